@@ -13,21 +13,25 @@
    DEEPSEEK_API_KEY=sk-your-actual-api-key-here
 
 3. UPDATE config/settings.py:
-   Add this line to your settings.py file:
-   DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
+   DEEPSEEK_API_KEY is read in settings.py and DeepSeek is registered in
+   AI_PROVIDERS, so projects/ai_service.py already routes to it (and fails
+   over between it and OpenRouter). This module is only needed for its
+   alternate prompts.
 
 =============================================================================
 """
 
-from openai import OpenAI
 from django.conf import settings
 import json
 import re
 
+from projects.json_extract import extract_json
+from projects.llm_clients import get_client
+
 class AIService:
     def __init__(self):
-        # 1. Initialize Client pointing strictly to DeepSeek Official API
-        self.client = OpenAI(
+        # 1. Shared pooled client pointing strictly to DeepSeek Official API
+        self.client = get_client(
             api_key=settings.DEEPSEEK_API_KEY,
             base_url="https://api.deepseek.com"
         )
@@ -55,13 +59,10 @@ class AIService:
     def repair_truncated_json(self, json_str):
         """
         Attempts to fix JSON that was cut off mid-stream.
+        Closes exactly the open strings/lists/objects (see json_extract.py).
         """
-        json_str = json_str.strip()
-        open_braces = json_str.count('{') - json_str.count('}')
-        open_brackets = json_str.count('[') - json_str.count(']')
-        json_str += ']' * open_brackets
-        json_str += '}' * open_braces
-        return json_str
+        value = extract_json(json_str).value
+        return json_str if value is None else json.dumps(value)
 
     def generate_blueprint(self, project_data):
         system_prompt = """
@@ -134,13 +135,12 @@ class AIService:
             )
             
             raw_content = response.choices[0].message.content
-            clean_text = self.clean_json_string(raw_content)
-            
-            try:
-                return json.loads(clean_text)
-            except json.JSONDecodeError:
-                repaired_text = self.repair_truncated_json(clean_text)
-                return json.loads(repaired_text)
+
+            # Single pass: skips <think>/fences and closes truncated output
+            blueprint = extract_json(raw_content).value
+            if not blueprint:
+                raise ValueError("No JSON object found in the AI response.")
+            return blueprint
 
         except Exception as e:
             return {"error": "DeepSeek Service Failed", "raw": str(e)}
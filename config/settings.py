@@ -68,6 +68,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / os.getenv('DATABASE_NAME', 'db.sqlite3'),
+        'OPTIONS': {
+            # Take the write lock at BEGIN (waiting up to `timeout` seconds) instead
+            # of failing with "database is locked" when a read turns into a write
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': int(os.getenv('SQLITE_TIMEOUT', 20)),
+        },
     }
 }
 
@@ -147,4 +153,158 @@ LOGIN_URL = 'login'
 # config/settings.py
 # GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
-# DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
\ No newline at end of file
+DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
+# AI response cache (projects/llm_cache.py)
+# Repeat prompts are served from an in-process LRU, then from the DB.
+AI_CACHE = {
+    'ENABLED': os.getenv('AI_CACHE_ENABLED', 'True') == 'True',
+    'TTL_SECONDS': int(os.getenv('AI_CACHE_TTL_SECONDS', 60 * 60 * 24 * 7)),
+    'MEMORY_MAX_ENTRIES': int(os.getenv('AI_CACHE_MEMORY_MAX_ENTRIES', 256)),
+    'DB_MAX_ENTRIES': int(os.getenv('AI_CACHE_DB_MAX_ENTRIES', 5000)),
+    'TOUCH_INTERVAL': int(os.getenv('AI_CACHE_TOUCH_INTERVAL', 60)),
+}
+
+# Background AI jobs (projects/jobs.py)
+# When True, generation views enqueue work and return immediately;
+# run `python manage.py run_ai_worker` to process the queue.
+AI_BACKGROUND_JOBS = os.getenv('AI_BACKGROUND_JOBS') == 'True'
+AI_JOBS = {
+    'LEASE_SECONDS': int(os.getenv('AI_JOBS_LEASE_SECONDS', 300)),
+    'MAX_ATTEMPTS': int(os.getenv('AI_JOBS_MAX_ATTEMPTS', 3)),
+    'RETRY_BACKOFF_SECONDS': int(os.getenv('AI_JOBS_RETRY_BACKOFF_SECONDS', 10)),
+    'POLL_INTERVAL': float(os.getenv('AI_JOBS_POLL_INTERVAL', 1.0)),
+    # Jobs still waiting after this long are dropped (nobody is polling any more)
+    'EXPIRE_AFTER': int(os.getenv('AI_JOBS_EXPIRE_AFTER', 900)),
+}
+
+# Max concurrent AI calls per provider, across all threads and processes
+# (projects/ratelimit.py); also sizes parallel fan-outs like "Generate All"
+AI_PROVIDER_CONCURRENCY = {
+    'openrouter': int(os.getenv('AI_OPENROUTER_CONCURRENCY', 4)),
+    'deepseek': int(os.getenv('AI_DEEPSEEK_CONCURRENCY', 8)),
+}
+
+# Shared HTTP connection pool for AI clients (projects/llm_clients.py)
+AI_HTTP_POOL = {
+    'MAX_CONNECTIONS': int(os.getenv('AI_HTTP_MAX_CONNECTIONS', 20)),
+    'MAX_KEEPALIVE_CONNECTIONS': int(os.getenv('AI_HTTP_MAX_KEEPALIVE', 10)),
+    'KEEPALIVE_EXPIRY': float(os.getenv('AI_HTTP_KEEPALIVE_EXPIRY', 60)),
+    'CONNECT_TIMEOUT': float(os.getenv('AI_HTTP_CONNECT_TIMEOUT', 10)),
+    'READ_TIMEOUT': float(os.getenv('AI_HTTP_READ_TIMEOUT', 120)),
+}
+
+# Directory for cross-process single-flight lock files (projects/singleflight.py)
+AI_LOCK_DIR = os.getenv('AI_LOCK_DIR', '')
+
+# AI providers, in order of preference (projects/providers.py)
+# Providers without an API key are skipped; the router sends each call to
+# the fastest healthy one and fails over to the rest.
+AI_PROVIDERS = [
+    {
+        'NAME': 'openrouter',
+        'BASE_URL': 'https://openrouter.ai/api/v1',
+        'API_KEY': OPENROUTER_API_KEY,
+        'MODEL': os.getenv('AI_OPENROUTER_MODEL', 'deepseek/deepseek-r1-0528:free'),
+        'HEADERS': {'HTTP-Referer': 'http://localhost:8000', 'X-Title': 'Apprompty'},
+    },
+    {
+        'NAME': 'deepseek',
+        'BASE_URL': 'https://api.deepseek.com',
+        'API_KEY': DEEPSEEK_API_KEY,
+        'MODEL': os.getenv('AI_DEEPSEEK_MODEL', 'deepseek-reasoner'),
+    },
+]
+# Local mock LLM for load tests (python manage.py run_mock_llm). When set it
+# replaces the real providers so benchmarks never spend provider quota.
+AI_MOCK_LLM_URL = os.getenv('AI_MOCK_LLM_URL', '')
+if AI_MOCK_LLM_URL:
+    AI_PROVIDERS = [
+        {'NAME': 'mock', 'BASE_URL': AI_MOCK_LLM_URL, 'API_KEY': 'mock', 'MODEL': 'mock-model'},
+    ]
+# Offline canned responses (local dev / tests); added after the real providers
+AI_STUB_PROVIDER = os.getenv('AI_STUB_PROVIDER') == 'True'
+AI_ROUTING = {
+    # Duplicate a call to the runner-up when the first provider is slower than its p95
+    'HEDGING': os.getenv('AI_ROUTING_HEDGING') == 'True',
+    'WINDOW': int(os.getenv('AI_ROUTING_WINDOW', 50)),
+    'MIN_SAMPLES': int(os.getenv('AI_ROUTING_MIN_SAMPLES', 5)),
+    'MAX_ERROR_RATE': float(os.getenv('AI_ROUTING_MAX_ERROR_RATE', 0.5)),
+    'HEDGE_DELAY_DEFAULT': float(os.getenv('AI_ROUTING_HEDGE_DELAY', 20)),
+}
+
+# Prompt context budget (projects/context.py)
+# Each prompt only gets the answers / blueprint keys it needs, compacted and
+# trimmed to this many tokens.
+AI_CONTEXT = {
+    'MAX_TOKENS': int(os.getenv('AI_CONTEXT_MAX_TOKENS', 2500)),
+}
+
+# Per-provider request rate (projects/ratelimit.py)
+# Calls queue (fairly per user) instead of bursting into 429s; a 429 pauses
+# the provider for every process for Retry-After / exponential backoff.
+AI_RATE_LIMITS = {
+    'openrouter': {'RPM': int(os.getenv('AI_OPENROUTER_RPM', 20))},
+    'deepseek': {'RPM': int(os.getenv('AI_DEEPSEEK_RPM', 300))},
+    'stub': {'RPM': 60000, 'MAX_IN_FLIGHT': 64},
+    'mock': {
+        'RPM': int(os.getenv('AI_MOCK_RPM', 6000)),
+        'MAX_IN_FLIGHT': int(os.getenv('AI_MOCK_CONCURRENCY', 32)),
+    },
+}
+
+# Speculative blueprint (projects/generation.py)
+# Locking the requirements starts the blueprint generation straight away;
+# "Generate" then reuses (or waits for) it instead of starting from zero.
+AI_SPECULATIVE_BLUEPRINT = {
+    'ENABLED': os.getenv('AI_SPECULATIVE_BLUEPRINT') == 'True',
+    'ATTACH_TIMEOUT': int(os.getenv('AI_SPECULATIVE_ATTACH_TIMEOUT', 180)),
+}
+
+# LLM call metrics (projects/metrics.py), exported at /metrics
+# Staff can read it in the browser; Prometheus sends the token as a Bearer header.
+AI_METRICS = {
+    'TOKEN': os.getenv('AI_METRICS_TOKEN', ''),
+    'ROLLUP_INTERVAL': int(os.getenv('AI_METRICS_ROLLUP_INTERVAL', 60)),  # Seconds; 0 = no DB history
+}
+
+# USD per million tokens, for the cost metric (models not listed count as free)
+AI_PRICING = {
+    'deepseek-chat': {'prompt': 0.27, 'cached_prompt': 0.07, 'completion': 1.10},
+    'deepseek/deepseek-chat': {'prompt': 0.27, 'cached_prompt': 0.07, 'completion': 1.10},
+    # Default model of the DeepSeek provider (AI_DEEPSEEK_MODEL)
+    'deepseek-reasoner': {'prompt': 0.55, 'cached_prompt': 0.14, 'completion': 2.19},
+}
+
+# Total time budget per AI operation in seconds (projects/deadlines.py),
+# covering queueing, retries and failover. What's left is each request's timeout.
+AI_DEADLINES = {
+    'blueprint': int(os.getenv('AI_DEADLINE_BLUEPRINT', 180)),
+    'doc_section': int(os.getenv('AI_DEADLINE_DOC_SECTION', 90)),
+    'task_guide': int(os.getenv('AI_DEADLINE_TASK_GUIDE', 90)),
+    'project_docs': int(os.getenv('AI_DEADLINE_PROJECT_DOCS', 240)),
+    'default': int(os.getenv('AI_DEADLINE_DEFAULT', 120)),
+}
+
+# Async AI views (projects/async_views.py): set when serving with an ASGI
+# server (e.g. `uvicorn config.asgi:application`). Generations are awaited
+# through AsyncOpenAI instead of holding a worker thread each.
+AI_ASYNC_VIEWS = os.getenv('AI_ASYNC_VIEWS') == 'True'
+
+# Blueprints, answers and doc sections are stored zlib-compressed
+# (projects/fields.py) when larger than THRESHOLD bytes.
+AI_COMPRESSION = {
+    'THRESHOLD': int(os.getenv('AI_COMPRESSION_THRESHOLD', 1024)),
+    'LEVEL': int(os.getenv('AI_COMPRESSION_LEVEL', 6)),
+}
+
+# SQLite pragmas and write handling (projects/sqlite.py). WAL lets reads run
+# alongside the writer; WRITE_QUEUE batches small writes on one thread.
+AI_SQLITE = {
+    'JOURNAL_MODE': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'SYNCHRONOUS': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'CACHE_SIZE_KB': int(os.getenv('SQLITE_CACHE_SIZE_KB', 65536)),
+    'MMAP_SIZE': int(os.getenv('SQLITE_MMAP_SIZE', 268435456)),
+    'BUSY_TIMEOUT_MS': int(os.getenv('SQLITE_TIMEOUT', 20)) * 1000,
+    'WRITE_RETRIES': int(os.getenv('SQLITE_WRITE_RETRIES', 5)),
+    'WRITE_QUEUE': os.getenv('SQLITE_WRITE_QUEUE') == 'True',
+}
@@ -28,6 +28,7 @@ urlpatterns = [
     path('accounts/', include('accounts.urls')),
     path('projects/', include('projects.urls')),
     path('api/projects/', include('projects.api_urls')),
+    path('metrics', views.llm_metrics, name='llm_metrics'),
 
     # 2. Add Documentation URLs
     path('api/docs/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
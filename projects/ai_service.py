@@ -1,19 +1,162 @@
-from openai import OpenAI
-from django.conf import settings
 import json
+import logging
 import re
+import time
+
+from asgiref.sync import sync_to_async
+
+from .constants import BLUEPRINT_SCHEMA
+from .context import build_context
+from .deadlines import deadline_for
+from .json_extract import ThinkStripper, extract_json
+from .llm_cache import response_cache, make_cache_key
+from . import metrics
+from .prompts import doc_section_prompt, get_prompt, prefix_cache
+from .providers import failed_provider, get_router
+from .streaming import BlueprintStreamParser
+
+logger = logging.getLogger(__name__)
 
 class AIService:
-    def __init__(self):
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=settings.OPENROUTER_API_KEY,
-            default_headers={
-                "HTTP-Referer": "http://localhost:8000",
-                "X-Title": "Apprompty",
-            }
+
+    def __init__(self, user=None):
+        # Calls go through the provider router (see providers.py): fastest
+        # healthy provider first, failover on errors, optional hedging
+        self.router = get_router()
+        # Sizes parallel fan-outs (generation.py); each call's provider is picked by the router
+        self.provider = self.router.primary.name
+        # Who the calls are for: the rate limiter queues users round-robin
+        self.user = user
+
+    def _complete(self, messages, temperature, max_tokens=None, use_cache=True, validate=None, prompt=None):
+        """
+        Single entry point for chat completions.
+        Serves repeats from the response cache; use_cache=False skips the
+        lookup (e.g. "Regenerate") but still refreshes the stored entry.
+        `validate` (optional) must return True for a response to be cached.
+        `prompt` (the PromptTemplate used) versions the cache key.
+        """
+        prompt_name = prompt.name if prompt else 'adhoc'
+        keys = self._cache_keys(messages, temperature, max_tokens, prompt)
+        if use_cache:
+            cached = response_cache.get_any(list(keys.values()))
+            if cached is not None:
+                metrics.record_cache_hit(prompt_name)
+                return cached
+
+        params = self._params(messages, temperature, max_tokens, prompt)
+
+        timer = metrics.CallTimer()
+        try:
+            provider, response = self.router.complete(user=self.user, deadline=deadline_for(prompt_name), **params)
+        except Exception as e:
+            self._record_failure(params, prompt_name, timer, e)
+            raise
+        content = self._record_response(provider, response, prompt_name, timer)
+        if validate is None or validate(content):
+            model = self._answered_by(provider, params)
+            response_cache.set(keys[model], content, model=model)
+        return content
+
+    async def _acomplete(self, messages, temperature, max_tokens=None, use_cache=True, validate=None, prompt=None):
+        """
+        Async _complete() for the ASGI views: the provider request is
+        awaited (AsyncOpenAI); cache reads / writes run via sync_to_async.
+        """
+        prompt_name = prompt.name if prompt else 'adhoc'
+        keys = self._cache_keys(messages, temperature, max_tokens, prompt)
+        if use_cache:
+            cached = await sync_to_async(response_cache.get_any)(list(keys.values()))
+            if cached is not None:
+                metrics.record_cache_hit(prompt_name)
+                return cached
+
+        params = self._params(messages, temperature, max_tokens, prompt)
+
+        timer = metrics.CallTimer()
+        try:
+            provider, response = await self.router.acomplete(user=self.user, deadline=deadline_for(prompt_name), **params)
+        except Exception as e:
+            self._record_failure(params, prompt_name, timer, e)
+            raise
+        content = self._record_response(provider, response, prompt_name, timer)
+        if validate is None or validate(content):
+            model = self._answered_by(provider, params)
+            await sync_to_async(response_cache.set)(keys[model], content, model=model)
+        return content
+
+    def _record_response(self, provider, response, prompt_name, timer):
+        """
+        Metrics + prefix-cache stats for a finished completion; returns its text.
+        """
+        usage = getattr(response, 'usage', None)
+        metrics.record_call(
+            provider.name, getattr(response, 'model', None) or provider.model, prompt_name, timer.elapsed,
+            usage=usage, finish_reason=response.choices[0].finish_reason,
+        )
+        prefix_cache.record(prompt_name, usage)
+        return response.choices[0].message.content or ''
+
+    def _record_failure(self, params, prompt_name, timer, error):
+        """
+        Metrics for a call that failed on every provider it tried,
+        attributed to the last of them.
+        """
+        provider = failed_provider(error) or self.router.primary
+        metrics.record_call(provider.name, params.get('model') or provider.model, prompt_name, timer.elapsed, error=error)
+
+    def _cache_keys(self, messages, temperature, max_tokens=None, prompt=None):
+        """
+        {model: cache key} for every model that may answer, in routing
+        order. Entries are keyed on the model that answered, so a
+        failover answer is never served as another model's.
+        """
+        if prompt is not None and prompt.model:
+            models = [prompt.model]  # Forced on every provider
+        else:
+            models = dict.fromkeys(provider.model for provider in self.router.ranked())
+        return {
+            model: make_cache_key(
+                model, messages, temperature, max_tokens,
+                version=prompt.fingerprint if prompt else None,
+            )
+            for model in models
+        }
+
+    @staticmethod
+    def _answered_by(provider, params):
+        return params.get('model') or provider.model
+
+    def _params(self, messages, temperature, max_tokens=None, prompt=None):
+        params = {'messages': messages, 'temperature': temperature}
+        if max_tokens:
+            params['max_tokens'] = max_tokens
+        if prompt is not None and prompt.model:
+            params['model'] = prompt.model
+        return params
+
+    def _run_prompt(self, prompt, use_cache=True, validate=None, **fields):
+        """
+        Renders a registered template and completes it with its defaults.
+        """
+        return self._complete(
+            messages=prompt.render(**fields),
+            temperature=prompt.temperature,
+            max_tokens=prompt.max_tokens,
+            use_cache=use_cache,
+            validate=validate,
+            prompt=prompt,
+        )
+
+    async def _arun_prompt(self, prompt, use_cache=True, validate=None, **fields):
+        return await self._acomplete(
+            messages=prompt.render(**fields),
+            temperature=prompt.temperature,
+            max_tokens=prompt.max_tokens,
+            use_cache=use_cache,
+            validate=validate,
+            prompt=prompt,
         )
-        self.model = "deepseek/deepseek-r1-0528:free" 
 
     def clean_json_string(self, text):
         """
@@ -33,316 +176,260 @@ class AIService:
         """
         Attempts to fix JSON that was cut off mid-stream.
         This is critical for free-tier models with low token limits.
+        The extractor tracks strings and nesting, so it closes exactly
+        the structures that are open (braces inside text don't count).
         """
-        json_str = json_str.strip()
-        
-        # Simple heuristic: Balance braces/brackets
-        open_braces = json_str.count('{') - json_str.count('}')
-        open_brackets = json_str.count('[') - json_str.count(']')
-        
-        # Append missing closing characters
-        # We generally close lists first, then objects
-        json_str += ']' * open_brackets
-        json_str += '}' * open_braces
-        
-        return json_str
+        value = extract_json(json_str).value
+        return json_str if value is None else json.dumps(value)
 
-    def generate_blueprint(self, project_data):
-        # UPDATED PROMPT: Richer, Professional, Specific
-        system_prompt = """
-        ACT AS: A Senior Principal Software Architect.
-        TASK: Generate a high-fidelity technical blueprint in JSON.
-        
-        CRITICAL INSTRUCTIONS:
-        1. CUSTOMIZATION: Use the INPUT REQUIREMENTS strictly. If they asked for "Video Streaming", include "FFmpeg" or "HLS" in the backend.
-        2. SPECIFICITY: Do not say "Database". Say "PostgreSQL 16" or "MongoDB". Do not say "Auth". Say "JWT via SimpleJWT".
-        3. JSON FORMAT: Output valid JSON only. No markdown.
-        4. LIMITS: Max 6 items per list (to prevent timeouts). Keep descriptions professional.
+    def extract_blueprint(self, raw_content):
+        """
+        Single pass over the raw completion: skips <think>/fences, parses,
+        closes truncated structures and checks BLUEPRINT_SCHEMA.
         """
+        return extract_json(raw_content, schema=BLUEPRINT_SCHEMA)
 
-        user_content = f"""
-        USER PROJECT REQUIREMENTS:
-        {json.dumps(project_data, indent=2)}
-
-        REQUIRED JSON OUTPUT STRUCTURE:
-        {{
-            "overview": "2-sentence executive technical summary.",
-            "architecture": {{
-                "style": "e.g. Event-Driven Microservices / Modular Monolith",
-                "diagram_description": "A clear description of how data flows from user to DB."
-            }},
-            "frontend": {{
-                "framework": "Specific Framework & Version",
-                "structure": ["/src/features", "/src/shared", "/src/app"],
-                "state_management": "Specific Library",
-                "ui_library": "e.g. Tailwind / ShadCN / MUI"
-            }},
-            "backend": {{
-                "framework": "Specific Framework",
-                "database": "Specific Database Engine",
-                "models": ["List of core domain entities (e.g. User, Subscription)"],
-                "services": ["List of distinct logic layers (e.g. PaymentService, VideoTranscoder)"]
-            }},
-            "api": {{
-                "style": "REST / GraphQL",
-                "endpoints": ["List of 5 critical high-level endpoints"]
-            }},
-            "phases": [
-                {{ "phase": 1, "title": "Foundation", "tasks": ["3 specific setup tasks"] }},
-                {{ "phase": 2, "title": "Core Logic", "tasks": ["3 specific coding tasks"] }},
-                {{ "phase": 3, "title": "Polish & Ship", "tasks": ["3 specific finishing tasks"] }}
-            ]
-        }}
+    def parse_blueprint(self, raw_content, extraction=None):
         """
+        Raw completion -> blueprint dict. Raises ValueError if unparseable.
+        Partial (truncated) blueprints are accepted; gaps are logged.
+        """
+        extraction = extraction or self.extract_blueprint(raw_content)
+        if not isinstance(extraction.value, dict) or not extraction.value:
+            raise ValueError("No JSON object found in the AI response.")
+
+        if extraction.truncated or extraction.missing or extraction.mismatched:
+            logger.warning(
+                f"Partial blueprint (truncated={extraction.truncated}) "
+                f"missing={extraction.missing} mismatched={extraction.mismatched}"
+            )
+        return extraction.value
+
+    def blueprint_messages(self, project_data):
+        # Shared by generate_blueprint and stream_blueprint so both hit the same cache key
+        context = build_context('blueprint', requirements=project_data)
+        return get_prompt('blueprint').render(requirements=context.requirements)
+
+    def generate_blueprint(self, project_data, use_cache=True):
+        extraction = {}
+
+        def is_complete(raw_content):
+            # Parse once here and reuse below; only complete JSON is cached
+            extraction['result'] = self.extract_blueprint(raw_content)
+            return extraction['result'].complete
 
         try:
-            # Using a slightly higher temperature for creativity, but low enough for valid JSON
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_content},
-                ],
-                temperature=0.2, 
-                max_tokens=3500,
+            prompt = get_prompt('blueprint')
+            raw_content = self._complete(
+                messages=self.blueprint_messages(project_data),
+                temperature=prompt.temperature,
+                max_tokens=prompt.max_tokens,
+                use_cache=use_cache,
+                validate=is_complete,
+                prompt=prompt,
             )
-            
-            raw_content = response.choices[0].message.content
-            clean_text = self.clean_json_string(raw_content)
-            
-            try:
-                return json.loads(clean_text)
-            except json.JSONDecodeError:
-                # Fallback repair if it gets cut off
-                repaired = self.repair_truncated_json(clean_text)
-                return json.loads(repaired)
+            return self.parse_blueprint(raw_content, extraction.get('result'))
 
         except Exception as e:
             return {"error": "Blueprint Generation Failed", "raw": str(e)}
-    def generate_task_guide(self, project_context, current_task):
-        system_prompt = """
-        ACT AS: A Senior Lead Developer.
-        TASK: Write a step-by-step implementation guide.
-        CONTEXT: Extremely explicit code for a Junior Developer.
-        
-        OUTPUT FORMAT (Markdown):
-        ## Goal
-        1-sentence summary.
-        
-        ### 1. Terminal
-        `pip install ...`
-        
-        ### 2. Code
-        **File: path/to/file.py**
-        ```python
-        # Code here
-        ```
+
+    async def agenerate_blueprint(self, project_data, use_cache=True):
+        extraction = {}
+
+        def is_complete(raw_content):
+            extraction['result'] = self.extract_blueprint(raw_content)
+            return extraction['result'].complete
+
+        try:
+            prompt = get_prompt('blueprint')
+            raw_content = await self._acomplete(
+                messages=self.blueprint_messages(project_data),
+                temperature=prompt.temperature,
+                max_tokens=prompt.max_tokens,
+                use_cache=use_cache,
+                validate=is_complete,
+                prompt=prompt,
+            )
+            return self.parse_blueprint(raw_content, extraction.get('result'))
+
+        except Exception as e:
+            return {"error": "Blueprint Generation Failed", "raw": str(e)}
+
+    def stream_blueprint(self, project_data, use_cache=True, keepalive=None):
         """
-        
-        user_content = f"""
-        CONTEXT: {json.dumps(project_context)}
-        TASK: "{current_task}"
+        Streaming variant of generate_blueprint.
+        Yields (key, value) for each top-level blueprint key as soon as it
+        is complete. Errors propagate to the caller.
+        With `keepalive` (seconds), also yields (None, None) that often
+        while tokens arrive, so the caller can write to its client and
+        notice a disconnect; closing this generator closes the provider
+        stream.
         """
+        prompt = get_prompt('blueprint')
+        messages = self.blueprint_messages(project_data)
+        keys = self._cache_keys(messages, prompt.temperature, prompt.max_tokens, prompt)
+
+        # 1. Cache hit: replay the stored blueprint key by key
+        if use_cache:
+            cached = response_cache.get_any(list(keys.values()))
+            if cached is not None:
+                metrics.record_cache_hit(prompt.name)
+                yield from self.parse_blueprint(cached).items()
+                return
 
+        # 2. Stream from the provider, parsing as we go
+        stripper = ThinkStripper()
+        parser = BlueprintStreamParser(schema=BLUEPRINT_SCHEMA)
+        params = self._params(messages, prompt.temperature, prompt.max_tokens, prompt)
+        deadline = deadline_for(prompt.name)
+        timer = metrics.CallTimer()
+        # Failover applies to opening the stream; hedging doesn't (one stream per call)
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_content},
-                ],
-                temperature=0.3,
+            provider, stream = self.router.complete(
+                user=self.user,
+                deadline=deadline,
+                stream=True,
+                # Final chunk carries usage (incl. cached prompt tokens)
+                stream_options={'include_usage': True},
+                **params,
+            )
+        except Exception as e:
+            self._record_failure(params, prompt.name, timer, e)
+            raise
+
+        usage = finish_reason = error = None
+        model = provider.model
+        last_yield = time.monotonic()
+        try:
+            for chunk in stream:
+                # The HTTP timeout only bounds each read; this bounds the total
+                deadline.check()
+                model = getattr(chunk, 'model', None) or model
+                if getattr(chunk, 'usage', None):
+                    usage = chunk.usage
+                    prefix_cache.record(prompt.name, chunk.usage)
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                if parser.finished:
+                    continue  # After the JSON closes, only drain for usage
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                timer.first_token()
+                sections = parser.feed(stripper.feed(delta))
+                if sections:
+                    last_yield = time.monotonic()
+                    yield from sections
+                elif keepalive and time.monotonic() - last_yield >= keepalive:
+                    last_yield = time.monotonic()
+                    yield None, None
+        except GeneratorExit:
+            finish_reason = 'cancelled'  # Client went away mid-stream
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            stream.close()
+            metrics.record_call(
+                provider.name, model, prompt.name, timer.elapsed,
+                usage=usage, finish_reason=finish_reason, ttft=timer.ttft, error=error,
             )
-            return response.choices[0].message.content
-            
+
+        yield from parser.close()
+
+        # 3. Store the parsed result (not the raw text) for future hits
+        if parser.complete:
+            model = self._answered_by(provider, params)
+            response_cache.set(keys[model], json.dumps(parser.result), model=model)
+
+    def task_guide_fields(self, project_context, current_task):
+        context = build_context('task_guide', blueprint=project_context, legacy_indent=None)
+        return {'context': context.blueprint, 'task': current_task}
+
+    def generate_task_guide(self, project_context, current_task, use_cache=True, raise_errors=False):
+        try:
+            return self._run_prompt(
+                get_prompt('task_guide'),
+                use_cache=use_cache,
+                **self.task_guide_fields(project_context, current_task),
+            )
+
+        except Exception as e:
+            if raise_errors:
+                raise
+            return f"AI Error: {str(e)}"
+
+    async def agenerate_task_guide(self, project_context, current_task, use_cache=True, raise_errors=False):
+        try:
+            return await self._arun_prompt(
+                get_prompt('task_guide'),
+                use_cache=use_cache,
+                **self.task_guide_fields(project_context, current_task),
+            )
+
         except Exception as e:
+            if raise_errors:
+                raise
             return f"AI Error: {str(e)}"
 
-    def generate_project_docs(self, project_context):
+    def generate_project_docs(self, project_context, use_cache=True):
         """
         Generates a Strategic Project Guide (Stored in DB).
         """
-        system_prompt = """
-        ACT AS: A Senior CTO and Product Manager.
-        TASK: Write a comprehensive Strategic Master Plan and Setup Guide.
-        
-        CRITICAL RULES:
-        1. DO NOT WRITE CODE. (No Python classes, no React components, no function bodies).
-        2. FOCUS ON: Architecture, Data Strategy, UI/UX Guidelines, and Best Practices.
-        3. PROVIDE: "Terminal Commands" only for project initialization (pip install, etc).
-        4. TONE: Professional, guiding, authoritative.
-        """
-        
-        user_content = f"""
-        PROJECT BLUEPRINT:
-        {json.dumps(project_context, indent=2)}
-        
-        Please generate a master markdown document with these exact sections:
-
-        # 1. Executive Summary
-        - Project Vision & Success Criteria.
-        - The "Why" behind the architecture choices.
-
-        # 2. Master Setup Guide (Terminal Only)
-        - Step-by-step shell commands to initialize this specific tech stack.
-        - Dependency installation guide.
-
-        # 3. Backend Strategy (Conceptual)
-        - Database Schema Rules (Explain relationships, don't write SQL).
-        - API Design Patterns (REST vs GraphQL strategy).
-        - Security & Scalability requirements.
-
-        # 4. Frontend & UI/UX Guidelines
-        - Component Hierarchy (Explain the folder structure).
-        - State Management Strategy (When to use Redux/Context).
-        - UI Polishing Guide (Typography, Spacing, Accessibility rules).
-
-        # 5. The "Phase 8" (Post-Setup Lifecycle)
-        - Testing Strategy (What to test and how).
-        - Deployment Pipeline (CI/CD recommendations).
-        - Maintenance Checklist (Logging, Monitoring).
-        """
-
+        context = build_context(
+            'project_docs',
+            requirements=project_context.get('original_requirements'),
+            blueprint=project_context.get('blueprint'),
+        )
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_content},
-                ],
-                temperature=0.3,
+            content = self._run_prompt(
+                get_prompt('project_docs'),
+                use_cache=use_cache,
+                blueprint=context.blueprint,
+                requirements=context.requirements,
             )
-            return self.clean_json_string(response.choices[0].message.content)
-            
+            return self.clean_json_string(content)
+
         except Exception as e:
             return f"Documentation Error: {str(e)}"
 
-# projects/ai_service.py
-# ... imports ...
-
-    def generate_doc_section(self, project_context, section_key):
+    def generate_doc_section(self, project_context, section_key, use_cache=True, raise_errors=False):
         """
         Generates granular, high-value documentation sections.
+        One registered template per tab (see prompts.py); unknown keys
+        fall back to the overview.
         """
-        
-        # 1. Define 8 Specialized Prompts
-        prompts = {
-            'overview': """
-                TASK: Write the 'Executive Vision & Project Plan'.
-                CONTEXT: The user wants to build a specific app described in the inputs.
-                OUTPUT SECTIONS:
-                - **The Core Concept**: A pitch-perfect summary of what we are building.
-                - **Target Audience**: Who is this for?
-                - **Success Metrics**: What defines 'done'?
-                - **The "Vibe"**: Describe the feeling/experience of the app.
-            """,
-            'features': """
-                TASK: Write the 'Platform Feature Specification'.
-                CONTEXT: Based on the user's intent, list the concrete features.
-                OUTPUT SECTIONS:
-                - **User Stories**: "As a user, I can..." list.
-                - **Core Modules**: The main functional blocks (e.g., Auth, Payments, Dashboards).
-                - **Edge Cases**: Specific tricky scenarios to handle.
-                - **MVP Scope**: What features are essential for version 1.0 vs later.
-            """,
-            'backend': """
-                TASK: Write the 'Backend Architecture Strategy'.
-                CONTEXT: Use the specific backend tech selected by the user (Django/Node/etc).
-                OUTPUT SECTIONS:
-                - **Tech Stack**: Justify the choice of framework & tools.
-                - **Server Architecture**: Monolith vs Microservices decision & reasoning.
-                - **Directory Structure**: ASCII tree of the backend folder.
-                - **Key Libraries**: List of essential packages (e.g., DRF, Celery, Stripe).
-            """,
-           'database': """
-                TASK: Write the 'Database Schema' as SQL Code.
-                CONTEXT: The user needs to copy-paste this to create their database.
-                
-                CRITICAL RULE: 
-                - DO NOT use text descriptions or XML. 
-                - OUTPUT ONLY A VALID SQL SCRIPT inside a markdown code block.
-                
-                OUTPUT SECTIONS:
-                1. **ER Diagram Summary** (2 sentences text).
-                2. **The SQL Schema**:
-                ```sql
-                CREATE TABLE users (
-                    id INTEGER PRIMARY KEY,
-                    ...
-                );
-                ```
-            """,
-            'frontend': """
-                TASK: Write the 'Frontend Engineering Guide'.
-                CONTEXT: Use the user's chosen frontend framework (React/Vue/etc).
-                OUTPUT SECTIONS:
-                - **Component Architecture**: How to split the UI (Atoms/Molecules).
-                - **State Management**: Strategy (Redux/Zustand/Context).
-                - **Routing Strategy**: List of main client-side routes.
-                - **Folder Structure**: ASCII tree of the frontend `src` folder.
-            """,
-            'ui_ux': """
-                TASK: Write the 'UI/UX & Skills.md Guide'.
-                CONTEXT: Create a 'cursor rules' style guide for the AI coder.
-                OUTPUT SECTIONS:
-                - **Design System**: Colors, Typography, Spacing variables.
-                - **Component Rules**: Rules for writing clean UI code (e.g., "Use functional components").
-                - **Accessibility**: ARIA labels and contrast rules.
-                - **The "Skills.md"**: A distinct block of rules to copy-paste into an AI editor.
-            """,
-            'api': """
-                TASK: Write the 'API Specification'.
-                CONTEXT: Define the communication layer.
-                OUTPUT SECTIONS:
-                - **Authentication Flow**: How login/token refresh works.
-                - **Endpoints List**: Grouped by resource (Auth, Users, Products).
-                - **Request/Response Examples**: JSON snippets for key endpoints.
-                - **Error Handling**: Standard error codes (400 vs 401 vs 403).
-            """,
-            'setup': """
-                TASK: Write the 'Master Terminal Setup Guide'.
-                CONTEXT: The exact commands to boot this from zero.
-                OUTPUT SECTIONS:
-                - **Prerequisites**: Node/Python versions.
-                - **Step 1: Backend Init**: `django-admin startproject` etc.
-                - **Step 2: Frontend Init**: `npm create vite@latest` etc.
-                - **Step 3: Environment**: `.env.example` file content.
-                - **Step 4: Running It**: Command to start both servers.
-            """
-        }
-
-        # 2. Get the specific prompt (Default to overview if missing)
-        specific_instruction = prompts.get(section_key, prompts['overview'])
+        prompt, fields = self.doc_section_fields(project_context, section_key)
+        try:
+            content = self._run_prompt(prompt, use_cache=use_cache, **fields)
+            return self.clean_json_string(content)
 
-        system_prompt = f"""
-        ACT AS: A World-Class Software Architect for "Vibecoders".
-        YOUR GOAL: Create specific, actionable, high-quality documentation.
-        AVOID: Generic fluff. Do not say "Use a database". Say "Use PostgreSQL because..."
-        
-        {specific_instruction}
-        
-        CRITICAL: Output valid Markdown.
-        """
-        
-        # We include the User's specific answers to ensure it's CUSTOM
-        user_content = f"""
-        PROJECT CONTEXT (The User's specific answers):
-        {json.dumps(project_context.get('requirements', {}), indent=2)}
-        
-        AI BLUEPRINT (Draft):
-        {json.dumps(project_context.get('blueprint', {}), indent=2)}
-        """
+        except Exception as e:
+            if raise_errors:
+                raise
+            return f"Error generating section: {str(e)}"
 
+    async def agenerate_doc_section(self, project_context, section_key, use_cache=True, raise_errors=False):
+        prompt, fields = self.doc_section_fields(project_context, section_key)
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_content},
-                ],
-                temperature=0.3, 
-            )
-            return self.clean_json_string(response.choices[0].message.content)
-            
+            content = await self._arun_prompt(prompt, use_cache=use_cache, **fields)
+            return self.clean_json_string(content)
+
         except Exception as e:
-            return f"Error generating section: {str(e)}"
\ No newline at end of file
+            if raise_errors:
+                raise
+            return f"Error generating section: {str(e)}"
+
+    def doc_section_fields(self, project_context, section_key):
+        """
+        -> (template, fields) with only the answers / blueprint keys this section needs.
+        """
+        prompt = doc_section_prompt(section_key)
+        context = build_context(
+            prompt.name,
+            requirements=project_context.get('requirements'),
+            blueprint=project_context.get('blueprint'),
+        )
+        return prompt, {'requirements': context.requirements, 'blueprint': context.blueprint}
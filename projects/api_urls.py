@@ -1,10 +1,17 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .api_views import ProjectViewSet
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'', ProjectViewSet, basename='project')
 
 urlpatterns = [
     path('', include(router.urls)),
-]
\ No newline at end of file
+]
+
+# DRF views can't be async: under ASGI, `generate` is served by a plain
+# async view (same auth and responses) placed ahead of the router
+if getattr(settings, 'AI_ASYNC_VIEWS', False):
+    urlpatterns.insert(0, path('<uuid:pk>/generate/', async_views.api_generate, name='project-generate-async'))
\ No newline at end of file
@@ -2,33 +2,98 @@ import uuid
 from rest_framework import viewsets, filters, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from .models import Project
-from .serializers import ProjectSerializer
-from .ai_service import AIService
+from .serializers import ProjectListSerializer, ProjectSerializer
 from .questions import QUESTION_BANK
 from rest_framework.decorators import action
 from rest_framework import status
-from .engine import FlowEngine
+from .engine import ConflictError, FlowEngine
 from .serializers import ProjectSerializer, AnswerInputSerializer
+from .streaming import blueprint_event_stream
+from .models import AIJob
+from .pagination import KeysetPagination
+from . import generation, jobs
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+
+def conflict_response(error):
+    # 409 + the version to re-read from
+    return Response({'error': str(error), 'version': error.current_version}, status=status.HTTP_409_CONFLICT)
+
 
 class ProjectViewSet(viewsets.ModelViewSet):
     serializer_class = ProjectSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
     
     # Enable API search (?search=name) and ordering (?ordering=-created_at)
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description']
     ordering_fields = ['updated_at', 'status']
 
+    # Serializer field -> model column it reads
+    FIELD_SOURCES = {'status_display': 'status', 'phase_display': 'current_phase'}
+
     def get_queryset(self):
         # STRICT: Users can only see their own projects
-        return Project.objects.filter(user=self.request.user)
+        queryset = Project.objects.filter(user=self.request.user)
+
+        # Reads load only the columns they return
+        if self.action in ('list', 'retrieve'):
+            fields = self.requested_fields()
+            if fields is not None:
+                columns = {self.FIELD_SOURCES.get(name, name) for name in fields}
+                # Plus the sort columns, which the paginator reads for its cursors
+                queryset = queryset.only('id', *self.ordering_fields, *columns)
+            elif self.action == 'list':
+                queryset = queryset.without_blobs()
+        return queryset
+
+    def requested_fields(self):
+        """
+        The ?fields=name,status sparse fieldset (None if not given).
+        """
+        raw = self.request.query_params.get('fields')
+        if not raw:
+            return None
+        fields = [name.strip() for name in raw.split(',') if name.strip()]
+        unknown = sorted(set(fields) - set(ProjectSerializer.Meta.fields))
+        if unknown:
+            raise ValidationError({'fields': [f"Unknown field: {name}" for name in unknown]})
+        return fields
+
+    def get_serializer_class(self):
+        if self.action == 'list' and self.requested_fields() is None:
+            return ProjectListSerializer
+        return super().get_serializer_class()
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in ('list', 'retrieve'):
+            kwargs.setdefault('fields', self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
 
     def perform_create(self, serializer):
         # STRICT: Force the user to be the current logged-in user
         serializer.save(user=self.request.user)
 
+    def update(self, request, *args, **kwargs):
+        try:
+            return super().update(request, *args, **kwargs)
+        except ConflictError as e:
+            return conflict_response(e)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def perform_update(self, serializer):
+        # Compare-and-swap like the flow actions, against the version the
+        # client sent (or the one just read): serializer.save() would write
+        # every column back over answers saved in the meantime
+        FlowEngine(serializer.instance).save_fields(
+            serializer.validated_data, expected_version=self.request.data.get('version'),
+        )
+
     @action(detail=True, methods=['post'])
     def duplicate(self, request, pk=None):
         """
@@ -36,6 +101,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
         POST /api/projects/{uuid}/duplicate/
         """
         original_project = self.get_object()
+        source_id = original_project.pk
         
         # 1. Create a memory copy of the object
         original_project.pk = None 
@@ -47,8 +113,9 @@ class ProjectViewSet(viewsets.ModelViewSet):
         original_project.status = 'draft' # Reset status
         original_project.current_phase = 0 # Reset phase
         
-        # 3. Save as new record
+        # 3. Save as new record (docs are rows of their own)
         original_project.save()
+        generation.copy_doc_sections(source_id, original_project)
         
         # 4. Return the new data
         serializer = self.get_serializer(original_project)
@@ -80,9 +147,13 @@ class ProjectViewSet(viewsets.ModelViewSet):
             try:
                 new_state = engine.submit_answer(
                     stage=serializer.validated_data['stage'],
-                    data=serializer.validated_data['answer_data']
+                    data=serializer.validated_data['answer_data'],
+                    expected_version=serializer.validated_data.get('version'),
                 )
-                return Response(new_state, status=status.HTTP_200_OK)
+                generation.discard_speculation(project)
+                return Response({**new_state, 'version': project.version}, status=status.HTTP_200_OK)
+            except ConflictError as e:
+                return conflict_response(e)
             except ValueError as e:
                 # Engine detected sequence violation
                 return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -124,8 +195,11 @@ class ProjectViewSet(viewsets.ModelViewSet):
         engine = FlowEngine(project)
         
         try:
-            engine.lock_requirements()
-            return Response({'status': 'locked', 'next_phase': 6, 'message': 'Ready for Gemini'})
+            engine.lock_requirements(expected_version=request.data.get('version'))
+            jobs.speculate_blueprint(project)
+            return Response({'status': 'locked', 'next_phase': 6, 'message': 'Ready for Gemini', 'version': project.version})
+        except ConflictError as e:
+            return conflict_response(e)
         except ValueError as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -134,28 +208,46 @@ class ProjectViewSet(viewsets.ModelViewSet):
         """
         POST /api/projects/{uuid}/generate/
         Triggers Gemini.
+        POST /api/projects/{uuid}/generate/?stream=true
+        Streams each blueprint section as a Server-Sent Event.
         """
         project = self.get_object()
+
+        if request.query_params.get('stream') in ('1', 'true'):
+            response = StreamingHttpResponse(blueprint_event_stream(project), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
         
         # Security: Only allow generation if phase is correct
         if project.current_phase != 6: # Ensure we are in Phase 6
              # (Optional) enforce stricter checks here
              pass
 
-        # 1. Prepare Data
-        requirements = project.requirements_data.get('answers', {})
-        
-        # 2. Call AI
-        ai = AIService()
-        blueprint = ai.generate_blueprint(requirements)
+        # 1. Background mode: 202 + job to poll
+        if jobs.background_jobs_enabled():
+            blueprint = generation.adopt_speculative_blueprint(project, wait=False)
+            if blueprint:
+                return Response(blueprint)
+            job = jobs.enqueue(project, 'blueprint')
+            return Response(jobs.describe_job(job), status=status.HTTP_202_ACCEPTED)
+
+        # 2. Call AI (saves to DB on success)
+        blueprint = generation.generate_blueprint(project)
         
+        if blueprint.get("error") == generation.BLUEPRINT_CONFLICT:
+            return Response(blueprint, status=status.HTTP_409_CONFLICT)
         if "error" in blueprint:
             return Response(blueprint, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # 3. Save to DB
-        project.blueprint_data = blueprint
-        project.status = 'blueprint_ready'
-        project.current_phase = 7 # Move to Execution Guide
-        project.save()
+        return Response(blueprint)
 
-        return Response(blueprint)
\ No newline at end of file
+    @action(detail=True, methods=['get'], url_path=r'jobs/(?P<job_id>[0-9a-f-]+)', url_name='job-status')
+    def job_status(self, request, pk=None, job_id=None):
+        """
+        GET /api/projects/{uuid}/jobs/{job_id}/
+        Status (and result, once finished) of a background AI job.
+        """
+        project = self.get_object()
+        job = get_object_or_404(AIJob, pk=job_id, project=project)
+        return Response(jobs.describe_job(job))
\ No newline at end of file
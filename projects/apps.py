@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class ProjectsConfig(AppConfig):
     name = 'projects'
+
+    def ready(self):
+        from .sqlite import configure_connection
+        connection_created.connect(configure_connection, dispatch_uid='projects.sqlite.configure_connection')
@@ -0,0 +1,231 @@
+"""
+Async versions of the AI views, for serving under ASGI
+(`uvicorn config.asgi:application`).
+
+They await the provider through AsyncOpenAI instead of blocking a
+thread for the whole completion, so one worker can keep many
+generations in flight (up to the per-provider limits). Routed instead
+of the sync views when settings.AI_ASYNC_VIEWS is on; the sync views
+stay in place for WSGI.
+
+The SSE endpoints return async iterators (streaming.aiter_events):
+Django would read a sync one to the end before sending anything.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, redirect, render
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import PermissionDenied
+
+from .models import AIJob, Project
+from .streaming import aiter_events, blueprint_event_stream, doc_sections_event_stream
+from . import generation, jobs
+
+logger = logging.getLogger(__name__)
+
+
+async def _own_project(request, pk):
+    user = await request.auser()
+    return await aget_object_or_404(Project, pk=pk, user=user)
+
+
+def _event_stream_response(make_events, *args, **kwargs):
+    # An async iterator: Django sends each frame as it comes
+    response = StreamingHttpResponse(aiter_events(make_events, *args, **kwargs), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+    return response
+
+
+@login_required
+async def project_generate(request, pk):
+    """
+    Phase 6: The AI Trigger (async)
+    """
+    project = await _own_project(request, pk)
+
+    if request.method == 'POST':
+        # 1. Background mode: queue it and let the page poll the job
+        if jobs.background_jobs_enabled():
+            if await sync_to_async(generation.adopt_speculative_blueprint)(project, wait=False):
+                messages.success(request, "Blueprint Architected Successfully!")
+                return redirect('project_blueprint', pk=pk)
+            job = await sync_to_async(jobs.enqueue)(project, 'blueprint')
+            return redirect(f"{reverse('project_generate', args=[pk])}?job={job.pk}")
+
+        # 2. Call the AI (awaited), saves on success
+        blueprint = await generation.agenerate_blueprint(project)
+
+        if blueprint.get('error') == generation.BLUEPRINT_CONFLICT:
+            messages.error(request, blueprint['raw'])
+            return redirect('project_summary', pk=pk)
+        if 'error' in blueprint:
+            messages.error(request, f"AI Error: {blueprint['raw']}")
+            return redirect('project_generate', pk=pk)
+
+        messages.success(request, "Blueprint Architected Successfully!")
+        return redirect('project_blueprint', pk=pk)
+
+    job = None
+    if request.GET.get('job'):
+        job = await AIJob.objects.filter(pk=request.GET['job'], project=project).afirst()
+
+    return await sync_to_async(render)(request, 'projects/generate.html', {
+        'project': project,
+        'job': jobs.describe_job(job) if job else None,
+        'background_jobs': jobs.background_jobs_enabled(),
+    })
+
+
+@login_required
+@require_POST
+async def project_generate_stream(request, pk):
+    """
+    Phase 6 (streaming, async): blueprint sections as SSE events.
+    """
+    project = await _own_project(request, pk)
+    return _event_stream_response(blueprint_event_stream, project)
+
+
+@login_required
+@require_POST
+async def get_task_help(request, pk):
+    """
+    AJAX Endpoint: Returns AI code for a specific task (async).
+    """
+    try:
+        project = await _own_project(request, pk)
+
+        try:
+            task_name = json.loads(request.body).get('task')
+        except json.JSONDecodeError:
+            return JsonResponse({'content': 'Error: Invalid JSON body'}, status=400)
+
+        if jobs.background_jobs_enabled():
+            stored = await sync_to_async(generation.stored_task_guides)(project, [task_name])
+            if task_name in stored:
+                return JsonResponse({'content': stored[task_name]})
+            job = await sync_to_async(jobs.enqueue)(project, 'task_guide', {'task': task_name})
+            return JsonResponse(jobs.describe_job(job), status=202)
+
+        # Serves the stored guide, or generates and stores it
+        return JsonResponse({'content': await generation.agenerate_task_guide(project, task_name)})
+
+    except Exception as e:
+        logger.error(f"Task Generation Error: {str(e)}")
+        return JsonResponse({
+            'content': f"## System Error\n\nThe server encountered an error while contacting the AI:\n\n`{str(e)}`"
+        }, status=500)
+
+
+@login_required
+@require_POST
+async def get_doc_section(request, pk):
+    project = await _own_project(request, pk)
+
+    try:
+        data = json.loads(request.body)
+        section_key = data.get('section')
+        force_regen = data.get('regenerate', False)
+
+        md_content = None if force_regen else await sync_to_async(generation.stored_doc_section)(project.pk, section_key)
+
+        if md_content is None and jobs.background_jobs_enabled():
+            job = await sync_to_async(jobs.enqueue)(project, 'doc_section', {'section': section_key, 'regenerate': force_regen})
+            return JsonResponse(jobs.describe_job(job), status=202)
+
+        if md_content is None:
+            md_content = await generation.aload_doc_section(project, section_key, regenerate=force_regen)
+        return JsonResponse({
+            'markdown': md_content,
+            'html': await sync_to_async(generation.doc_section_html)(project, section_key, md_content),
+        })
+
+    except Exception as e:
+        logger.error(f"Doc section error: {str(e)}")
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@login_required
+@require_POST
+async def generate_all_docs(request, pk):
+    """
+    Generates every missing doc section at once (async): SSE progress,
+    or one queued job per section in background mode.
+    """
+    project = await _own_project(request, pk)
+    try:
+        data = json.loads(request.body or '{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+
+    regenerate = bool(data.get('regenerate', False))
+    section_keys = await sync_to_async(generation.missing_doc_sections)(project, regenerate=regenerate)
+
+    if jobs.background_jobs_enabled():
+        queued = {}
+        for key in section_keys:
+            job = await sync_to_async(jobs.enqueue)(project, 'doc_section', {'section': key, 'regenerate': regenerate})
+            queued[key] = jobs.describe_job(job)
+        return JsonResponse({'jobs': queued}, status=202)
+
+    return _event_stream_response(doc_sections_event_stream, project, section_keys, regenerate=regenerate)
+
+
+# --- API ---
+async def _api_user(request):
+    """
+    What DRF's Token + Session authentication would resolve (None if
+    neither applies). Session users get DRF's CSRF check.
+    """
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Token '):
+        token = await Token.objects.select_related('user').filter(key=header[6:].strip()).afirst()
+        return token.user if token and token.user.is_active else None
+
+    user = await request.auser()
+    if not user.is_authenticated:
+        return None
+    SessionAuthentication().enforce_csrf(request)
+    return user
+
+
+@csrf_exempt  # Token clients have no CSRF cookie; session users are checked in _api_user
+@require_POST
+async def api_generate(request, pk):
+    """
+    POST /api/projects/{uuid}/generate/ (async variant of the DRF action)
+    Same responses: the blueprint, 202 + job in background mode,
+    or SSE with ?stream=true.
+    """
+    try:
+        user = await _api_user(request)
+    except PermissionDenied as e:
+        return JsonResponse({'detail': str(e.detail)}, status=403)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    project = await aget_object_or_404(Project, pk=pk, user=user)
+
+    if request.GET.get('stream') in ('1', 'true'):
+        return _event_stream_response(blueprint_event_stream, project)
+
+    if jobs.background_jobs_enabled():
+        blueprint = await sync_to_async(generation.adopt_speculative_blueprint)(project, wait=False)
+        if blueprint:
+            return JsonResponse(blueprint)
+        job = await sync_to_async(jobs.enqueue)(project, 'blueprint')
+        return JsonResponse(jobs.describe_job(job), status=202)
+
+    blueprint = await generation.agenerate_blueprint(project)
+    if blueprint.get('error') == generation.BLUEPRINT_CONFLICT:
+        return JsonResponse(blueprint, status=409)
+    return JsonResponse(blueprint, status=500 if 'error' in blueprint else 200)
@@ -10,4 +10,47 @@ FLOW_STAGES = [
 ]
 
 # Helper to check valid stages
-VALID_STAGES = set(FLOW_STAGES)
\ No newline at end of file
+VALID_STAGES = set(FLOW_STAGES)
+
+# Documentation tabs, in display order (keys of AIService.generate_doc_section)
+DOC_SECTIONS = [
+    'overview',
+    'features',
+    'backend',
+    'database',
+    'api',
+    'frontend',
+    'ui_ux',
+    'setup',
+]
+
+# Shape of the blueprint JSON requested by the 'blueprint' prompt (prompts.py).
+# Checked by projects/json_extract.py while the response is parsed.
+BLUEPRINT_SCHEMA = {
+    'overview': str,
+    'architecture': {
+        'style': str,
+        'diagram_description': str,
+    },
+    'frontend': {
+        'framework': str,
+        'structure': [str],
+        'state_management': str,
+        'ui_library': str,
+    },
+    'backend': {
+        'framework': str,
+        'database': str,
+        'models': [str],
+        'services': [str],
+    },
+    'api': {
+        'style': str,
+        'endpoints': [str],
+    },
+    'phases': [{
+        'phase': (int, str),
+        'title': str,
+        'tasks': [str],
+    }],
+}
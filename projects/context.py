@@ -0,0 +1,227 @@
+"""
+Token-budgeted project context for AI prompts.
+
+Prompts used to embed `json.dumps(..., indent=2)` of every answer and the
+whole blueprint. build_context() instead:
+- keeps only the answer stages / blueprint keys a prompt type declares;
+- serialises compactly (no indentation, no spaces after separators);
+- counts tokens and trims (long strings, then long lists, then the
+  least important keys) until the context fits AI_CONTEXT['MAX_TOKENS'];
+- records the tokens saved versus the old serialisation.
+"""
+import copy
+import json
+import logging
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_TOKENS': 2500,  # Budget for the context part of a prompt
+}
+
+ALL = None  # Every stage / key
+
+# What each prompt (by its prompts.py name) needs: answer stages
+# (FLOW_STAGES) and blueprint keys, most important first (dotted paths
+# select nested keys). When over budget, trailing entries are dropped first.
+PROMPT_CONTEXT = {
+    'blueprint': {'requirements': ALL, 'blueprint': ()},
+    'task_guide': {'requirements': (), 'blueprint': ('backend', 'frontend', 'architecture')},
+    'project_docs': {'requirements': ALL, 'blueprint': ALL},
+    'doc_section.overview': {
+        'requirements': ('intent', 'platform', 'quality'),
+        'blueprint': ('overview', 'architecture', 'phases'),
+    },
+    'doc_section.features': {
+        'requirements': ('intent', 'platform', 'tech_stack'),
+        'blueprint': ('overview', 'backend.models', 'backend.services', 'phases'),
+    },
+    'doc_section.backend': {
+        'requirements': ('tech_stack', 'platform', 'quality'),
+        'blueprint': ('backend', 'architecture', 'api'),
+    },
+    'doc_section.database': {
+        'requirements': ('intent', 'tech_stack'),
+        'blueprint': ('backend.database', 'backend.models', 'backend.framework'),
+    },
+    'doc_section.api': {
+        'requirements': ('tech_stack', 'intent'),
+        'blueprint': ('api', 'backend', 'architecture.style'),
+    },
+    'doc_section.frontend': {
+        'requirements': ('platform', 'ui_ux', 'tech_stack'),
+        'blueprint': ('frontend', 'architecture', 'api.style'),
+    },
+    'doc_section.ui_ux': {
+        'requirements': ('ui_ux', 'platform', 'intent'),
+        'blueprint': ('frontend.ui_library', 'frontend.framework', 'overview'),
+    },
+    'doc_section.setup': {
+        'requirements': ('tech_stack', 'quality'),
+        'blueprint': ('backend.framework', 'backend.database', 'frontend.framework', 'frontend.ui_library'),
+    },
+}
+
+
+def context_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AI_CONTEXT', {}))
+    return config
+
+
+def compact(value):
+    # sort_keys: byte-identical output however the JSON was stored
+    # (Postgres jsonb reorders keys), which keeps prompts cacheable
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, sort_keys=True)
+
+
+# --- Token counting ---
+_encoding = None
+_encoding_failed = False
+
+
+def count_tokens(text):
+    """
+    Exact count with tiktoken when it is installed (and its encoding is
+    available); otherwise the usual ~4 characters per token estimate.
+    """
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:  # Not installed, or offline without a cached encoding
+            _encoding_failed = True
+
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+# --- Savings ---
+class ContextSavings:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_type = {}
+
+    def record(self, prompt_type, baseline, actual):
+        with self._lock:
+            entry = self.by_type.setdefault(prompt_type, {'calls': 0, 'baseline_tokens': 0, 'tokens': 0})
+            entry['calls'] += 1
+            entry['baseline_tokens'] += baseline
+            entry['tokens'] += actual
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                prompt_type: dict(entry, saved_tokens=entry['baseline_tokens'] - entry['tokens'])
+                for prompt_type, entry in self.by_type.items()
+            }
+
+
+savings = ContextSavings()
+
+
+# --- Selection & trimming ---
+def _select(source, keys):
+    if not isinstance(source, dict):
+        return {}
+    if keys is ALL:
+        return copy.deepcopy(source)
+
+    selected = {}
+    for path in keys:
+        value, parts = source, path.split('.')
+        for part in parts:
+            value = value.get(part) if isinstance(value, dict) else None
+        if value is None:
+            continue
+        target = selected
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = copy.deepcopy(value)
+    return selected
+
+
+def _shorten(value, max_chars, max_items):
+    if isinstance(value, dict):
+        return {key: _shorten(item, max_chars, max_items) for key, item in value.items()}
+    if isinstance(value, list):
+        items = value if max_items is None else value[:max_items]
+        return [_shorten(item, max_chars, max_items) for item in items]
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars].rstrip() + '…'
+    return value
+
+
+class PromptContext:
+    def __init__(self, prompt_type, requirements, blueprint, tokens, baseline_tokens, trimmed):
+        self.prompt_type = prompt_type
+        self.requirements = requirements  # Compact JSON strings
+        self.blueprint = blueprint
+        self.tokens = tokens
+        self.baseline_tokens = baseline_tokens
+        self.trimmed = trimmed
+
+    @property
+    def saved_tokens(self):
+        return self.baseline_tokens - self.tokens
+
+
+def build_context(prompt_type, requirements=None, blueprint=None, max_tokens=None, legacy_indent=2):
+    """
+    Selects, serialises and (if needed) trims the context for one prompt.
+    Unknown prompt types get everything, still compact and budgeted.
+    """
+    spec = PROMPT_CONTEXT.get(prompt_type, {'requirements': ALL, 'blueprint': ALL})
+    budget = max_tokens or context_settings()['MAX_TOKENS']
+    requirements = requirements or {}
+    blueprint = blueprint or {}
+
+    parts = {
+        'requirements': _select(requirements, spec['requirements']),
+        'blueprint': _select(blueprint, spec['blueprint']),
+    }
+
+    def measure():
+        return sum(count_tokens(compact(value)) for value in parts.values())
+
+    # Trim in order of least information lost
+    trimmed = False
+    tokens = measure()
+    for max_chars, max_items in ((600, None), (300, 6), (150, 4), (80, 3)):
+        if tokens <= budget:
+            break
+        parts = {name: _shorten(value, max_chars, max_items) for name, value in parts.items()}
+        trimmed = True
+        tokens = measure()
+
+    # Still too big: drop trailing (least important) keys, blueprint first
+    for name in ('blueprint', 'requirements'):
+        while tokens > budget and len(parts[name]) > 1:
+            parts[name].pop(list(parts[name])[-1])
+            trimmed = True
+            tokens = measure()
+
+    # What the old prompts sent: everything, indented (legacy_indent=None
+    # for prompts that already used plain json.dumps)
+    baseline = count_tokens(json.dumps(requirements, indent=legacy_indent)) if requirements else 0
+    if blueprint and spec['blueprint'] != ():
+        baseline += count_tokens(json.dumps(blueprint, indent=legacy_indent))
+
+    savings.record(prompt_type, baseline, tokens)
+    logger.debug(
+        f"Context {prompt_type}: {tokens} tokens (was {baseline}, saved {baseline - tokens})"
+        + (" [trimmed]" if trimmed else "")
+    )
+    return PromptContext(
+        prompt_type=prompt_type,
+        requirements=compact(parts['requirements']),
+        blueprint=compact(parts['blueprint']),
+        tokens=tokens,
+        baseline_tokens=baseline,
+        trimmed=trimmed,
+    )
@@ -0,0 +1,69 @@
+"""
+Per-operation deadlines for AI calls.
+
+Each prompt gets a total time budget from AI_DEADLINES (by operation:
+blueprint, doc_section, task_guide, ...). The Deadline travels with the
+call: rate-limiter queueing, failover and hedging share it, and what is
+left becomes the HTTP timeout of each provider request, so a stalled
+model can't hold a worker past its budget.
+"""
+import time
+
+from django.conf import settings
+
+DEFAULTS = {
+    'blueprint': 180,
+    'doc_section': 90,
+    'task_guide': 90,
+    'project_docs': 240,
+    'default': 120,
+}
+
+
+class DeadlineExceeded(TimeoutError):
+    """The operation ran out of its time budget."""
+
+
+def deadline_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AI_DEADLINES', {}))
+    return config
+
+
+class Deadline:
+    def __init__(self, seconds, operation='default'):
+        self.seconds = seconds
+        self.operation = operation
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self):
+        if self.expired:
+            raise DeadlineExceeded(f"{self.operation}: no result within {self.seconds:g}s")
+
+    def cap(self, seconds):
+        """
+        `seconds` limited to what is left (for waits inside the call).
+        """
+        remaining = self.remaining()
+        return remaining if seconds is None else min(seconds, remaining)
+
+    def __repr__(self):
+        return f"<Deadline {self.operation} {self.remaining():.1f}s left>"
+
+
+def operation_for(prompt_name):
+    # 'doc_section.backend' -> 'doc_section'
+    return (prompt_name or 'default').split('.', 1)[0]
+
+
+def deadline_for(prompt_name):
+    operation = operation_for(prompt_name)
+    config = deadline_settings()
+    return Deadline(config.get(operation, config['default']), operation)
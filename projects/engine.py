@@ -1,5 +1,21 @@
+import copy
+
+from django.db.models import F
+from django.utils import timezone
+
 from .constants import FLOW_STAGES
+from .models import Project
 from .questions import QUESTION_BANK
+from . import sqlite
+
+
+class ConflictError(ValueError):
+    """The project changed since it was read (another tab or request)."""
+
+    def __init__(self, message, current_version=None):
+        super().__init__(message)
+        self.current_version = current_version
+
 
 class FlowEngine:
     def __init__(self, project):
@@ -38,10 +54,50 @@ class FlowEngine:
             'answers_so_far': answers
         }
 
-    def submit_answer(self, stage, data):
+    def _update(self, **changes):
+        """
+        Writes only `changes` (+ version, updated_at), and only if nobody
+        else wrote the project since it was read (compare-and-swap on
+        `version`). Raises ConflictError otherwise.
+        """
+        expected = self.project.version
+        now = timezone.now()
+        updated = sqlite.write(
+            Project.objects.filter(pk=self.project.pk, version=expected).update,
+            version=F('version') + 1, updated_at=now, **changes,
+        )
+        if not updated:
+            current = Project.objects.filter(pk=self.project.pk).values_list('version', flat=True).first()
+            raise ConflictError(
+                "This project was changed elsewhere (another tab?). Reload it and try again.",
+                current_version=current,
+            )
+        for name, value in changes.items():
+            setattr(self.project, name, value)
+        self.project.version = expected + 1
+        self.project.updated_at = now
+
+    def _check_version(self, expected_version):
+        # The version the client last saw (form field / API body)
+        if expected_version is not None and int(expected_version) != self.project.version:
+            raise ConflictError(
+                "This project was changed elsewhere (another tab?). Reload it and try again.",
+                current_version=self.project.version,
+            )
+
+    def save_fields(self, changes, expected_version=None):
+        """
+        Writes plain field edits (the API's PUT/PATCH) through the same
+        compare-and-swap as the flow steps below.
+        """
+        self._check_version(expected_version)
+        self._update(**changes)
+
+    def submit_answer(self, stage, data, expected_version=None):
         """
         Validates and saves an answer. 
         """
+        self._check_version(expected_version)
         state = self.get_current_state()
         
         # 1. Strict Validation
@@ -50,21 +106,15 @@ class FlowEngine:
             if stage not in self.project.requirements_data.get('answers', {}):
                  raise ValueError(f"Sequence Violation: You must complete '{state['current_stage']}' before '{stage}'.")
 
-        # 2. ROBUST SAVE MECHANISM (The Fix)
-        # We assume the current data, modify it, and RE-ASSIGN it.
-        # This forces Django to recognize the field as "dirty" (changed).
-        current_data = self.project.requirements_data
+        # 2. Save only the answers (a copy, so a conflict leaves the project as read)
+        current_data = copy.deepcopy(self.project.requirements_data)
         
         if 'answers' not in current_data:
             current_data['answers'] = {}
             
         current_data['answers'][stage] = data
         
-        # Explicit assignment triggers the update flag
-        self.project.requirements_data = current_data
-        
-        # Force save
-        self.project.save()
+        self._update(requirements_data=current_data)
         
         return self.get_current_state()
 
@@ -91,12 +141,31 @@ class FlowEngine:
             summary.append(stage_summary)
         return summary
 
-    def lock_requirements(self):
+    def lock_requirements(self, expected_version=None):
         # (Keep your existing lock code here)
+        self._check_version(expected_version)
         state = self.get_current_state()
         if not state['is_completed']:
             raise ValueError("Cannot lock requirements: Questions are incomplete.")
-        self.project.status = 'architecting'
-        self.project.current_phase = 6
-        self.project.save()
-        return True
\ No newline at end of file
+        self._update(status='architecting', current_phase=6)
+        return True
+
+    def store_blueprint(self, blueprint):
+        """
+        Saves a generated blueprint and moves the project to Phase 7.
+        Raises ConflictError if the answers changed while it was generated.
+        """
+        changes = {'blueprint_data': blueprint, 'status': 'blueprint_ready', 'current_phase': 7}  # Phase 7: Execution Guide
+        try:
+            self._update(**changes)
+        except ConflictError:
+            # Other writes (e.g. a parallel generate) don't make it stale; new answers do
+            fresh = Project.objects.filter(pk=self.project.pk).values('version', 'requirements_data').first()
+            if fresh is None or fresh['requirements_data'].get('answers', {}) != self.project.requirements_data.get('answers', {}):
+                raise ConflictError(
+                    "The requirements changed while the blueprint was being generated. Generate it again.",
+                    current_version=fresh and fresh['version'],
+                )
+            self.project.version = fresh['version']
+            self._update(**changes)
+        return blueprint
@@ -0,0 +1,122 @@
+"""
+Model fields that zlib-compress large values.
+
+Blueprints and generated docs are mostly LLM prose and shrink 3-5x, so
+storing them compressed makes the DB file (and every full-row read)
+smaller. Values are stored as bytes with a header byte:
+
+    0x01 + zlib stream   compressed (values over AI_COMPRESSION['THRESHOLD'])
+    0x00 + UTF-8         raw text (CompressedTextField below the threshold)
+    UTF-8 JSON           raw JSON (CompressedJSONField below the threshold)
+
+Rows written before a column switched to these fields are plain text
+and are still read as-is; `manage.py compress_payloads` rewrites them.
+
+The data is opaque to SQL: no JSON key lookups or text searches on
+these columns.
+"""
+import json
+import zlib
+
+from django.conf import settings
+from django.db import models
+
+DEFAULTS = {
+    'THRESHOLD': 1024,  # Bytes; smaller values are stored raw
+    'LEVEL': 6,         # zlib level (1 fastest .. 9 smallest)
+}
+
+RAW = b'\x00'
+ZLIB = b'\x01'
+
+
+def compression_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AI_COMPRESSION', {}))
+    return config
+
+
+def pack(data, raw_header=b''):
+    """
+    bytes -> stored bytes (compressed if over the threshold and it helps).
+    """
+    config = compression_settings()
+    if len(data) >= config['THRESHOLD']:
+        compressed = zlib.compress(data, config['LEVEL'])
+        if len(compressed) + 1 < len(data):
+            return ZLIB + compressed
+    return raw_header + data
+
+
+def unpack(value):
+    """
+    Stored value (bytes, or str for legacy rows) -> str.
+    """
+    if isinstance(value, str):
+        return value
+    value = bytes(value)  # memoryview on some backends
+    header = value[:1]
+    if header == ZLIB:
+        return zlib.decompress(value[1:]).decode('utf-8')
+    if header == RAW:
+        return value[1:].decode('utf-8')
+    return value.decode('utf-8')
+
+
+def is_packed(value):
+    """
+    True if a stored value is already in the current format.
+    """
+    return value is None or not isinstance(value, str)
+
+
+class CompressedJSONField(models.JSONField):
+    """
+    Drop-in JSONField stored as (compressed) bytes.
+    """
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return json.loads(unpack(value), cls=self.decoder)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if hasattr(value, 'as_sql'):
+            return value
+        data = json.dumps(value, cls=self.encoder).encode('utf-8')
+        return connection.Database.Binary(pack(data))
+
+    def get_transform(self, name):
+        # No KeyTransform: the JSON isn't readable by the database
+        return models.Field.get_transform(self, name)
+
+
+class CompressedTextField(models.TextField):
+    """
+    Drop-in TextField stored as (compressed) bytes.
+    """
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return unpack(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return unpack(value)
+        return super().to_python(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None or hasattr(value, 'as_sql'):
+            return value
+        return connection.Database.Binary(pack(value.encode('utf-8'), raw_header=RAW))
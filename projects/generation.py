@@ -0,0 +1,594 @@
+"""
+Shared AI generation routines.
+Used by the request/response views and by the background job worker,
+so both paths build the same context and persist results the same way.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .ai_service import AIService
+from .constants import DOC_SECTIONS
+from .engine import ConflictError, FlowEngine
+from .models import AIJob, DocSection, Project, TaskGuide
+from . import ratelimit, rendering, singleflight, sqlite
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationError(Exception):
+    """The AI call completed but returned nothing usable."""
+
+
+# --- BLUEPRINT ---
+# Error of a blueprint that came back after the answers were edited
+BLUEPRINT_CONFLICT = "Requirements Changed"
+
+
+def store_blueprint(project, blueprint):
+    """
+    FlowEngine.store_blueprint(), returning the {"error", "raw"} dict
+    (BLUEPRINT_CONFLICT) instead of raising if the answers changed.
+    """
+    try:
+        return FlowEngine(project).store_blueprint(blueprint)
+    except ConflictError as e:
+        return {"error": BLUEPRINT_CONFLICT, "raw": str(e)}
+
+
+def blueprint_flight_key(project, requirements, use_cache):
+    # Shared by the sync, async and streaming generate paths
+    return singleflight.make_key(project.pk, 'blueprint', requirements, use_cache)
+
+
+def generate_blueprint(project, use_cache=True):
+    """
+    Calls the AI and stores the blueprint on success.
+    Returns the blueprint dict, or the {"error", "raw"} dict on failure.
+    A speculative generation for the same answers (see below) is reused
+    instead of starting a new call.
+    """
+    requirements = project.requirements_data.get('answers', {})
+
+    def generate():
+        if use_cache:
+            blueprint = adopt_speculative_blueprint(project)
+            if blueprint is not None:
+                return blueprint
+
+        blueprint = AIService(user=project.user_id).generate_blueprint(requirements, use_cache=use_cache)
+        if 'error' not in blueprint:
+            blueprint = store_blueprint(project, blueprint)
+        return blueprint
+
+    # Concurrent generates for the same answers share one AI call.
+    # A follower in another process re-runs generate(), but the leader's
+    # response is in the AI cache by then, so that is a cache hit.
+    return singleflight.run(
+        blueprint_flight_key(project, requirements, use_cache),
+        generate,
+    )
+
+
+async def agenerate_blueprint(project, use_cache=True):
+    """
+    Async generate_blueprint() for the ASGI views (same flight key, so
+    sync and async requests for the same answers share one call).
+    """
+    requirements = project.requirements_data.get('answers', {})
+
+    async def generate():
+        if use_cache:
+            blueprint = await aspeculative_blueprint(project)
+            if blueprint is not None:
+                return await sync_to_async(store_blueprint)(project, blueprint)
+
+        blueprint = await AIService(user=project.user_id).agenerate_blueprint(requirements, use_cache=use_cache)
+        if 'error' not in blueprint:
+            blueprint = await sync_to_async(store_blueprint)(project, blueprint)
+        return blueprint
+
+    return await singleflight.arun(
+        blueprint_flight_key(project, requirements, use_cache),
+        generate,
+    )
+
+
+# --- SPECULATIVE BLUEPRINT ---
+# With AI_SPECULATIVE_BLUEPRINT['ENABLED'], locking the requirements
+# queues the blueprint generation right away (jobs.speculate_blueprint),
+# so it runs while the user reads the summary. The job is keyed by a hash
+# of the answers: generate requests for the same answers attach to it,
+# and it is simply ignored (or discarded) once the answers change.
+SPECULATIVE_KIND = 'speculative_blueprint'
+
+SPECULATION_DEFAULTS = {
+    'ENABLED': False,
+    'ATTACH_TIMEOUT': 180,   # Max seconds a generate request waits for a running speculation
+    'POLL_INTERVAL': 0.25,
+}
+
+
+def speculation_settings():
+    config = dict(SPECULATION_DEFAULTS)
+    config.update(getattr(settings, 'AI_SPECULATIVE_BLUEPRINT', {}))
+    return config
+
+
+def content_hash(value):
+    payload = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def requirements_hash(requirements):
+    return content_hash(requirements)
+
+
+def run_speculative_blueprint(project, expected_hash):
+    """
+    Job body: generates (but doesn't store) the blueprint for the answers
+    the speculation was queued for.
+    """
+    requirements = project.requirements_data.get('answers', {})
+    if requirements_hash(requirements) != expected_hash:
+        raise GenerationError("Answers changed since the speculation was queued; discarded.")
+
+    blueprint = AIService(user=project.user_id).generate_blueprint(requirements)
+    if 'error' in blueprint:
+        raise GenerationError(blueprint['raw'])
+    return {'blueprint': blueprint}
+
+
+def _speculation_step(project, answers_hash, wait):
+    """
+    One look at the speculation -> (blueprint or None, keep polling?).
+    """
+    while True:
+        job = AIJob.objects.filter(
+            project=project, kind=SPECULATIVE_KIND, payload__requirements_hash=answers_hash,
+        ).exclude(status='failed').order_by('-created_at').first()
+
+        if job is None:
+            return None, False
+        if job.status == 'succeeded':
+            return (job.result or {}).get('blueprint'), False
+        if job.status == 'queued':
+            if not wait:
+                return None, False
+            AIJob.objects.filter(pk=job.pk, status='queued').update(
+                status='failed', error='Superseded by an explicit generate.', updated_at=timezone.now(),
+            )
+            continue  # It may have been claimed meanwhile
+
+        # Running: attach, unless its worker died
+        dead = job.leased_until and job.leased_until < timezone.now()
+        return None, wait and not dead
+
+
+def speculative_blueprint(project, wait=True):
+    """
+    The blueprint of a speculation matching the current answers, or None.
+    wait=True blocks while it is running (up to ATTACH_TIMEOUT); one that
+    hasn't started yet is cancelled, since generating now is faster than
+    waiting for a free worker.
+    """
+    config = speculation_settings()
+    answers_hash = requirements_hash(project.requirements_data.get('answers', {}))
+    deadline = time.monotonic() + config['ATTACH_TIMEOUT']
+
+    while True:
+        blueprint, running = _speculation_step(project, answers_hash, wait)
+        if not running or time.monotonic() > deadline:
+            return blueprint
+        time.sleep(config['POLL_INTERVAL'])
+
+
+async def aspeculative_blueprint(project, wait=True):
+    # Same as speculative_blueprint(), polling without holding a thread
+    config = speculation_settings()
+    answers_hash = requirements_hash(project.requirements_data.get('answers', {}))
+    deadline = time.monotonic() + config['ATTACH_TIMEOUT']
+
+    while True:
+        blueprint, running = await sync_to_async(_speculation_step)(project, answers_hash, wait)
+        if not running or time.monotonic() > deadline:
+            return blueprint
+        await asyncio.sleep(config['POLL_INTERVAL'])
+
+
+def adopt_speculative_blueprint(project, wait=True):
+    """
+    Stores a matching speculative blueprint on the project (as if it had
+    just been generated). Returns it, or None.
+    """
+    blueprint = speculative_blueprint(project, wait=wait)
+    if blueprint:
+        try:
+            FlowEngine(project).store_blueprint(blueprint)
+        except ConflictError:
+            return None  # Answers changed under it: not usable
+    return blueprint
+
+
+def discard_speculation(project):
+    """
+    Drops speculations that no longer match the answers (call after an
+    answer changes). Running ones finish, but their result never matches.
+    """
+    answers_hash = requirements_hash(project.requirements_data.get('answers', {}))
+    AIJob.objects.filter(project=project, kind=SPECULATIVE_KIND).exclude(
+        payload__requirements_hash=answers_hash,
+    ).exclude(status='running').delete()
+
+
+# --- TASK GUIDES ---
+def build_task_context(project):
+    """
+    The slice of the blueprint a task guide needs (handles missing keys).
+    """
+    blueprint = project.blueprint_data or {}
+    backend = dict(blueprint.get('backend', {}))
+
+    # Force SQLite3 context if missing, since you explicitly requested it
+    if not backend.get('database'):
+        backend['database'] = "SQLite3"
+
+    return {
+        'architecture': blueprint.get('architecture', {}),
+        'frontend': blueprint.get('frontend', {}),
+        'backend': backend,
+    }
+
+
+# Guides are stored per task (TaskGuide) for the blueprint they were
+# written for, so the board serves them instead of regenerating.
+def blueprint_tasks(project, phase=None):
+    """
+    Task names of one phase (by its "phase" number) or of the whole blueprint.
+    """
+    tasks = []
+    for entry in (project.blueprint_data or {}).get('phases', []):
+        if phase is None or str(entry.get('phase')) == str(phase):
+            tasks.extend(str(task) for task in entry.get('tasks', []))
+    return list(dict.fromkeys(tasks))  # Drop duplicates, keep order
+
+
+def task_key(task_name):
+    return hashlib.sha256(task_name.encode('utf-8')).hexdigest()
+
+
+def stored_task_guides(project, tasks=None):
+    """
+    {task: content} of the guides stored for the current blueprint.
+    """
+    guides = TaskGuide.objects.filter(project=project, blueprint_hash=content_hash(project.blueprint_data or {}))
+    if tasks is not None:
+        guides = guides.filter(task_key__in=[task_key(task) for task in tasks])
+    return dict(guides.values_list('task', 'content'))
+
+
+def save_task_guide(project, task_name, content, blueprint_hash):
+    # One upsert statement: no read-then-write transaction for parallel
+    # batch threads to deadlock on
+    sqlite.write(
+        TaskGuide.objects.bulk_create,
+        [TaskGuide(project=project, blueprint_hash=blueprint_hash, task_key=task_key(task_name),
+                   task=task_name, content=content)],
+        update_conflicts=True,
+        unique_fields=['project', 'blueprint_hash', 'task_key'],
+        update_fields=['task', 'content'],
+    )
+
+
+def prune_task_guides(project):
+    # Guides of older blueprints are never served again
+    TaskGuide.objects.filter(project=project).exclude(
+        blueprint_hash=content_hash(project.blueprint_data or {}),
+    ).delete()
+
+
+def _task_guide_flight(project, task_name, ai=None):
+    """
+    (flight key, generate) for one guide; generate() stores the result.
+    """
+    project_context = build_task_context(project)
+    blueprint_hash = content_hash(project.blueprint_data or {})
+    ai = ai or AIService(user=project.user_id)
+
+    def generate():
+        content = ai.generate_task_guide(project_context=project_context, current_task=task_name, raise_errors=True)
+        save_task_guide(project, task_name, content, blueprint_hash)
+        return content
+
+    return singleflight.make_key(project.pk, 'task_guide', task_name, project_context), generate
+
+
+def generate_task_guide(project, task_name, raise_errors=False):
+    """
+    The stored guide for a task, generating (and storing) it if missing.
+    """
+    stored = stored_task_guides(project, [task_name])
+    if task_name in stored:
+        return stored[task_name]
+
+    prune_task_guides(project)
+    key, generate = _task_guide_flight(project, task_name)
+    try:
+        return singleflight.run(key, generate, recheck=lambda: stored_task_guides(project, [task_name]).get(task_name))
+    except Exception as e:
+        if raise_errors:
+            raise
+        return f"AI Error: {str(e)}"
+
+
+async def agenerate_task_guide(project, task_name):
+    """
+    Async generate_task_guide() (errors are returned as text, like the sync one).
+    """
+    stored = await sync_to_async(stored_task_guides)(project, [task_name])
+    if task_name in stored:
+        return stored[task_name]
+
+    await sync_to_async(prune_task_guides)(project)
+    project_context = build_task_context(project)
+    blueprint_hash = content_hash(project.blueprint_data or {})
+
+    async def generate():
+        content = await AIService(user=project.user_id).agenerate_task_guide(
+            project_context=project_context, current_task=task_name, raise_errors=True,
+        )
+        await sync_to_async(save_task_guide)(project, task_name, content, blueprint_hash)
+        return content
+
+    async def recheck():
+        return (await sync_to_async(stored_task_guides)(project, [task_name])).get(task_name)
+
+    try:
+        return await singleflight.arun(
+            singleflight.make_key(project.pk, 'task_guide', task_name, project_context), generate, recheck=recheck,
+        )
+    except Exception as e:
+        return f"AI Error: {str(e)}"
+
+
+def generate_task_guides(project, tasks):
+    """
+    Guides for several tasks: stored ones first, the missing ones in
+    parallel over a bounded pool (like generate_doc_sections).
+    Returns ({task: content}, {task: error}).
+    """
+    guides = stored_task_guides(project, tasks)
+    missing = [task for task in tasks if task not in guides]
+    errors = {}
+    if not missing:
+        return guides, errors
+
+    prune_task_guides(project)
+    ai = AIService(user=project.user_id)
+    max_workers = ratelimit.max_in_flight(ai.provider)
+
+    def work(task_name):
+        try:
+            # Same flight key as a single click on that task
+            key, generate = _task_guide_flight(project, task_name, ai=ai)
+            return singleflight.run(key, generate, recheck=lambda: stored_task_guides(project, [task_name]).get(task_name))
+        finally:
+            connection.close()  # Pool threads get their own DB connection
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as pool:
+        futures = {pool.submit(work, task): task for task in missing}
+        for future in as_completed(futures):
+            task_name = futures[future]
+            try:
+                guides[task_name] = future.result()
+            except Exception as e:
+                errors[task_name] = str(e)
+    return guides, errors
+
+
+# --- DOC SECTIONS ---
+def build_doc_context(project):
+    return {
+        'blueprint': project.blueprint_data,
+        'requirements': project.requirements_data.get('answers', {}),
+    }
+
+
+def doc_section_flight_key(project, section_key, context, regenerate):
+    return singleflight.make_key(project.pk, 'doc_section', section_key, context, regenerate)
+
+
+def stored_doc_section(project_id, section_key):
+    """
+    Reads a single section straight from the DB (None if missing).
+    """
+    return DocSection.objects.filter(project_id=project_id, key=section_key).values_list(
+        'markdown', flat=True
+    ).first()
+
+
+def load_doc_section(project, section_key, regenerate=False, raise_errors=False):
+    """
+    Returns the stored markdown for a section, generating (and saving)
+    it first if it is missing or a regenerate was requested.
+    Concurrent requests for the same section share one generation.
+    A failed generation is never saved: its error is raised, or returned
+    as text when not raise_errors.
+    """
+    if not regenerate:
+        md_content = stored_doc_section(project.pk, section_key)
+        if md_content is not None:
+            return md_content
+
+    context = build_doc_context(project)
+
+    def generate():
+        logger.debug(f"Generating doc section {section_key} for project {project.pk}")
+        md_content = AIService(user=project.user_id).generate_doc_section(
+            context, section_key,
+            use_cache=not regenerate, raise_errors=True,
+        )
+        logger.debug(f"Doc section {section_key}: {md_content[:100]!r}")
+
+        save_doc_section(project, section_key, md_content, context_hash=content_hash(context))
+        return md_content
+
+    try:
+        return singleflight.run(
+            doc_section_flight_key(project, section_key, context, regenerate),
+            generate,
+            # Another process may have finished it while we waited
+            recheck=None if regenerate else lambda: stored_doc_section(project.pk, section_key),
+        )
+    except Exception as e:
+        if raise_errors:
+            raise
+        return f"Error generating section: {str(e)}"
+
+
+async def aload_doc_section(project, section_key, regenerate=False):
+    """
+    Async load_doc_section() (same flight key as the sync path; errors
+    are returned as text, unsaved).
+    """
+    async def recheck():
+        return await sync_to_async(stored_doc_section)(project.pk, section_key)
+
+    if not regenerate:
+        md_content = await recheck()
+        if md_content is not None:
+            return md_content
+
+    context = build_doc_context(project)
+
+    async def generate():
+        md_content = await AIService(user=project.user_id).agenerate_doc_section(
+            context, section_key, use_cache=not regenerate, raise_errors=True,
+        )
+        await sync_to_async(save_doc_section)(project, section_key, md_content, context_hash=content_hash(context))
+        return md_content
+
+    try:
+        return await singleflight.arun(
+            doc_section_flight_key(project, section_key, context, regenerate),
+            generate,
+            recheck=None if regenerate else recheck,
+        )
+    except Exception as e:
+        return f"Error generating section: {str(e)}"
+
+
+def markdown_hash(md_content):
+    return hashlib.sha256((md_content or '').encode('utf-8')).hexdigest()
+
+
+def save_doc_section(project, section_key, md_content, context_hash=''):
+    """
+    Stores one section (one row upsert) with its rendered HTML, so
+    reads never re-render.
+    """
+    entry = rendering.rendered_entry(md_content)
+    # One upsert statement, like save_task_guide(): parallel section
+    # threads never read-modify-write a shared row
+    def store():
+        DocSection.objects.bulk_create(
+            [DocSection(project=project, key=section_key, markdown=md_content,
+                        html=entry['html'], html_key=entry['key'],
+                        content_hash=markdown_hash(md_content), context_hash=context_hash)],
+            update_conflicts=True,
+            unique_fields=['project', 'key'],
+            update_fields=['markdown', 'html', 'html_key', 'content_hash', 'context_hash', 'updated_at'],
+        )
+        Project.objects.filter(pk=project.pk).update(updated_at=timezone.now())
+
+    sqlite.write(store)
+
+
+def doc_section_html(project, section_key, md_content):
+    """
+    Stored HTML for a section, rendering (and storing) it only when the
+    markdown or the renderer changed since it was saved.
+    """
+    key = rendering.html_key(md_content)
+    sections = DocSection.objects.filter(project=project, key=section_key)
+    html_content = sections.filter(html_key=key).values_list('html', flat=True).first()
+    if html_content is not None:
+        return html_content
+
+    html_content = rendering.render_markdown(md_content)
+    # Cache fill only (and only for the same markdown): leave updated_at alone
+    sections.filter(content_hash=markdown_hash(md_content)).update(html=html_content, html_key=key)
+    return html_content
+
+
+def copy_doc_sections(source_project_id, project):
+    # For duplicated projects
+    DocSection.objects.bulk_create([
+        DocSection(project=project, key=section.key, markdown=section.markdown, html=section.html,
+                   html_key=section.html_key, content_hash=section.content_hash, context_hash=section.context_hash)
+        for section in DocSection.objects.filter(project_id=source_project_id)
+    ])
+
+
+# --- BULK DOC GENERATION ---
+def missing_doc_sections(project, regenerate=False):
+    stored = set() if regenerate else set(DocSection.objects.filter(project=project).values_list('key', flat=True))
+    return [key for key in DOC_SECTIONS if key not in stored]
+
+
+def generate_doc_sections(project, section_keys, regenerate=False):
+    """
+    Generates several sections in parallel over a bounded thread pool.
+    Yields (section_key, md_content, error) in completion order; each
+    section is saved as soon as it arrives.
+    """
+    if not section_keys:
+        return
+
+    ai = AIService(user=project.user_id)
+    context = build_doc_context(project)
+    context_hash = content_hash(context)
+    # In-flight calls are capped per provider by the rate limiter (across
+    # processes); more threads than that would only queue
+    max_workers = ratelimit.max_in_flight(ai.provider)
+
+    def generate(section_key):
+        md_content = ai.generate_doc_section(
+            context, section_key, use_cache=not regenerate, raise_errors=True,
+        )
+        save_doc_section(project, section_key, md_content, context_hash=context_hash)
+        return md_content
+
+    def work(section_key):
+        try:
+            # Same flight key as load_doc_section: a tab click during a
+            # bulk run waits for this generation instead of duplicating it
+            return singleflight.run(
+                doc_section_flight_key(project, section_key, context, regenerate),
+                lambda: generate(section_key),
+                recheck=None if regenerate else lambda: stored_doc_section(project.pk, section_key),
+            )
+        finally:
+            connection.close()  # Pool threads get their own DB connection
+
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(section_keys)))
+    try:
+        futures = {pool.submit(work, key): key for key in section_keys}
+        for future in as_completed(futures):
+            section_key = futures[future]
+            try:
+                yield section_key, future.result(), None
+            except Exception as e:
+                yield section_key, None, str(e)
+    finally:
+        # Consumer gone (e.g. the SSE client disconnected): drop the
+        # sections not started yet; running ones stop at their deadline
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,292 @@
+"""
+DB-backed job queue for AI generations.
+
+Views call enqueue(); `manage.py run_ai_worker` processes jobs with
+claim_next() + run_job(). Jobs are claimed with a compare-and-swap UPDATE
+so several worker processes can share the table safely; the lease is
+renewed while a job runs, and only the claim holding it records the outcome.
+"""
+import logging
+import os
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import AIJob
+from . import generation
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'LEASE_SECONDS': 300,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_BACKOFF_SECONDS': 10,   # Doubled after each failed attempt
+    'POLL_INTERVAL': 1.0,
+    'EXPIRE_AFTER': 900,           # Seconds a job may wait (incl. retries) before it is dropped; 0 = never
+}
+
+JOB_HANDLERS = {}
+
+
+def job_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AI_JOBS', {}))
+    return config
+
+
+def background_jobs_enabled():
+    return getattr(settings, 'AI_BACKGROUND_JOBS', False)
+
+
+def job_handler(kind):
+    """
+    Registers a function(job) -> JSON-serialisable result for a job kind.
+    """
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+# --- PRODUCER SIDE ---
+def enqueue(project, kind, payload=None, max_attempts=None, expire_after=None):
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    config = job_settings()
+    expire_after = config['EXPIRE_AFTER'] if expire_after is None else expire_after
+    return AIJob.objects.create(
+        project=project,
+        kind=kind,
+        payload=payload or {},
+        max_attempts=max_attempts or config['MAX_ATTEMPTS'],
+        expires_at=timezone.now() + timedelta(seconds=expire_after) if expire_after else None,
+    )
+
+
+def run_in_thread(job, lease_seconds=None):
+    """
+    Claims a just-enqueued job and runs it on a local daemon thread, for
+    work that should start now even when no worker is running.
+    """
+    lease_seconds = lease_seconds or job_settings()['LEASE_SECONDS']
+    now = timezone.now()
+    claimed = AIJob.objects.filter(pk=job.pk, status='queued', attempts=job.attempts).update(
+        status='running',
+        worker_id=f"local:{os.getpid()}",
+        leased_until=now + timedelta(seconds=lease_seconds),
+        attempts=F('attempts') + 1,
+        updated_at=now,
+    )
+    if not claimed:
+        return
+
+    def target():
+        try:
+            run_job(AIJob.objects.select_related('project').get(pk=job.pk), lease_seconds)
+        finally:
+            connection.close()
+
+    threading.Thread(target=target, daemon=True).start()
+
+
+def speculate_blueprint(project):
+    """
+    Starts generating the blueprint as soon as requirements are locked
+    (if AI_SPECULATIVE_BLUEPRINT is enabled). Returns the job or None.
+    """
+    if not generation.speculation_settings()['ENABLED']:
+        return None
+
+    answers_hash = generation.requirements_hash(project.requirements_data.get('answers', {}))
+    existing = AIJob.objects.filter(
+        project=project, kind=generation.SPECULATIVE_KIND, payload__requirements_hash=answers_hash,
+    ).exclude(status='failed').first()
+    if existing:
+        return existing
+
+    # One attempt: a failed speculation just means generating on click
+    job = enqueue(project, generation.SPECULATIVE_KIND, {'requirements_hash': answers_hash}, max_attempts=1)
+    if not background_jobs_enabled():
+        run_in_thread(job)
+    return job
+
+
+def job_status_url(job):
+    return reverse('project-job-status', kwargs={'pk': job.project_id, 'job_id': job.pk})
+
+
+def describe_job(job):
+    """
+    Compact JSON view of a job for polling clients.
+    """
+    return {
+        'id': str(job.pk),
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'result': job.result,
+        'error': job.error,
+        'status_url': job_status_url(job),
+    }
+
+
+# --- CONSUMER SIDE ---
+def expire_jobs(now=None):
+    """
+    Fails jobs past their expiry that are waiting (queued, or abandoned by
+    a dead worker). Returns how many.
+    """
+    now = now or timezone.now()
+    return AIJob.objects.filter(
+        Q(status='queued') | Q(status='running', leased_until__lt=now),
+        expires_at__lt=now,
+    ).update(status='failed', error='Expired before a worker could finish it.', leased_until=None, updated_at=now)
+
+
+def claim_next(worker_id, lease_seconds=None):
+    """
+    Atomically leases the oldest runnable job to `worker_id`.
+    Runnable = queued and due, or running with an expired lease (and not
+    expired). Returns the claimed job or None.
+    """
+    lease_seconds = lease_seconds or job_settings()['LEASE_SECONDS']
+    now = timezone.now()
+    expire_jobs(now)
+    runnable = (
+        Q(status='queued', run_after__lte=now) |
+        Q(status='running', leased_until__lt=now)
+    ) & (Q(expires_at__isnull=True) | Q(expires_at__gte=now))
+
+    for candidate in AIJob.objects.filter(runnable).order_by('run_after')[:10]:
+        # Compare-and-swap: only one worker can move this exact state forward
+        claimed = AIJob.objects.filter(
+            pk=candidate.pk,
+            status=candidate.status,
+            attempts=candidate.attempts,
+        ).update(
+            status='running',
+            worker_id=worker_id,
+            leased_until=now + timedelta(seconds=lease_seconds),
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+        if claimed:
+            return AIJob.objects.select_related('project').get(pk=candidate.pk)
+    return None
+
+
+def leased(job):
+    """
+    The job's row, as long as this claim (worker + attempt) still holds it.
+    """
+    return AIJob.objects.filter(pk=job.pk, status='running', worker_id=job.worker_id, attempts=job.attempts)
+
+
+class LeaseHeartbeat:
+    """
+    Keeps a running job's lease alive while its handler runs, so a slow
+    generation isn't reclaimed and run a second time by another worker.
+    Renews every third of the lease from a daemon thread.
+    """
+
+    def __init__(self, job, lease_seconds=None):
+        self.job = job
+        self.lease_seconds = lease_seconds or job_settings()['LEASE_SECONDS']
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'ai-job-lease-{job.pk}', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def renew(self):
+        now = timezone.now()
+        return bool(leased(self.job).update(leased_until=now + timedelta(seconds=self.lease_seconds), updated_at=now))
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.lease_seconds / 3):
+                if not self.renew():
+                    logger.warning(f"AI job {self.job.pk} lost its lease to another worker")
+                    return
+        finally:
+            connection.close()
+
+
+def run_job(job, lease_seconds=None):
+    """
+    Executes a claimed job and records success, retry or failure.
+    The outcome is only written if this claim still holds the lease;
+    otherwise another worker owns the job now and the result is dropped.
+    """
+    handler = JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise ValueError(f"No handler registered for '{job.kind}'")
+        with LeaseHeartbeat(job, lease_seconds):
+            result = handler(job)
+    except Exception as e:
+        logger.error(f"AI job {job.pk} ({job.kind}) attempt {job.attempts} failed: {e}")
+        changes = {'error': str(e), 'status': 'failed'}
+        if job.attempts < job.max_attempts:
+            backoff = job_settings()['RETRY_BACKOFF_SECONDS'] * (2 ** (job.attempts - 1))
+            changes.update(status='queued', run_after=timezone.now() + timedelta(seconds=backoff))
+    else:
+        changes = {'status': 'succeeded', 'result': result, 'error': ''}
+
+    if not leased(job).update(leased_until=None, updated_at=timezone.now(), **changes):
+        logger.warning(f"AI job {job.pk} attempt {job.attempts} finished after losing its lease; result discarded")
+    job.refresh_from_db()
+    return job
+
+
+# --- HANDLERS ---
+@job_handler('blueprint')
+def _run_blueprint(job):
+    blueprint = generation.generate_blueprint(job.project, use_cache=job.payload.get('use_cache', True))
+    if 'error' in blueprint:
+        raise generation.GenerationError(blueprint['raw'])
+    return {
+        'blueprint': blueprint,
+        'redirect': reverse('project_blueprint', args=[job.project_id]),
+    }
+
+
+@job_handler(generation.SPECULATIVE_KIND)
+def _run_speculative_blueprint(job):
+    return generation.run_speculative_blueprint(job.project, job.payload['requirements_hash'])
+
+
+@job_handler('task_guides')
+def _run_task_guides(job):
+    tasks = job.payload.get('tasks') or generation.blueprint_tasks(job.project, job.payload.get('phase'))
+    guides, errors = generation.generate_task_guides(job.project, tasks)
+    if errors and not guides:
+        raise generation.GenerationError(next(iter(errors.values())))
+    return {'guides': guides, 'errors': errors}
+
+
+@job_handler('doc_section')
+def _run_doc_section(job):
+    md_content = generation.load_doc_section(
+        job.project,
+        job.payload['section'],
+        regenerate=job.payload.get('regenerate', False),
+        raise_errors=True,
+    )
+    return {'markdown': md_content, 'html': generation.doc_section_html(job.project, job.payload['section'], md_content)}
+
+
+@job_handler('task_guide')
+def _run_task_guide(job):
+    content = generation.generate_task_guide(job.project, job.payload['task'], raise_errors=True)
+    return {'content': content}
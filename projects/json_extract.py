@@ -0,0 +1,357 @@
+"""
+Single-pass JSON extraction for LLM output.
+
+JSONExtractor walks the text once, character by character:
+- skips <think> reasoning traces, code fences and any preamble before
+  the first '{';
+- tracks string / escape state, so braces inside descriptions are text;
+- builds the Python value as it goes (containers are attached to their
+  parent the moment they open), so a truncated response already *is*
+  the partial result - no brace balancing and no second json.loads;
+- validates each top-level member against a declared schema as soon
+  as it completes, and reports which fields are missing.
+"""
+
+_WHITESPACE = ' \t\r\n'
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_LITERALS = {'true': True, 'false': False, 'null': None}
+
+
+def _partial_suffix_len(text, tag):
+    """
+    Length of the longest suffix of `text` that is a prefix of `tag`
+    (i.e. a tag that may be completed by the next chunk).
+    """
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
+
+
+class ThinkStripper:
+    """
+    Removes <think>...</think> reasoning traces from a chunked stream.
+    Tags split across chunk boundaries are held back until resolved.
+    """
+    OPEN_TAG = '<think>'
+    CLOSE_TAG = '</think>'
+
+    def __init__(self):
+        self.in_think = False
+        self._pending = ''
+
+    def feed(self, chunk):
+        text = self._pending + chunk
+        self._pending = ''
+        visible = []
+
+        while text:
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            idx = text.find(tag)
+            if idx == -1:
+                keep = _partial_suffix_len(text, tag)
+                if not self.in_think:
+                    visible.append(text[:len(text) - keep])
+                self._pending = text[len(text) - keep:]
+                break
+
+            if not self.in_think:
+                visible.append(text[:idx])
+            text = text[idx + len(tag):]
+            self.in_think = not self.in_think
+
+        return ''.join(visible)
+
+
+class ExtractionResult:
+    def __init__(self, value, complete, truncated, missing, mismatched, errors):
+        self.value = value            # Parsed object (partial if truncated), or None
+        self.complete = complete      # The top-level object was closed
+        self.truncated = truncated    # Input ended inside the object
+        self.missing = missing        # Schema paths that are absent / null
+        self.mismatched = mismatched  # Schema paths with the wrong type
+        self.errors = errors          # Syntax problems that were skipped
+
+    @property
+    def is_valid(self):
+        return self.complete and not self.missing and not self.mismatched
+
+
+class _Frame:
+    __slots__ = ('container', 'key', 'owner_key')
+
+    def __init__(self, container, owner_key):
+        self.container = container
+        self.key = None              # Pending key (dict frames)
+        self.owner_key = owner_key   # Key this container has in its parent
+
+
+class JSONExtractor:
+    """
+    Incremental extractor for one top-level JSON object.
+    feed() returns the top-level (key, value) members completed by that
+    chunk; close() finalises and returns an ExtractionResult.
+    """
+
+    def __init__(self, schema=None, strip_think=True):
+        self.schema = schema
+        self.root = None
+        self.finished = False
+        self._think = ThinkStripper() if strip_think else None
+        self._stack = []
+        self._expect = 'value'   # 'key' | 'colon' | 'value' | 'comma'
+        self._string = None      # Chars of the string being read
+        self._string_is_key = False
+        self._escape = None      # None, '' after a backslash, 'u...' for \uXXXX
+        self._scalar = None      # Chars of the number / literal being read
+        self._completed = []
+        self._validated = set()
+        self.missing = []
+        self.mismatched = []
+        self.errors = []
+
+    # --- Public API ---
+    def feed(self, text):
+        if self._think is not None:
+            text = self._think.feed(text)
+
+        self._completed = []
+        for ch in text:
+            if self.finished:
+                break
+            self._step(ch)
+        return self._completed
+
+    def close(self):
+        self._completed = []
+        truncated = False
+
+        if not self.finished and self._stack:
+            truncated = True
+            if self._scalar is not None:
+                self._finish_scalar()
+            elif self._string is not None and not self._string_is_key:
+                # Keep the text we have: a cut-off sentence beats nothing
+                self._attach(self._decode(self._string))
+            self._string = None
+
+            # Containers are already attached; the top-level member that
+            # was open is as complete as it will get
+            if len(self._stack) > 1:
+                self._member_done(self._stack[1].owner_key, self._stack[1].container)
+            self._stack = []
+
+        if isinstance(self.root, dict) and isinstance(self.schema, dict):
+            for key, spec in self.schema.items():
+                if key not in self.root or self.root[key] is None:
+                    self.missing.append(key)
+                elif key not in self._validated:
+                    self._validate(self.root[key], spec, key)
+
+        return ExtractionResult(
+            value=self.root,
+            complete=self.finished,
+            truncated=truncated,
+            missing=self.missing,
+            mismatched=self.mismatched,
+            errors=self.errors,
+        )
+
+    # --- Tokenizer ---
+    def _step(self, ch):
+        # 1. Skip everything before the opening brace (fences, preamble)
+        if self.root is None:
+            if ch == '{':
+                self._open({})
+            return
+
+        # 2. Strings: only escapes and the closing quote matter
+        if self._string is not None:
+            self._string_char(ch)
+            return
+
+        # 3. Numbers / literals end at a delimiter, which is then processed
+        if self._scalar is not None:
+            if ch in _WHITESPACE or ch in ',:}]':
+                self._finish_scalar()
+            else:
+                self._scalar.append(ch)
+                return
+
+        if ch in _WHITESPACE:
+            return
+
+        if ch == '"':
+            if self._expect in ('key', 'value'):
+                self._string = []
+                self._string_is_key = self._expect == 'key'
+            else:
+                self.errors.append(f"Unexpected string (expected {self._expect})")
+                self._string = []
+                self._string_is_key = False
+        elif ch == '{' or ch == '[':
+            if self._expect == 'value':
+                self._open({} if ch == '{' else [])
+            else:
+                self.errors.append(f"Unexpected '{ch}' (expected {self._expect})")
+        elif ch == '}' or ch == ']':
+            self._close(ch)
+        elif ch == ':':
+            if self._expect == 'colon':
+                self._expect = 'value'
+        elif ch == ',':
+            if self._expect == 'comma':
+                self._expect = 'key' if isinstance(self._stack[-1].container, dict) else 'value'
+        elif self._expect == 'value':
+            self._scalar = [ch]
+        else:
+            self.errors.append(f"Skipped stray character {ch!r}")
+
+    def _string_char(self, ch):
+        if self._escape is not None:
+            if self._escape == '':
+                if ch == 'u':
+                    self._escape = 'u'
+                else:
+                    self._string.append(_ESCAPES.get(ch, ch))
+                    self._escape = None
+            else:
+                self._escape += ch
+                if len(self._escape) == 5:
+                    try:
+                        self._string.append(chr(int(self._escape[1:], 16)))
+                    except ValueError:
+                        self.errors.append(f"Bad escape \\{self._escape}")
+                    self._escape = None
+            return
+
+        if ch == '\\':
+            self._escape = ''
+        elif ch == '"':
+            text = self._decode(self._string)
+            self._string = None
+            if self._string_is_key:
+                self._stack[-1].key = text
+                self._expect = 'colon'
+            elif self._expect == 'value':
+                self._attach(text)
+        else:
+            self._string.append(ch)
+
+    def _finish_scalar(self):
+        text = ''.join(self._scalar)
+        self._scalar = None
+        if text in _LITERALS:
+            value = _LITERALS[text]
+        else:
+            try:
+                value = int(text)
+            except ValueError:
+                try:
+                    value = float(text)
+                except ValueError:
+                    self.errors.append(f"Invalid literal {text!r}")
+                    self._drop_pending()
+                    return
+        self._attach(value)
+
+    # --- Tree building ---
+    def _open(self, container):
+        owner_key = self._stack[-1].key if self._stack else None
+        if self.root is None:
+            self.root = container
+        else:
+            self._attach(container, is_container=True)
+        self._stack.append(_Frame(container, owner_key))
+        self._expect = 'key' if isinstance(container, dict) else 'value'
+
+    def _attach(self, value, is_container=False):
+        frame = self._stack[-1]
+        if isinstance(frame.container, dict):
+            if frame.key is None:
+                self.errors.append("Value without a key")
+                return
+            frame.container[frame.key] = value
+            member_key = frame.key
+            frame.key = None
+        else:
+            frame.container.append(value)
+            member_key = None
+        self._expect = 'comma'
+
+        # Scalars directly under the root complete a member immediately
+        if not is_container and len(self._stack) == 1:
+            self._member_done(member_key, value)
+
+    def _close(self, ch):
+        if self._expect == 'colon' or (self._expect == 'value' and isinstance(self._stack[-1].container, dict)):
+            self.errors.append("Key without a value")
+            self._drop_pending()
+
+        frame = self._stack.pop()
+        expected = '}' if isinstance(frame.container, dict) else ']'
+        if ch != expected:
+            self.errors.append(f"Expected '{expected}' but found '{ch}'")
+
+        if not self._stack:
+            self.finished = True
+            return
+
+        self._expect = 'comma'
+        if len(self._stack) == 1:
+            self._member_done(frame.owner_key, frame.container)
+
+    def _drop_pending(self):
+        if self._stack and isinstance(self._stack[-1].container, dict):
+            self._stack[-1].key = None
+        self._expect = 'comma'
+
+    def _member_done(self, key, value):
+        if key is None:
+            return
+        self._completed.append((key, value))
+        if isinstance(self.schema, dict) and key in self.schema:
+            self._validated.add(key)
+            self._validate(value, self.schema[key], key)
+
+    @staticmethod
+    def _decode(chars):
+        text = ''.join(chars)
+        try:
+            # Re-join 😀-style surrogate pairs
+            return text.encode('utf-16', 'surrogatepass').decode('utf-16')
+        except UnicodeError:
+            return text
+
+    # --- Schema ---
+    def _validate(self, value, spec, path):
+        """
+        spec: a type (or tuple of types), {key: spec} for objects,
+        or [spec] for lists whose items all match spec.
+        """
+        if isinstance(spec, dict):
+            if not isinstance(value, dict):
+                self.mismatched.append(path)
+                return
+            for key, sub_spec in spec.items():
+                if value.get(key) is None:
+                    self.missing.append(f"{path}.{key}")
+                else:
+                    self._validate(value[key], sub_spec, f"{path}.{key}")
+        elif isinstance(spec, list):
+            if not isinstance(value, list):
+                self.mismatched.append(path)
+                return
+            for index, item in enumerate(value):
+                self._validate(item, spec[0], f"{path}[{index}]")
+        elif not isinstance(value, spec):
+            self.mismatched.append(path)
+
+
+def extract_json(text, schema=None):
+    """
+    One-shot helper: extract the first JSON object from `text`.
+    """
+    extractor = JSONExtractor(schema=schema)
+    extractor.feed(text)
+    return extractor.close()
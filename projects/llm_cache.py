@@ -0,0 +1,214 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+DEFAULTS = {
+    'ENABLED': True,
+    'TTL_SECONDS': 60 * 60 * 24 * 7,
+    'MEMORY_MAX_ENTRIES': 256,
+    'DB_MAX_ENTRIES': 5000,
+    'DB_PRUNE_EVERY': 50,  # Run DB eviction once every N writes
+    'TOUCH_INTERVAL': 60,  # Seconds; a DB hit refreshes last_hit_at at most this often
+}
+
+
+def cache_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AI_CACHE', {}))
+    return config
+
+
+def make_cache_key(model, messages, temperature, max_tokens=None, version=None):
+    """
+    Content-addressed key: identical model + messages + sampling params
+    (+ prompt template version) always hash to the same 64-char hex digest.
+    """
+    payload = json.dumps({
+        'model': model,
+        'messages': messages,
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'version': version,
+    }, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache for raw LLM completions.
+    Tier 1: in-process LRU (OrderedDict). Tier 2: AIResponseCache table.
+    Both tiers honour the same TTL; the DB tier is also capped by row count.
+    """
+
+    def __init__(self):
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.stats = {
+            'memory_hits': 0,
+            'db_hits': 0,
+            'misses': 0,
+            'writes': 0,
+            'evictions': 0,
+        }
+
+    # --- Public API ---
+    def get(self, key):
+        return self.get_any([key])
+
+    def get_any(self, keys):
+        """
+        The value of the first of `keys` that is cached, or None. Counts
+        as one lookup; the DB tier is read with a single query.
+        """
+        config = cache_settings()
+        if not config['ENABLED'] or not keys:
+            return None
+
+        # 1. Memory tier
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry is None:
+                    continue
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return value
+                del self._memory[key]
+
+        # 2. DB tier (promote into memory on hit, for what is left of its TTL)
+        row = self._db_get(keys, config)
+        with self._lock:
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['db_hits'] += 1
+        self._memory_set(row.key, row.response, config, ttl=(row.expires_at - timezone.now()).total_seconds())
+        return row.response
+
+    def set(self, key, value, model=''):
+        config = cache_settings()
+        if not config['ENABLED'] or not value:
+            return
+        self._memory_set(key, value, config)
+        self._db_set(key, value, model, config)
+        with self._lock:
+            self.stats['writes'] += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+        from .models import AIResponseCache
+        try:
+            AIResponseCache.objects.filter(key=key).delete()
+        except DatabaseError:
+            pass  # Like get/set: the cache never breaks the call it serves
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_ratio'] = round((lookups - stats['misses']) / lookups, 3) if lookups else 0.0
+        return stats
+
+    # --- Memory tier ---
+    def _memory_set(self, key, value, config, ttl=None):
+        expires_at = time.time() + (config['TTL_SECONDS'] if ttl is None else ttl)
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > config['MEMORY_MAX_ENTRIES']:
+                self._memory.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    # --- DB tier ---
+    def _db_get(self, keys, config=None):
+        """
+        The unexpired row of the first of `keys` that has one (response
+        and expires_at loaded), or None.
+        """
+        from .models import AIResponseCache
+        config = config or cache_settings()
+        now = timezone.now()
+        try:
+            rows = {
+                row.key: row for row in AIResponseCache.objects.filter(key__in=keys, expires_at__gt=now).only(
+                    'key', 'response', 'expires_at', 'last_hit_at',
+                )
+            }
+        except DatabaseError:
+            return None
+        row = next((rows[key] for key in keys if key in rows), None)
+        if row is None:
+            return None
+        # Touch for LRU-style pruning, but not on every hit: each touch is a
+        # write, and pruning only needs minute-level recency
+        stale = now - timedelta(seconds=config['TOUCH_INTERVAL'])
+        if row.last_hit_at < stale:
+            try:
+                AIResponseCache.objects.filter(key=row.key, last_hit_at__lt=stale).update(last_hit_at=now)
+            except DatabaseError:
+                pass  # A lost touch is harmless
+        return row
+
+    def _db_set(self, key, value, model, config):
+        from .models import AIResponseCache
+        now = timezone.now()
+        try:
+            AIResponseCache.objects.update_or_create(
+                key=key,
+                defaults={
+                    'model': model,
+                    'response': value,
+                    'expires_at': now + timedelta(seconds=config['TTL_SECONDS']),
+                    'last_hit_at': now,
+                }
+            )
+        except DatabaseError:
+            return
+
+        with self._lock:
+            self._writes += 1
+            should_prune = self._writes % config['DB_PRUNE_EVERY'] == 1
+        if should_prune:
+            self.prune(config)
+
+    def prune(self, config=None):
+        """
+        Deletes expired rows, then trims the table to DB_MAX_ENTRIES
+        by dropping the least recently used entries.
+        """
+        from .models import AIResponseCache
+        config = config or cache_settings()
+        removed, _ = AIResponseCache.objects.filter(expires_at__lte=timezone.now()).delete()
+
+        overflow = AIResponseCache.objects.count() - config['DB_MAX_ENTRIES']
+        if overflow > 0:
+            stale_keys = list(
+                AIResponseCache.objects.order_by('last_hit_at').values_list('key', flat=True)[:overflow]
+            )
+            extra, _ = AIResponseCache.objects.filter(key__in=stale_keys).delete()
+            removed += extra
+
+        with self._lock:
+            self.stats['evictions'] += removed
+        return removed
+
+
+# Process-wide singleton shared by every AIService instance
+response_cache = LLMResponseCache()
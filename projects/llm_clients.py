@@ -0,0 +1,220 @@
+"""
+Process-wide registry of pooled OpenAI-compatible clients.
+
+Building an OpenAI client per request also builds a new HTTP connection
+pool, so every AI call paid for a fresh TCP + TLS handshake. Clients
+here are created once per (base_url, api_key, headers) and share a
+keep-alive httpx pool sized from settings.AI_HTTP_POOL.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import weakref
+
+import httpx
+from django.conf import settings
+from openai import AsyncOpenAI, OpenAI
+
+DEFAULTS = {
+    'MAX_CONNECTIONS': 20,
+    'MAX_KEEPALIVE_CONNECTIONS': 10,
+    'KEEPALIVE_EXPIRY': 60.0,
+    'CONNECT_TIMEOUT': 10.0,
+    'READ_TIMEOUT': 120.0,
+    'WRITE_TIMEOUT': 30.0,
+    'POOL_TIMEOUT': 30.0,
+}
+
+
+def pool_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AI_HTTP_POOL', {}))
+    return config
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connection(self):
+        with self._lock:
+            self.connections_opened += 1
+
+
+class InstrumentedTransport(httpx.HTTPTransport):
+    """
+    httpx transport that counts requests and newly opened connections
+    (via httpcore trace events) so we can report the pool reuse ratio.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def handle_request(self, request):
+        self.stats.record_request()
+        parent_trace = request.extensions.get('trace')
+
+        def trace(event_name, info):
+            if event_name == 'connection.connect_tcp.complete':
+                self.stats.record_connection()
+            if parent_trace is not None:
+                parent_trace(event_name, info)
+
+        request.extensions['trace'] = trace
+        return super().handle_request(request)
+
+    def snapshot(self):
+        connections = list(getattr(self._pool, 'connections', []))
+        in_use = sum(1 for conn in connections if not conn.is_idle())
+        requests = self.stats.requests
+        opened = self.stats.connections_opened
+        return {
+            'requests': requests,
+            'connections_opened': opened,
+            'connections_open': len(connections),
+            'connections_in_use': in_use,
+            'reuse_ratio': round(1 - opened / requests, 3) if requests else 0.0,
+        }
+
+
+_clients = {}
+_transports = {}
+_lock = threading.Lock()
+
+
+def _build_http_client(config):
+    transport = InstrumentedTransport(
+        limits=httpx.Limits(
+            max_connections=config['MAX_CONNECTIONS'],
+            max_keepalive_connections=config['MAX_KEEPALIVE_CONNECTIONS'],
+            keepalive_expiry=config['KEEPALIVE_EXPIRY'],
+        ),
+    )
+    timeout = httpx.Timeout(
+        connect=config['CONNECT_TIMEOUT'],
+        read=config['READ_TIMEOUT'],
+        write=config['WRITE_TIMEOUT'],
+        pool=config['POOL_TIMEOUT'],
+    )
+    return httpx.Client(transport=transport, timeout=timeout), transport
+
+
+def get_client(base_url, api_key, default_headers=None):
+    """
+    Returns the shared OpenAI client for this endpoint + credentials,
+    creating it (and its connection pool) on first use.
+    """
+    key = (base_url, api_key, tuple(sorted((default_headers or {}).items())))
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            http_client, transport = _build_http_client(pool_settings())
+            client = OpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                default_headers=default_headers,
+                http_client=http_client,
+            )
+            _clients[key] = client
+            _transports[key] = transport
+    return client
+
+
+# Async clients: an httpx.AsyncClient's connections belong to the event
+# loop that opened them, so there is one pool per (loop, endpoint). Under
+# ASGI that is one loop per worker; the entries go away with their loop.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client(base_url, api_key, default_headers=None):
+    """
+    AsyncOpenAI counterpart of get_client() for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    key = (base_url, api_key, tuple(sorted((default_headers or {}).items())))
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            config = pool_settings()
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=config['MAX_CONNECTIONS'],
+                    max_keepalive_connections=config['MAX_KEEPALIVE_CONNECTIONS'],
+                    keepalive_expiry=config['KEEPALIVE_EXPIRY'],
+                ),
+                timeout=httpx.Timeout(
+                    connect=config['CONNECT_TIMEOUT'],
+                    read=config['READ_TIMEOUT'],
+                    write=config['WRITE_TIMEOUT'],
+                    pool=config['POOL_TIMEOUT'],
+                ),
+            )
+            client = clients[key] = AsyncOpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                default_headers=default_headers,
+                http_client=http_client,
+            )
+    return client
+
+
+def pool_label(key):
+    """
+    Readable name for a pool key: the endpoint plus a short fingerprint
+    of its credentials and headers (never the API key itself).
+    """
+    base_url, api_key, headers = key
+    fingerprint = hashlib.sha256(repr((api_key, headers)).encode()).hexdigest()[:8]
+    return f"{base_url} [{fingerprint}]"
+
+
+def pool_stats():
+    """
+    Per-pool metrics (one pool per endpoint + credentials + headers):
+    connections in use/open and reuse ratio.
+    """
+    with _lock:
+        items = list(_transports.items())
+    return {pool_label(key): transport.snapshot() for key, transport in items}
+
+
+def reset_clients(close=True):
+    """
+    Drops every pooled client. close=False is used after fork: the child
+    must not close sockets that still belong to the parent.
+    """
+    global _lock
+    if close:
+        with _lock:
+            clients = list(_clients.values())
+            _clients.clear()
+            _transports.clear()
+            _async_clients.clear()
+        for client in clients:
+            client.close()
+        return
+
+    # After fork the lock may have been held by a parent thread
+    _lock = threading.Lock()
+    _clients.clear()
+    _transports.clear()
+    _async_clients.clear()
+
+
+# gunicorn --preload (and our job worker) fork after import; give each
+# child its own pools instead of sharing the parent's sockets.
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=lambda: reset_clients(close=False))
@@ -0,0 +1,278 @@
+import json
+import math
+import secrets
+import threading
+import time
+from collections import defaultdict
+
+import httpx
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.constants import DOC_SECTIONS, FLOW_STAGES
+from projects.models import Project
+from projects.questions import QUESTION_BANK
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def wizard_answers(stage):
+    """
+    Form data answering every question of a stage (first option / 'on').
+    """
+    data = {}
+    for question in QUESTION_BANK[stage]['questions']:
+        qid = question['id']
+        if question['type'] == 'checkbox':
+            data[qid] = question['options'][:1]
+        elif question['type'] == 'boolean':
+            data[qid] = 'on'
+        elif question['type'] == 'select':
+            data[qid] = question['options'][0]
+        else:
+            data[qid] = f"Benchmark {qid}"
+    return data
+
+
+class FlowFailed(Exception):
+    pass
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, endpoint, seconds, ok):
+        with self._lock:
+            if ok:
+                self.timings[endpoint].append(seconds)
+            else:
+                self.errors[endpoint] += 1
+
+
+class SimulatedUser:
+    """
+    One browser session walking wizard -> lock -> generate -> docs -> task board -> task help.
+    """
+
+    def __init__(self, base_url, username, password, recorder, options):
+        self.client = httpx.Client(base_url=base_url, timeout=options['timeout'], follow_redirects=False)
+        self.username = username
+        self.password = password
+        self.recorder = recorder
+        self.sections = options['sections']
+        self.tasks = options['tasks']
+        self.poll_interval = options['poll_interval']
+        self.timeout = options['timeout']
+
+    # --- HTTP helpers ---
+    def csrf(self):
+        return self.client.cookies.get('csrftoken', '')
+
+    def timed(self, endpoint, method, url, ok_statuses, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.client.request(method, url, **kwargs)
+            # Background mode: time until the job finishes, not until it's queued
+            if response.status_code == 202:
+                response = self.wait_for_job(response.json())
+        except (httpx.HTTPError, FlowFailed) as e:
+            self.recorder.add(endpoint, time.perf_counter() - started, ok=False)
+            raise FlowFailed(f"{endpoint}: {e}") from e
+
+        ok = response.status_code in ok_statuses
+        self.recorder.add(endpoint, time.perf_counter() - started, ok=ok)
+        if not ok:
+            raise FlowFailed(f"{endpoint}: HTTP {response.status_code}")
+        return response
+
+    def post_form(self, endpoint, url, data=None, ok_statuses=(302,)):
+        data = dict(data or {}, csrfmiddlewaretoken=self.csrf())
+        return self.timed(endpoint, 'POST', url, ok_statuses, data=data)
+
+    def post_json(self, endpoint, url, body):
+        return self.timed(
+            endpoint, 'POST', url, (200,),
+            content=json.dumps(body),
+            headers={'Content-Type': 'application/json', 'X-CSRFToken': self.csrf()},
+        )
+
+    def wait_for_job(self, job):
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            response = self.client.get(job['status_url'])
+            job = response.json()
+            if job['status'] == 'succeeded':
+                return response
+            if job['status'] == 'failed':
+                raise FlowFailed(f"job failed: {job['error']}")
+            time.sleep(self.poll_interval)
+        raise FlowFailed("job timed out")
+
+    # --- Flow ---
+    def run(self):
+        self.client.get('/accounts/login/')
+        self.post_form('login', '/accounts/login/', {'username': self.username, 'password': self.password})
+
+        self.post_form('create_project', '/projects/create/', {'name': f"Bench {self.username}", 'description': 'Load test'})
+        project = Project.objects.filter(user__username=self.username).order_by('-created_at').first()
+        base = f'/projects/{project.pk}'
+
+        for stage in FLOW_STAGES:
+            self.post_form('wizard', f'{base}/wizard/', wizard_answers(stage))
+        self.post_form('lock', f'{base}/summary/')
+
+        response = self.post_form('generate', f'{base}/generate/')
+        job_id = httpx.URL(response.headers.get('location', '')).params.get('job')
+        if job_id:
+            # Background mode: the redirect only means "queued"
+            started = time.perf_counter()
+            try:
+                self.wait_for_job({'status_url': f'/api/projects/{project.pk}/jobs/{job_id}/'})
+            except (httpx.HTTPError, FlowFailed) as e:
+                self.recorder.add('generate_job', time.perf_counter() - started, ok=False)
+                raise FlowFailed(f"generate_job: {e}") from e
+            self.recorder.add('generate_job', time.perf_counter() - started, ok=True)
+
+        for section in self.sections:
+            self.post_json('get_doc_section', f'{base}/get_doc_section/', {'section': section})
+
+        # Opening the task board batch-generates every guide
+        self.post_json('task_guides', f'{base}/generate_task_guides/', {})
+
+        project.refresh_from_db(fields=['blueprint_data'])
+        tasks = [
+            task
+            for phase in (project.blueprint_data or {}).get('phases', [])
+            for task in phase.get('tasks', [])
+        ]
+        for task in tasks[:self.tasks]:
+            self.post_json('get_task_help', f'{base}/get_task_help/', {'task': task})
+
+    def close(self):
+        self.client.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Drives the full wizard -> lock -> generate -> docs -> task help flow "
+        "with N concurrent users against a running server and reports "
+        "throughput and p50/p95/p99 per endpoint. Run the server against "
+        "the same database (and ideally run_mock_llm) first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--users', type=int, default=10, help="Concurrent simulated users.")
+        parser.add_argument('--rounds', type=int, default=1, help="Flows per user.")
+        parser.add_argument('--sections', default=','.join(DOC_SECTIONS), help="Comma-separated doc sections to open.")
+        parser.add_argument('--tasks', type=int, default=1, help="Task guides to request per flow.")
+        parser.add_argument('--timeout', type=float, default=300, help="Per request (and per job) timeout.")
+        parser.add_argument('--poll-interval', type=float, default=0.5, help="Job polling interval in background mode.")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark users and projects.")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        options['sections'] = [key for key in options['sections'].split(',') if key]
+        unknown = set(options['sections']) - set(DOC_SECTIONS)
+        if unknown:
+            raise CommandError(f"Unknown sections: {', '.join(sorted(unknown))}")
+
+        try:
+            httpx.get(options['base_url'] + '/accounts/login/', timeout=5)
+        except httpx.HTTPError as e:
+            raise CommandError(f"Server not reachable at {options['base_url']}: {e}")
+
+        User = get_user_model()
+        run_id = secrets.token_hex(3)
+        password = secrets.token_urlsafe(12)
+        users = [User.objects.create_user(username=f'bench-{run_id}-{i}', password=password) for i in range(options['users'])]
+
+        recorder = Recorder()
+        failures = []
+        completed = [0]
+        lock = threading.Lock()
+
+        def simulate(user):
+            for _ in range(options['rounds']):
+                session = SimulatedUser(options['base_url'], user.username, password, recorder, options)
+                try:
+                    session.run()
+                    with lock:
+                        completed[0] += 1
+                except Exception as e:
+                    with lock:
+                        failures.append(f"{user.username}: {e}")
+                finally:
+                    session.close()
+
+        if not options['json']:
+            self.stdout.write(f"🏁 {options['users']} user(s) x {options['rounds']} flow(s) against {options['base_url']}")
+        started = time.perf_counter()
+        threads = [threading.Thread(target=simulate, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        if not options['keep']:
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        report = self.build_report(recorder, elapsed, completed[0], failures)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+    def build_report(self, recorder, elapsed, completed, failures):
+        endpoints = {}
+        total_requests = 0
+        for endpoint in sorted(set(recorder.timings) | set(recorder.errors)):
+            values = sorted(recorder.timings[endpoint])
+            count = len(values) + recorder.errors[endpoint]
+            total_requests += count
+            endpoints[endpoint] = {
+                'requests': count,
+                'errors': recorder.errors[endpoint],
+                'throughput_rps': round(count / elapsed, 2) if elapsed else 0,
+                'p50_ms': round(percentile(values, 0.50) * 1000, 1) if values else None,
+                'p95_ms': round(percentile(values, 0.95) * 1000, 1) if values else None,
+                'p99_ms': round(percentile(values, 0.99) * 1000, 1) if values else None,
+                'max_ms': round(values[-1] * 1000, 1) if values else None,
+            }
+        return {
+            'elapsed_s': round(elapsed, 2),
+            'flows_completed': completed,
+            'flows_failed': len(failures),
+            'flows_per_minute': round(completed / elapsed * 60, 2) if elapsed else 0,
+            'requests_per_second': round(total_requests / elapsed, 2) if elapsed else 0,
+            'endpoints': endpoints,
+            'failures': failures[:20],
+        }
+
+    def print_report(self, report):
+        header = f"{'endpoint':<18}{'reqs':>6}{'errs':>6}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, row in report['endpoints'].items():
+            cells = [f"{row[key]:>10}" if row[key] is not None else f"{'-':>10}" for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms')]
+            self.stdout.write(f"{name:<18}{row['requests']:>6}{row['errors']:>6}{row['throughput_rps']:>8}" + ''.join(cells))
+
+        self.stdout.write(
+            f"\n⏱️  {report['elapsed_s']}s, {report['flows_completed']} flow(s) completed, "
+            f"{report['flows_failed']} failed, {report['flows_per_minute']} flows/min, "
+            f"{report['requests_per_second']} req/s"
+        )
+        for failure in report['failures']:
+            self.stdout.write(self.style.ERROR(f"  ✖ {failure}"))
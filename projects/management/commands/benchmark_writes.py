@@ -0,0 +1,134 @@
+import json
+import secrets
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.db.models import F
+from django.utils import timezone
+
+from projects.models import Project
+from projects import sqlite
+from projects.management.commands.benchmark_flow import percentile
+
+MODES = ('direct', 'retry', 'queue')
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks concurrent small writes (wizard-style answer updates) against "
+        "the configured database: plain autocommit UPDATEs, retry_writes(), and "
+        "the single-writer queue. Reports writes/s, latency percentiles and "
+        "'database is locked' errors per mode."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=16, help="Concurrent writer threads.")
+        parser.add_argument('--writes', type=int, default=50, help="Writes per writer.")
+        parser.add_argument('--mode', choices=MODES + ('all',), default='all')
+        parser.add_argument('--payload-bytes', type=int, default=300, help="Size of each answer written.")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark user and projects.")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        user = User.objects.create_user(username=f'bench-writes-{secrets.token_hex(3)}')
+        projects = [Project.objects.create(user=user, name=f'Write benchmark {i}') for i in range(options['writers'])]
+
+        modes = MODES if options['mode'] == 'all' else (options['mode'],)
+        try:
+            report = {
+                'writers': options['writers'],
+                'writes_per_writer': options['writes'],
+                'journal_mode': self.journal_mode(),
+                'modes': {mode: self.run_mode(mode, projects, options) for mode in modes},
+            }
+        finally:
+            if not options['keep']:
+                user.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+    def journal_mode(self):
+        if connection.vendor != 'sqlite':
+            return connection.vendor
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            return cursor.fetchone()[0]
+
+    def run_mode(self, mode, projects, options):
+        answer = 'x' * options['payload_bytes']
+        timings = []
+        errors = []
+        lock = threading.Lock()
+
+        def write_once(project, i):
+            # What FlowEngine does for an answer submit
+            return Project.objects.filter(pk=project.pk).update(
+                requirements_data={'answers': {'intent': {'n': i, 'text': answer}}},
+                version=F('version') + 1,
+                updated_at=timezone.now(),
+            )
+
+        if mode == 'direct':
+            run = write_once
+        elif mode == 'retry':
+            run = sqlite.retry_writes(write_once)
+        else:
+            queue = sqlite.write_queue()
+            run = lambda project, i: queue.submit(write_once, project, i).result()
+
+        def writer(project):
+            try:
+                for i in range(options['writes']):
+                    started = time.perf_counter()
+                    try:
+                        run(project, i)
+                        elapsed = time.perf_counter() - started
+                        with lock:
+                            timings.append(elapsed)
+                    except OperationalError as e:
+                        with lock:
+                            errors.append(str(e))
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=writer, args=(project,)) for project in projects]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        timings.sort()
+        return {
+            'writes': len(timings),
+            'errors': len(errors),
+            'elapsed_s': round(elapsed, 2),
+            'writes_per_second': round(len(timings) / elapsed, 1) if elapsed else 0,
+            'p50_ms': round(percentile(timings, 0.50) * 1000, 2) if timings else None,
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 2) if timings else None,
+            'p99_ms': round(percentile(timings, 0.99) * 1000, 2) if timings else None,
+            'max_ms': round(timings[-1] * 1000, 2) if timings else None,
+            'sample_error': errors[0] if errors else None,
+        }
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"✍️  {report['writers']} writer(s) x {report['writes_per_writer']} write(s), "
+            f"journal_mode={report['journal_mode']}"
+        )
+        header = f"{'mode':<8}{'writes':>8}{'errors':>8}{'w/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for mode, row in report['modes'].items():
+            cells = [f"{row[key]:>10}" if row[key] is not None else f"{'-':>10}" for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms')]
+            self.stdout.write(f"{mode:<8}{row['writes']:>8}{row['errors']:>8}{row['writes_per_second']:>9}" + ''.join(cells))
+            if row['sample_error']:
+                self.stdout.write(self.style.ERROR(f"  ✖ {row['sample_error']}"))
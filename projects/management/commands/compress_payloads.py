@@ -0,0 +1,71 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import BinaryField, F, Sum
+from django.db.models.functions import Cast, Length
+
+from projects.fields import CompressedJSONField, CompressedTextField
+
+
+def compressed_fields(model):
+    return [field.name for field in model._meta.concrete_fields
+            if isinstance(field, (CompressedJSONField, CompressedTextField))]
+
+
+def stored_bytes(model, fields):
+    totals = model.objects.aggregate(**{
+        name: Sum(Length(Cast(F(name), BinaryField()))) for name in fields
+    })
+    return sum(value or 0 for value in totals.values())
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrites compressed columns (projects/fields.py) in the current format: "
+        "compresses rows stored before the switch and applies AI_COMPRESSION."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help="Rows per transaction.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report the current sizes.")
+        parser.add_argument('--vacuum', action='store_true', help="VACUUM afterwards so the DB file shrinks (SQLite).")
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+
+        for model in apps.get_app_config('projects').get_models():
+            fields = compressed_fields(model)
+            if not fields:
+                continue
+
+            label = model._meta.label
+            before = stored_bytes(model, fields)
+            if options['dry_run']:
+                self.stdout.write(f"{label} ({', '.join(fields)}): {before:,} bytes")
+                continue
+
+            rows = 0
+            last_pk = None
+            while True:
+                # Keyset batches: each one is a short write transaction
+                batch = model.objects.order_by('pk').only('pk', *fields)
+                if last_pk is not None:
+                    batch = batch.filter(pk__gt=last_pk)
+                batch = list(batch[:batch_size])
+                if not batch:
+                    break
+                with transaction.atomic():
+                    for obj in batch:
+                        # update() re-encodes the values and leaves auto_now fields alone
+                        model.objects.filter(pk=obj.pk).update(**{name: getattr(obj, name) for name in fields})
+                rows += len(batch)
+                last_pk = batch[-1].pk
+
+            after = stored_bytes(model, fields)
+            saved = 100 * (before - after) / before if before else 0
+            self.stdout.write(f"{label}: {rows} rows, {before:,} -> {after:,} bytes ({saved:.0f}% smaller)")
+
+        if options['vacuum'] and not options['dry_run'] and connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+            self.stdout.write("VACUUM done.")
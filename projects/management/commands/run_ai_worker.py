@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+
+from projects import jobs
+
+
+class Command(BaseCommand):
+    help = "Processes queued AI jobs (blueprints, doc sections, task guides)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help="Worker processes to fork.")
+        parser.add_argument('--threads', type=int, default=4, help="Worker threads per process.")
+        parser.add_argument('--poll-interval', type=float, default=None, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--lease-seconds', type=int, default=None, help="How long a claimed job stays leased.")
+        parser.add_argument('--once', action='store_true', help="Drain the queue, then exit.")
+
+    def handle(self, *args, **options):
+        config = jobs.job_settings()
+        self.poll_interval = options['poll_interval'] or config['POLL_INTERVAL']
+        self.lease_seconds = options['lease_seconds'] or config['LEASE_SECONDS']
+        self.threads = max(1, options['threads'])
+        self.once = options['once']
+
+        processes = max(1, options['processes'])
+        self.stdout.write(f"🛠️  AI worker: {processes} process(es) x {self.threads} thread(s)")
+
+        if processes == 1:
+            self.run_process()
+            return
+
+        # Children must not share the parent's DB connection
+        connections.close_all()
+        children = [multiprocessing.Process(target=self.run_process) for _ in range(processes)]
+        for child in children:
+            child.start()
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            for child in children:
+                child.terminate()
+
+    def run_process(self):
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+        workers = [
+            threading.Thread(target=self.run_thread, args=(stop, f"{socket.gethostname()}:{os.getpid()}:{i}"), daemon=True)
+            for i in range(self.threads)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(timeout=0.5)
+        except KeyboardInterrupt:
+            stop.set()
+
+    def run_thread(self, stop, worker_id):
+        try:
+            while not stop.is_set():
+                job = jobs.claim_next(worker_id, lease_seconds=self.lease_seconds)
+                if job is None:
+                    if self.once:
+                        return
+                    stop.wait(self.poll_interval)
+                    continue
+
+                self.stdout.write(f"▶ {worker_id} {job.kind} {job.pk} (attempt {job.attempts})")
+                job = jobs.run_job(job, lease_seconds=self.lease_seconds)
+                self.stdout.write(f"  {job.kind} {job.pk} -> {job.status}")
+        finally:
+            connection.close()
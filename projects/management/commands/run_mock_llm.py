@@ -0,0 +1,255 @@
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+from projects.providers import stub_content
+
+
+class MockLLM:
+    """
+    Behaviour of the mock server (latency, token rate, faults).
+    """
+
+    def __init__(self, options):
+        self.latency = options['latency_ms'] / 1000
+        self.distribution = options['latency_dist']
+        self.spread = options['latency_spread']
+        self.tokens_per_second = options['tokens_per_second']
+        self.completion_tokens = options['completion_tokens']
+        self.think_tokens = options['think_tokens']
+        self.truncate_rate = options['truncate_rate']
+        self.rate_429 = options['rate_429']
+        self.retry_after = options['retry_after']
+        self.max_rpm = options['max_rpm']
+        self.random = random.Random(options['seed'])
+        self._lock = threading.Lock()
+        self._recent = deque()  # Request timestamps for --max-rpm
+        self._prefixes = OrderedDict()  # System prompts seen (simulated prefix cache)
+
+    def first_token_delay(self):
+        with self._lock:
+            if self.distribution == 'uniform':
+                delay = self.random.uniform(self.latency * (1 - self.spread), self.latency * (1 + self.spread))
+            elif self.distribution == 'lognormal':
+                # Median = --latency-ms, long right tail controlled by spread (sigma)
+                delay = self.random.lognormvariate(math.log(max(self.latency, 1e-6)), self.spread)
+            elif self.distribution == 'exponential':
+                delay = self.random.expovariate(1 / self.latency) if self.latency else 0
+            else:
+                delay = self.latency
+        return max(0.0, delay)
+
+    def should_reject(self):
+        """
+        Returns seconds for Retry-After if this request gets a 429.
+        """
+        with self._lock:
+            if self.max_rpm:
+                now = time.monotonic()
+                while self._recent and now - self._recent[0] > 60:
+                    self._recent.popleft()
+                if len(self._recent) >= self.max_rpm:
+                    return max(1, int(60 - (now - self._recent[0])) + 1)
+                self._recent.append(now)
+            if self.rate_429 and self.random.random() < self.rate_429:
+                return self.retry_after
+        return None
+
+    def usage(self, messages, content):
+        """
+        Token usage, reporting a system prompt seen before as cached (in
+        64-token blocks, like DeepSeek; in both OpenAI and DeepSeek fields).
+        """
+        prompt_tokens = sum(len(m.get('content') or '') for m in messages) // 4
+        completion_tokens = len(content) // 4
+        system = next((m.get('content') or '' for m in messages if m.get('role') == 'system'), '')
+        digest = hashlib.sha256(system.encode('utf-8')).hexdigest()
+        with self._lock:
+            hit = digest in self._prefixes
+            self._prefixes[digest] = True
+            self._prefixes.move_to_end(digest)
+            if len(self._prefixes) > 1000:
+                self._prefixes.popitem(last=False)
+        cached = (len(system) // 4) // 64 * 64 if hit else 0
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': cached},
+            'prompt_cache_hit_tokens': cached,
+            'prompt_cache_miss_tokens': prompt_tokens - cached,
+        }
+
+    def completion(self, messages):
+        """
+        -> (content, finish_reason)
+        """
+        content = stub_content(messages, tokens=self.completion_tokens)
+        if self.think_tokens:
+            content = f"<think>{'Reasoning about the request. ' * max(1, self.think_tokens // 5)}</think>\n{content}"
+
+        with self._lock:
+            truncate = self.truncate_rate and self.random.random() < self.truncate_rate
+            cut = self.random.randint(len(content) // 4, len(content) * 3 // 4) if truncate else None
+        if truncate:
+            return content[:cut], 'length'
+        return content, 'stop'
+
+
+def _pieces(content, size=16):
+    # ~4 chars per token; stream a few tokens per chunk
+    return [content[i:i + size] for i in range(0, len(content), size)]
+
+
+def make_handler(llm, quiet):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            if not quiet:
+                super().log_message(format, *args)
+
+        def _json(self, status, body, headers=None):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path.rstrip('/') in ('/health', '/v1/health'):
+                self._json(200, {'status': 'ok'})
+            elif self.path.rstrip('/') == '/v1/models':
+                self._json(200, {'object': 'list', 'data': [{'id': 'mock-model', 'object': 'model', 'owned_by': 'mock'}]})
+            else:
+                self._json(404, {'error': {'message': 'Not found'}})
+
+        def do_POST(self):
+            if self.path.rstrip('/') != '/v1/chat/completions':
+                self._json(404, {'error': {'message': 'Not found'}})
+                return
+
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                request = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self._json(400, {'error': {'message': 'Invalid JSON'}})
+                return
+
+            retry_after = llm.should_reject()
+            if retry_after is not None:
+                self._json(429, {'error': {'message': 'Rate limit exceeded (mock)', 'type': 'rate_limit'}},
+                           headers={'Retry-After': str(retry_after)})
+                return
+
+            messages = request.get('messages', [])
+            model = request.get('model', 'mock-model')
+            content, finish_reason = llm.completion(messages)
+            usage = llm.usage(messages, content)
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+
+            time.sleep(llm.first_token_delay())
+            if request.get('stream'):
+                include_usage = (request.get('stream_options') or {}).get('include_usage')
+                self._stream(completion_id, model, content, finish_reason, usage if include_usage else None)
+                return
+
+            if llm.tokens_per_second:
+                time.sleep(usage['completion_tokens'] / llm.tokens_per_second)
+            self._json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': finish_reason}],
+                'usage': usage,
+            })
+
+        def _stream(self, completion_id, model, content, finish_reason, usage=None):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+
+            def send(delta, finish=None, usage=None):
+                chunk = {
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [] if usage else [{'index': 0, 'delta': delta, 'finish_reason': finish}],
+                }
+                if usage:
+                    chunk['usage'] = usage
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+
+            try:
+                send({'role': 'assistant', 'content': ''})
+                for piece in _pieces(content):
+                    if llm.tokens_per_second:
+                        time.sleep((len(piece) / 4) / llm.tokens_per_second)
+                    send({'content': piece})
+                send({}, finish=finish_reason)
+                if usage:
+                    send({}, usage=usage)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # Client cancelled the stream
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a local OpenAI-compatible mock LLM for load tests. "
+        "Point the app at it with AI_MOCK_LLM_URL=http://127.0.0.1:8001/v1"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency-ms', type=float, default=800, help="Time to first token (median for lognormal).")
+        parser.add_argument('--latency-dist', choices=['fixed', 'uniform', 'lognormal', 'exponential'], default='lognormal')
+        parser.add_argument('--latency-spread', type=float, default=0.5,
+                            help="uniform: +/- fraction of the latency; lognormal: sigma.")
+        parser.add_argument('--tokens-per-second', type=float, default=60, help="Generation speed (0 = instant).")
+        parser.add_argument('--completion-tokens', type=int, default=600, help="Approximate length of markdown answers.")
+        parser.add_argument('--think-tokens', type=int, default=0, help="Prepend a <think> block of about this many tokens.")
+        parser.add_argument('--truncate-rate', type=float, default=0.0, help="Fraction of answers cut off (finish_reason=length).")
+        parser.add_argument('--rate-429', type=float, default=0.0, help="Fraction of requests rejected with 429.")
+        parser.add_argument('--retry-after', type=int, default=2, help="Retry-After seconds sent with injected 429s.")
+        parser.add_argument('--max-rpm', type=int, default=0, help="Reject with 429 above this many requests/minute (0 = off).")
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--quiet', action='store_true', help="Don't log each request.")
+
+    def handle(self, *args, **options):
+        llm = MockLLM(options)
+        server = ThreadingHTTPServer((options['host'], options['port']), make_handler(llm, options['quiet']))
+        server.daemon_threads = True
+
+        self.stdout.write(
+            f"🤖 Mock LLM on http://{options['host']}:{options['port']}/v1 "
+            f"({options['latency_dist']} {options['latency_ms']:.0f}ms, {options['tokens_per_second']:g} tok/s, "
+            f"429 rate {options['rate_429']:g}, truncate rate {options['truncate_rate']:g})"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,355 @@
+"""
+LLM call instrumentation.
+
+AIService reports every call here (record_call): wall time, time to
+first token (streams), tokens by type, finish reason and cost, labelled
+by provider, model and prompt. Values live in in-memory histograms /
+counters exported in Prometheus text format at /metrics, and a daemon
+thread rolls them up into LLMCallRollup rows every
+AI_METRICS['ROLLUP_INTERVAL'] seconds for history.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ROLLUP_INTERVAL': 60,  # Seconds between DB rollups (0 = off)
+    'TOKEN': '',            # Bearer token for /metrics scrapers (staff can always read it)
+}
+
+# Seconds; LLM calls run from sub-second (cache-warm) to minutes
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, 300)
+TOKEN_TYPES = ('prompt', 'completion', 'reasoning', 'cached')
+LABELS = ('provider', 'model', 'prompt')
+
+
+def metrics_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AI_METRICS', {}))
+    return config
+
+
+# --- Metric types ---
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[tuple(labels)] += amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_text(self.labels, labels)} {value:g}" for labels, value in items]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.setdefault(tuple(labels), [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        lines = []
+        for labels, series in items:
+            names = self.labels + ('le',)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_label_text(names, labels + (f'{bound:g}',))} {count}")
+            lines.append(f"{self.name}_bucket{_label_text(names, labels + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, labels)} {series[-2]:g}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, labels)} {series[-1]}")
+        return lines
+
+
+class Collected:
+    """
+    Values kept elsewhere, read at scrape time: `collect()` returns
+    {label value: number} (or a number when there is no label).
+    """
+
+    def __init__(self, name, help_text, label, collect, kind='counter'):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.collect = collect
+        self.kind = kind
+
+    def render(self):
+        values = self.collect()
+        if self.label is None:
+            return [f"{self.name} {values:g}"]
+        return [f"{self.name}{_label_text((self.label,), (key,))} {value:g}" for key, value in sorted(values.items())]
+
+
+# Response cache (llm_cache.py) counters, read at scrape time
+def _cache_lookups():
+    from .llm_cache import response_cache
+    stats = response_cache.get_stats()
+    return {'memory_hit': stats['memory_hits'], 'db_hit': stats['db_hits'], 'miss': stats['misses']}
+
+
+def _cache_operations():
+    from .llm_cache import response_cache
+    stats = response_cache.get_stats()
+    return {'write': stats['writes'], 'eviction': stats['evictions']}
+
+
+def _cache_memory_entries():
+    from .llm_cache import response_cache
+    return response_cache.get_stats()['memory_entries']
+
+
+# --- Registry ---
+REQUEST_DURATION = Histogram(
+    'apprompty_llm_request_duration_seconds', "Wall time of LLM calls.", LABELS + ('outcome',))
+TIME_TO_FIRST_TOKEN = Histogram(
+    'apprompty_llm_time_to_first_token_seconds', "Time until the first streamed token.", LABELS)
+REQUESTS = Counter(
+    'apprompty_llm_requests_total', "LLM calls by finish reason ('error' if the call failed).",
+    LABELS + ('finish_reason',))
+TOKENS = Counter(
+    'apprompty_llm_tokens_total', "Tokens by type (prompt, completion, reasoning, cached prompt).",
+    LABELS + ('type',))
+COST = Counter('apprompty_llm_cost_usd_total', "Estimated spend from AI_PRICING.", LABELS)
+CACHE_HITS = Counter('apprompty_llm_response_cache_hits_total', "Calls served from the response cache.", ('prompt',))
+CACHE_LOOKUPS = Collected(
+    'apprompty_llm_response_cache_lookups_total', "Response cache lookups by result.", 'result', _cache_lookups)
+CACHE_OPERATIONS = Collected(
+    'apprompty_llm_response_cache_operations_total', "Response cache writes and evictions.", 'operation', _cache_operations)
+CACHE_MEMORY_ENTRIES = Collected(
+    'apprompty_llm_response_cache_memory_entries', "Entries in this process's in-memory cache tier.",
+    None, _cache_memory_entries, kind='gauge')
+
+METRICS = [
+    REQUEST_DURATION, TIME_TO_FIRST_TOKEN, REQUESTS, TOKENS, COST,
+    CACHE_HITS, CACHE_LOOKUPS, CACHE_OPERATIONS, CACHE_MEMORY_ENTRIES,
+]
+
+
+def render_prometheus():
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# --- Usage & cost ---
+def usage_tokens(usage):
+    """
+    {type: count} from an OpenAI-style usage object (or dict).
+    """
+    def get(source, name):
+        if source is None:
+            return None
+        return source.get(name) if isinstance(source, dict) else getattr(source, name, None)
+
+    completion_details = get(usage, 'completion_tokens_details')
+    prompt_details = get(usage, 'prompt_tokens_details')
+    return {
+        'prompt': get(usage, 'prompt_tokens') or 0,
+        'completion': get(usage, 'completion_tokens') or 0,
+        'reasoning': get(completion_details, 'reasoning_tokens') or 0,
+        # OpenAI / OpenRouter field, else DeepSeek's
+        'cached': get(prompt_details, 'cached_tokens') or get(usage, 'prompt_cache_hit_tokens') or 0,
+    }
+
+
+def call_cost(model, tokens):
+    """
+    USD for one call from AI_PRICING ({model: per-million prices}).
+    Unknown models cost 0.
+    """
+    prices = getattr(settings, 'AI_PRICING', {}).get(model)
+    if not prices:
+        return 0.0
+    cached = tokens['cached']
+    prompt_price = prices.get('prompt', 0)
+    cost = (tokens['prompt'] - cached) * prompt_price
+    cost += cached * prices.get('cached_prompt', prompt_price)
+    cost += tokens['completion'] * prices.get('completion', 0)
+    return cost / 1_000_000
+
+
+# --- Recording ---
+_pending = {}  # (period, provider, model, prompt) -> totals since the last rollup
+_pending_lock = threading.Lock()
+
+
+def record_call(provider, model, prompt, seconds, usage=None, finish_reason=None, ttft=None, error=None):
+    """
+    Records one finished (or failed) LLM call.
+    """
+    labels = (provider or 'unknown', model or 'unknown', prompt or 'adhoc')
+    tokens = usage_tokens(usage)
+    cost = call_cost(model, tokens)
+    outcome = 'error' if error else 'ok'
+
+    REQUEST_DURATION.observe(labels + (outcome,), seconds)
+    if ttft is not None:
+        TIME_TO_FIRST_TOKEN.observe(labels, ttft)
+    REQUESTS.inc(labels + ('error' if error else (finish_reason or 'unknown'),))
+    for token_type in TOKEN_TYPES:
+        if tokens[token_type]:
+            TOKENS.inc(labels + (token_type,), tokens[token_type])
+    if cost:
+        COST.inc(labels, cost)
+
+    period = timezone.now().replace(second=0, microsecond=0)
+    with _pending_lock:
+        row = _pending.setdefault((period,) + labels, defaultdict(float))
+        row['calls'] += 1
+        row['errors'] += 1 if error else 0
+        row['total_seconds'] += seconds
+        row['max_seconds'] = max(row['max_seconds'], seconds)
+        for token_type in TOKEN_TYPES:
+            row[f'{token_type}_tokens'] += tokens[token_type]
+        row['cost_usd'] += cost
+    _ensure_rollup_thread()
+
+
+def record_cache_hit(prompt):
+    CACHE_HITS.inc((prompt or 'adhoc',))
+
+
+class CallTimer:
+    """
+    Times one call; `first_token()` marks the first streamed token.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.ttft = None
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+# --- Rollup ---
+def _merge_pending(rows):
+    """
+    Puts unwritten rollup rows back, adding to what arrived meanwhile.
+    """
+    with _pending_lock:
+        for key, row in rows:
+            target = _pending.setdefault(key, defaultdict(float))
+            for name, value in row.items():
+                if name == 'max_seconds':
+                    target[name] = max(target[name], value)
+                else:
+                    target[name] += value
+
+
+def flush_rollup():
+    """
+    Writes the totals gathered since the last flush to LLMCallRollup
+    (adding to rows of the same minute). Returns the rows written.
+    Each row is written in its own transaction; if one fails (e.g.
+    "database is locked"), it and the rest go back to the pending set
+    for the next flush.
+    """
+    from django.db import transaction
+    from django.db.models import F
+    from .models import LLMCallRollup
+
+    with _pending_lock:
+        pending = list(_pending.items())
+        _pending.clear()
+
+    integer_fields = {'calls', 'errors'} | {f'{token_type}_tokens' for token_type in TOKEN_TYPES}
+    for index, ((period, provider, model, prompt), row) in enumerate(pending):
+        counts = {key: value for key, value in row.items() if key != 'max_seconds'}
+        counts = {key: int(value) if key in integer_fields else value for key, value in counts.items()}
+        key = {'period_start': period, 'provider': provider, 'model': model, 'prompt': prompt}
+        try:
+            with transaction.atomic():
+                updated = LLMCallRollup.objects.filter(**key).update(**{name: F(name) + value for name, value in counts.items()})
+                if updated:
+                    LLMCallRollup.objects.filter(max_seconds__lt=row['max_seconds'], **key).update(max_seconds=row['max_seconds'])
+                else:
+                    LLMCallRollup.objects.create(max_seconds=row['max_seconds'], **key, **counts)
+        except Exception:
+            _merge_pending(pending[index:])
+            raise
+    return len(pending)
+
+
+_rollup_thread = None
+_rollup_lock = threading.Lock()
+
+
+def _rollup_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush_rollup()
+        except Exception as e:  # Never let the loop die; retry next round
+            logger.warning(f"LLM metrics rollup failed: {e}")
+        finally:
+            connection.close()
+
+
+def _ensure_rollup_thread():
+    global _rollup_thread
+    interval = metrics_settings()['ROLLUP_INTERVAL']
+    if not interval or _rollup_thread is not None:
+        return
+    with _rollup_lock:
+        if _rollup_thread is None:
+            _rollup_thread = threading.Thread(target=_rollup_loop, args=(interval,), name='llm-metrics-rollup', daemon=True)
+            _rollup_thread.start()
+            atexit.register(_flush_at_exit)
+
+
+def _flush_at_exit():
+    try:
+        flush_rollup()
+    except Exception:  # Interpreter shutting down; best effort
+        pass
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0003_remove_project_documentation_md_project_docs_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIResponseCache',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('model', models.CharField(blank=True, max_length=255)),
+                ('response', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('last_hit_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'AI Response Cache Entry',
+                'verbose_name_plural': 'AI Response Cache',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0005_ai_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='aijob',
+            name='kind',
+            field=models.CharField(choices=[('blueprint', 'Blueprint'), ('speculative_blueprint', 'Speculative Blueprint'), ('doc_section', 'Documentation Section'), ('task_guide', 'Task Guide')], max_length=50),
+        ),
+    ]
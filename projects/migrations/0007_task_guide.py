@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0006_aijob_speculative_blueprint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='aijob',
+            name='kind',
+            field=models.CharField(choices=[('blueprint', 'Blueprint'), ('speculative_blueprint', 'Speculative Blueprint'), ('doc_section', 'Documentation Section'), ('task_guide', 'Task Guide'), ('task_guides', 'Task Guides (batch)')], max_length=50),
+        ),
+        migrations.CreateModel(
+            name='TaskGuide',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('blueprint_hash', models.CharField(max_length=64)),
+                ('task_key', models.CharField(max_length=64)),
+                ('task', models.TextField()),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='task_guides', to='projects.project')),
+            ],
+            options={
+                'verbose_name': 'Task Guide',
+                'verbose_name_plural': 'Task Guides',
+                'constraints': [models.UniqueConstraint(fields=('project', 'blueprint_hash', 'task_key'), name='unique_task_guide')],
+            },
+        ),
+    ]
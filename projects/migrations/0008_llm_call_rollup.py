@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0007_task_guide'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCallRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateTimeField()),
+                ('provider', models.CharField(max_length=50)),
+                ('model', models.CharField(max_length=255)),
+                ('prompt', models.CharField(max_length=100)),
+                ('calls', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+                ('total_seconds', models.FloatField(default=0)),
+                ('max_seconds', models.FloatField(default=0)),
+                ('prompt_tokens', models.PositiveBigIntegerField(default=0)),
+                ('completion_tokens', models.PositiveBigIntegerField(default=0)),
+                ('reasoning_tokens', models.PositiveBigIntegerField(default=0)),
+                ('cached_tokens', models.PositiveBigIntegerField(default=0)),
+                ('cost_usd', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'LLM Call Rollup',
+                'verbose_name_plural': 'LLM Call Rollups',
+                'constraints': [models.UniqueConstraint(fields=('period_start', 'provider', 'model', 'prompt'), name='unique_llm_rollup')],
+            },
+        ),
+    ]
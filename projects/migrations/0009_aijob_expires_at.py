@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0008_llm_call_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aijob',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
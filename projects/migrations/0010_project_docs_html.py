@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0009_aijob_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='docs_html',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:29
+
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_docs_to_sections(apps, schema_editor):
+    """
+    Project.docs_data / docs_html -> one DocSection row per section.
+    HTML is kept only if it was rendered from the same markdown; the
+    rest is rendered on first read.
+    """
+    Project = apps.get_model('projects', 'Project')
+    DocSection = apps.get_model('projects', 'DocSection')
+
+    for project in Project.objects.exclude(docs_data={}).only('id', 'docs_data', 'docs_html').iterator():
+        rendered = project.docs_html or {}
+        sections = []
+        for key, md_content in (project.docs_data or {}).items():
+            md_content = md_content if isinstance(md_content, str) else str(md_content)
+            entry = rendered.get(key) or {}
+            sections.append(DocSection(
+                project_id=project.pk,
+                key=key[:64],
+                markdown=md_content,
+                html=entry.get('html', ''),
+                html_key=entry.get('key', ''),
+                content_hash=hashlib.sha256(md_content.encode('utf-8')).hexdigest(),
+            ))
+        DocSection.objects.bulk_create(sections, ignore_conflicts=True)
+
+
+def move_sections_to_docs(apps, schema_editor):
+    Project = apps.get_model('projects', 'Project')
+    DocSection = apps.get_model('projects', 'DocSection')
+
+    docs = {}
+    for section in DocSection.objects.order_by('id').iterator():
+        project_docs = docs.setdefault(section.project_id, ({}, {}))
+        project_docs[0][section.key] = section.markdown
+        if section.html:
+            project_docs[1][section.key] = {'key': section.html_key, 'html': section.html}
+    for project_id, (docs_data, docs_html) in docs.items():
+        Project.objects.filter(pk=project_id).update(docs_data=docs_data, docs_html=docs_html)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0012_project_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocSection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('markdown', models.TextField()),
+                ('html', models.TextField(blank=True)),
+                ('html_key', models.CharField(blank=True, max_length=32)),
+                ('content_hash', models.CharField(blank=True, max_length=64)),
+                ('context_hash', models.CharField(blank=True, max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='doc_sections', to='projects.project')),
+            ],
+            options={
+                'verbose_name': 'Doc Section',
+                'verbose_name_plural': 'Doc Sections',
+                'constraints': [models.UniqueConstraint(fields=('project', 'key'), name='unique_doc_section')],
+            },
+        ),
+        migrations.RunPython(move_docs_to_sections, move_sections_to_docs),
+        migrations.RemoveField(
+            model_name='project',
+            name='docs_data',
+        ),
+        migrations.RemoveField(
+            model_name='project',
+            name='docs_html',
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:31
+
+import projects.fields
+from django.db import migrations
+
+
+def unpack_payloads(apps, schema_editor):
+    """
+    Rollback: rewrites the compressed values as plain text/JSON so the
+    TextField/JSONField columns of 0013 can read them again. Runs before
+    the columns are switched back (operations are undone in reverse).
+    """
+    connection = schema_editor.connection
+    qn = connection.ops.quote_name
+    columns = {
+        apps.get_model('projects', 'DocSection')._meta.db_table: ('markdown', 'html'),
+        apps.get_model('projects', 'Project')._meta.db_table: ('requirements_data', 'blueprint_data'),
+    }
+    with connection.cursor() as cursor:
+        for table, names in columns.items():
+            for name in names:
+                cursor.execute(f"SELECT id, {qn(name)} FROM {qn(table)} WHERE {qn(name)} IS NOT NULL")
+                rows = [
+                    (projects.fields.unpack(value), pk) for pk, value in cursor.fetchall()
+                    if not isinstance(value, str)  # Legacy rows are plain text already
+                ]
+                cursor.executemany(f"UPDATE {qn(table)} SET {qn(name)} = %s WHERE id = %s", rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0013_doc_section'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='docsection',
+            name='html',
+            field=projects.fields.CompressedTextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='docsection',
+            name='markdown',
+            field=projects.fields.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='blueprint_data',
+            field=projects.fields.CompressedJSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='requirements_data',
+            field=projects.fields.CompressedJSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(migrations.RunPython.noop, unpack_payloads),
+    ]
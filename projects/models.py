@@ -1,6 +1,19 @@
 import uuid
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .fields import CompressedJSONField, CompressedTextField
+
+
+class ProjectQuerySet(models.QuerySet):
+    def without_blobs(self):
+        """
+        Skips the JSON columns (answers, blueprint, docs), which can be
+        megabytes per project, for pages that only list projects.
+        """
+        return self.defer(*Project.BLOB_FIELDS)
+
 
 class Project(models.Model):
     # --- ENUMS ---
@@ -36,16 +49,184 @@ class Project(models.Model):
     current_phase = models.IntegerField(choices=PHASE_CHOICES, default=0)
     
     # Future-proofing for AI Data (Stored as JSON in SQLite)
-    requirements_data = models.JSONField(default=dict, blank=True)
-    blueprint_data = models.JSONField(default=dict, blank=True)
-    docs_data = models.JSONField(default=dict, blank=True)
+    requirements_data = CompressedJSONField(default=dict, blank=True)
+    blueprint_data = CompressedJSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Bumped by every FlowEngine write (compare-and-swap, see engine.py)
+    version = models.PositiveIntegerField(default=0)
+
+    BLOB_FIELDS = ('requirements_data', 'blueprint_data')
+
+    objects = ProjectQuerySet.as_manager()
 
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Per-user listings in (updated_at, id) keyset order (projects/pagination.py)
+            models.Index(fields=['user', '-updated_at', '-id'], name='project_user_updated_idx'),
+        ]
         verbose_name = "Project"
         verbose_name_plural = "Projects"
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+class AIResponseCache(models.Model):
+    """
+    Persistent tier of the LLM response cache (see projects/llm_cache.py).
+    Keyed on a SHA-256 of model + messages + sampling params.
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    model = models.CharField(max_length=255, blank=True)
+    response = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    last_hit_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "AI Response Cache Entry"
+        verbose_name_plural = "AI Response Cache"
+
+    def __str__(self):
+        return f"{self.model} {self.key[:12]}"
+
+
+class AIJob(models.Model):
+    """
+    A queued AI generation, processed by `manage.py run_ai_worker`.
+    Workers claim jobs with a time-limited lease; an expired lease makes
+    the job claimable again, so a crashed worker never strands it.
+    """
+    KIND_CHOICES = [
+        ('blueprint', 'Blueprint'),
+        ('speculative_blueprint', 'Speculative Blueprint'),
+        ('doc_section', 'Documentation Section'),
+        ('task_guide', 'Task Guide'),
+        ('task_guides', 'Task Guides (batch)'),
+    ]
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES)
+    payload = models.JSONField(default=dict, blank=True)
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    # Lease & retry bookkeeping
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    leased_until = models.DateTimeField(null=True, blank=True)
+    # Past this, nobody is waiting for the result any more: don't start it
+    expires_at = models.DateTimeField(null=True, blank=True)
+    worker_id = models.CharField(max_length=100, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+        verbose_name = "AI Job"
+        verbose_name_plural = "AI Jobs"
+
+    def __str__(self):
+        return f"{self.kind} [{self.status}]"
+
+    @property
+    def is_finished(self):
+        return self.status in ('succeeded', 'failed')
+
+
+class TaskGuide(models.Model):
+    """
+    A generated implementation guide for one blueprint task.
+    Keyed by a hash of the blueprint it was written for, so a new
+    blueprint never serves stale guides.
+    """
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='task_guides')
+    blueprint_hash = models.CharField(max_length=64)
+    task_key = models.CharField(max_length=64)  # sha256 of the task text
+    task = models.TextField()
+    content = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'blueprint_hash', 'task_key'], name='unique_task_guide'),
+        ]
+        verbose_name = "Task Guide"
+        verbose_name_plural = "Task Guides"
+
+    def __str__(self):
+        return self.task[:50]
+
+
+class DocSection(models.Model):
+    """
+    One generated documentation section (see constants.DOC_SECTIONS) of
+    a project, with its rendered HTML. A row per section, so reading or
+    writing one never touches the others.
+    """
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='doc_sections')
+    key = models.CharField(max_length=64)
+    markdown = CompressedTextField()
+    html = CompressedTextField(blank=True)
+    html_key = models.CharField(max_length=32, blank=True)      # rendering.html_key() of the stored html
+    content_hash = models.CharField(max_length=64, blank=True)  # sha256 of the markdown
+    context_hash = models.CharField(max_length=64, blank=True)  # Answers + blueprint it was written from
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'key'], name='unique_doc_section'),
+        ]
+        verbose_name = "Doc Section"
+        verbose_name_plural = "Doc Sections"
+
+    def __str__(self):
+        return self.key
+
+
+class LLMCallRollup(models.Model):
+    """
+    Per-minute totals of LLM calls (see projects/metrics.py), one row per
+    provider / model / prompt.
+    """
+    period_start = models.DateTimeField()
+    provider = models.CharField(max_length=50)
+    model = models.CharField(max_length=255)
+    prompt = models.CharField(max_length=100)
+
+    calls = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+    total_seconds = models.FloatField(default=0)
+    max_seconds = models.FloatField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    reasoning_tokens = models.PositiveBigIntegerField(default=0)
+    cached_tokens = models.PositiveBigIntegerField(default=0)
+    cost_usd = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period_start', 'provider', 'model', 'prompt'], name='unique_llm_rollup'),
+        ]
+        verbose_name = "LLM Call Rollup"
+        verbose_name_plural = "LLM Call Rollups"
+
+    def __str__(self):
+        return f"{self.period_start:%Y-%m-%d %H:%M} {self.prompt} ({self.calls})"
@@ -0,0 +1,181 @@
+"""
+Keyset (seek) pagination for project listings.
+
+A page is "the next N rows after this one" in (updated_at, id) order,
+so each page is one indexed range scan whatever the depth, and rows
+don't shift between pages when projects are created or updated in the
+meantime (an OFFSET would skip or repeat them). Cursors are opaque:
+base64 JSON of the last row's sort values plus the direction.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+DEFAULT_ORDERING = ('-updated_at', '-id')
+
+
+class InvalidCursor(ValueError):
+    """The cursor is malformed or belongs to another ordering."""
+
+
+def encode_cursor(ordering, values, reverse=False):
+    payload = {'o': list(ordering), 'v': [str(value) for value in values], 'r': reverse}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(model, ordering, cursor):
+    """
+    -> (values, reverse). Raises InvalidCursor.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if payload['o'] != list(ordering) or len(payload['v']) != len(ordering):
+            raise InvalidCursor("Cursor does not match the ordering")
+        values = [
+            model._meta.get_field(name.lstrip('-')).to_python(value)
+            for name, value in zip(ordering, payload['v'])
+        ]
+        return values, bool(payload.get('r'))
+    except InvalidCursor:
+        raise
+    except (binascii.Error, ValueError, TypeError, KeyError, AttributeError, LookupError, ValidationError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}") from e
+
+
+def normalize_ordering(ordering):
+    """
+    Appends the primary key as the tie-breaker so the order is total.
+    """
+    ordering = tuple(ordering) or DEFAULT_ORDERING
+    if not any(name.lstrip('-') in ('id', 'pk') for name in ordering):
+        ordering += ('-id' if ordering[0].startswith('-') else 'id',)
+    return ordering
+
+
+def _flip(name):
+    return name[1:] if name.startswith('-') else f'-{name}'
+
+
+def _after(ordering, values):
+    """
+    Q for rows strictly after `values` in `ordering` (row-value comparison
+    spelled out, since the directions can differ per column).
+    """
+    condition = Q()
+    equal = Q()
+    for name, value in zip(ordering, values):
+        field = name.lstrip('-')
+        lookup = 'lt' if name.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{field}__{lookup}': value})
+        equal &= Q(**{field: value})
+    return condition
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_paginate(queryset, cursor=None, page_size=20, ordering=None):
+    """
+    One page of `queryset` after (or, for a "previous" cursor, before)
+    the cursor position. Raises InvalidCursor.
+    """
+    ordering = normalize_ordering(ordering or queryset.query.order_by or queryset.model._meta.ordering)
+    fields = [name.lstrip('-') for name in ordering]
+
+    values, reverse = (None, False)
+    if cursor:
+        values, reverse = decode_cursor(queryset.model, ordering, cursor)
+
+    # Going back = walking forward in the flipped order, then flipping the rows
+    walk = tuple(_flip(name) for name in ordering) if reverse else ordering
+    queryset = queryset.order_by(*walk)
+    if values is not None:
+        queryset = queryset.filter(_after(walk, values))
+
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    def position(row):
+        return [getattr(row, field) for field in fields]
+
+    next_cursor = previous_cursor = None
+    if rows:
+        if has_more or reverse:
+            next_cursor = encode_cursor(ordering, position(rows[-1]))
+        if (has_more and reverse) or (cursor and not reverse):
+            previous_cursor = encode_cursor(ordering, position(rows[0]), reverse=True)
+    return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+class KeysetPagination(BasePagination):
+    """
+    DRF paginator over keyset_paginate():
+    {"next": url, "previous": url, "results": [...]}.
+    Follows the queryset ordering (e.g. from OrderingFilter).
+    """
+    cursor_query_param = 'cursor'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            self.page = keyset_paginate(
+                queryset,
+                cursor=request.query_params.get(self.cursor_query_param),
+                page_size=self.get_page_size(request),
+            )
+        except InvalidCursor:
+            raise NotFound("Invalid cursor")
+        return self.page.items
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self._link(self.page.next_cursor),
+            'previous': self._link(self.page.previous_cursor),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,384 @@
+"""
+Prompt template registry.
+
+Every prompt the app sends is a named, versioned PromptTemplate built
+once at import: whitespace is normalised, placeholders ($name, so JSON
+braces need no escaping) are checked, and a fingerprint of the text,
+version and sampling defaults is computed. The fingerprint goes into
+response-cache keys, so editing a prompt (or bumping its version)
+never serves answers generated by the old one.
+
+Bump `version` when a prompt's meaning changes without its text
+changing (e.g. the response is parsed differently).
+
+Layout rule, for provider-side prefix caching: everything static (the
+system message and any fixed instructions / output formats) comes first,
+byte-for-byte identical on every call; the variable project data comes
+last, in the user message. PrefixCacheStats records how many prompt
+tokens providers actually served from their cache.
+"""
+import hashlib
+import json
+import textwrap
+import threading
+from string import Template
+
+
+class PromptTemplate:
+    def __init__(self, name, version, system, user, temperature=0.3, max_tokens=None, model=None):
+        self.name = name
+        self.version = version
+        self.system = textwrap.dedent(system).strip()
+        self.user = Template(textwrap.dedent(user).strip())
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.model = model  # Forces a model id on every provider (None = provider default)
+
+        if not self.user.is_valid():
+            raise ValueError(f"Prompt {name}: invalid placeholder in user template")
+        self.fields = frozenset(self.user.get_identifiers())
+
+        # The part of every rendered prompt that never changes
+        first = self.user.pattern.search(self.user.template)
+        static_user = self.user.template[:first.start()] if first else self.user.template
+        self.static_prefix = self.system + '\n' + static_user
+
+        payload = json.dumps({
+            'name': name,
+            'version': version,
+            'system': self.system,
+            'user': self.user.template,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'model': model,
+        }, sort_keys=True)
+        self.fingerprint = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:12]
+
+    def render(self, **fields):
+        missing = self.fields - set(fields)
+        if missing:
+            raise KeyError(f"Prompt {self.name} needs: {', '.join(sorted(missing))}")
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user.substitute(fields)},
+        ]
+
+    def __repr__(self):
+        return f"<PromptTemplate {self.name} v{self.version} {self.fingerprint}>"
+
+
+PROMPTS = {}
+
+
+def register(template):
+    if template.name in PROMPTS:
+        raise ValueError(f"Duplicate prompt: {template.name}")
+    PROMPTS[template.name] = template
+    return template
+
+
+def get_prompt(name):
+    return PROMPTS[name]
+
+
+# --- BLUEPRINT ---
+register(PromptTemplate(
+    name='blueprint',
+    version=2,
+    temperature=0.2,  # Low enough for valid JSON
+    max_tokens=3500,
+    system="""
+        ACT AS: A Senior Principal Software Architect.
+        TASK: Generate a high-fidelity technical blueprint in JSON.
+
+        CRITICAL INSTRUCTIONS:
+        1. CUSTOMIZATION: Use the INPUT REQUIREMENTS strictly. If they asked for "Video Streaming", include "FFmpeg" or "HLS" in the backend.
+        2. SPECIFICITY: Do not say "Database". Say "PostgreSQL 16" or "MongoDB". Do not say "Auth". Say "JWT via SimpleJWT".
+        3. JSON FORMAT: Output valid JSON only. No markdown.
+        4. LIMITS: Max 6 items per list (to prevent timeouts). Keep descriptions professional.
+
+        REQUIRED JSON OUTPUT STRUCTURE:
+        {
+            "overview": "2-sentence executive technical summary.",
+            "architecture": {
+                "style": "e.g. Event-Driven Microservices / Modular Monolith",
+                "diagram_description": "A clear description of how data flows from user to DB."
+            },
+            "frontend": {
+                "framework": "Specific Framework & Version",
+                "structure": ["/src/features", "/src/shared", "/src/app"],
+                "state_management": "Specific Library",
+                "ui_library": "e.g. Tailwind / ShadCN / MUI"
+            },
+            "backend": {
+                "framework": "Specific Framework",
+                "database": "Specific Database Engine",
+                "models": ["List of core domain entities (e.g. User, Subscription)"],
+                "services": ["List of distinct logic layers (e.g. PaymentService, VideoTranscoder)"]
+            },
+            "api": {
+                "style": "REST / GraphQL",
+                "endpoints": ["List of 5 critical high-level endpoints"]
+            },
+            "phases": [
+                { "phase": 1, "title": "Foundation", "tasks": ["3 specific setup tasks"] },
+                { "phase": 2, "title": "Core Logic", "tasks": ["3 specific coding tasks"] },
+                { "phase": 3, "title": "Polish & Ship", "tasks": ["3 specific finishing tasks"] }
+            ]
+        }
+    """,
+    user="""
+        USER PROJECT REQUIREMENTS:
+        $requirements
+    """,
+))
+
+
+# --- TASK GUIDE ---
+register(PromptTemplate(
+    name='task_guide',
+    version=1,
+    system="""
+        ACT AS: A Senior Lead Developer.
+        TASK: Write a step-by-step implementation guide.
+        CONTEXT: Extremely explicit code for a Junior Developer.
+
+        OUTPUT FORMAT (Markdown):
+        ## Goal
+        1-sentence summary.
+
+        ### 1. Terminal
+        `pip install ...`
+
+        ### 2. Code
+        **File: path/to/file.py**
+        ```python
+        # Code here
+        ```
+    """,
+    user="""
+        CONTEXT: $context
+        TASK: "$task"
+    """,
+))
+
+
+# --- STRATEGIC PROJECT GUIDE ---
+register(PromptTemplate(
+    name='project_docs',
+    version=2,
+    system="""
+        ACT AS: A Senior CTO and Product Manager.
+        TASK: Write a comprehensive Strategic Master Plan and Setup Guide.
+
+        CRITICAL RULES:
+        1. DO NOT WRITE CODE. (No Python classes, no React components, no function bodies).
+        2. FOCUS ON: Architecture, Data Strategy, UI/UX Guidelines, and Best Practices.
+        3. PROVIDE: "Terminal Commands" only for project initialization (pip install, etc).
+        4. TONE: Professional, guiding, authoritative.
+
+        Please generate a master markdown document with these exact sections:
+
+        # 1. Executive Summary
+        - Project Vision & Success Criteria.
+        - The "Why" behind the architecture choices.
+
+        # 2. Master Setup Guide (Terminal Only)
+        - Step-by-step shell commands to initialize this specific tech stack.
+        - Dependency installation guide.
+
+        # 3. Backend Strategy (Conceptual)
+        - Database Schema Rules (Explain relationships, don't write SQL).
+        - API Design Patterns (REST vs GraphQL strategy).
+        - Security & Scalability requirements.
+
+        # 4. Frontend & UI/UX Guidelines
+        - Component Hierarchy (Explain the folder structure).
+        - State Management Strategy (When to use Redux/Context).
+        - UI Polishing Guide (Typography, Spacing, Accessibility rules).
+
+        # 5. The "Phase 8" (Post-Setup Lifecycle)
+        - Testing Strategy (What to test and how).
+        - Deployment Pipeline (CI/CD recommendations).
+        - Maintenance Checklist (Logging, Monitoring).
+    """,
+    user="""
+        PROJECT BLUEPRINT:
+        $blueprint
+
+        ORIGINAL REQUIREMENTS:
+        $requirements
+    """,
+))
+
+
+# --- DOC SECTIONS (one template per tab) ---
+DOC_SECTION_PREAMBLE = """
+ACT AS: A World-Class Software Architect for "Vibecoders".
+YOUR GOAL: Create specific, actionable, high-quality documentation.
+AVOID: Generic fluff. Do not say "Use a database". Say "Use PostgreSQL because..."
+"""
+
+DOC_SECTION_FOOTER = "CRITICAL: Output valid Markdown."
+
+# We include the User's specific answers to ensure it's CUSTOM
+DOC_SECTION_USER = """
+    PROJECT CONTEXT (The User's specific answers):
+    $requirements
+
+    AI BLUEPRINT (Draft):
+    $blueprint
+"""
+
+DOC_SECTION_INSTRUCTIONS = {
+    'overview': """
+        TASK: Write the 'Executive Vision & Project Plan'.
+        CONTEXT: The user wants to build a specific app described in the inputs.
+        OUTPUT SECTIONS:
+        - **The Core Concept**: A pitch-perfect summary of what we are building.
+        - **Target Audience**: Who is this for?
+        - **Success Metrics**: What defines 'done'?
+        - **The "Vibe"**: Describe the feeling/experience of the app.
+    """,
+    'features': """
+        TASK: Write the 'Platform Feature Specification'.
+        CONTEXT: Based on the user's intent, list the concrete features.
+        OUTPUT SECTIONS:
+        - **User Stories**: "As a user, I can..." list.
+        - **Core Modules**: The main functional blocks (e.g., Auth, Payments, Dashboards).
+        - **Edge Cases**: Specific tricky scenarios to handle.
+        - **MVP Scope**: What features are essential for version 1.0 vs later.
+    """,
+    'backend': """
+        TASK: Write the 'Backend Architecture Strategy'.
+        CONTEXT: Use the specific backend tech selected by the user (Django/Node/etc).
+        OUTPUT SECTIONS:
+        - **Tech Stack**: Justify the choice of framework & tools.
+        - **Server Architecture**: Monolith vs Microservices decision & reasoning.
+        - **Directory Structure**: ASCII tree of the backend folder.
+        - **Key Libraries**: List of essential packages (e.g., DRF, Celery, Stripe).
+    """,
+    'database': """
+        TASK: Write the 'Database Schema' as SQL Code.
+        CONTEXT: The user needs to copy-paste this to create their database.
+
+        CRITICAL RULE:
+        - DO NOT use text descriptions or XML.
+        - OUTPUT ONLY A VALID SQL SCRIPT inside a markdown code block.
+
+        OUTPUT SECTIONS:
+        1. **ER Diagram Summary** (2 sentences text).
+        2. **The SQL Schema**:
+        ```sql
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY,
+            ...
+        );
+        ```
+    """,
+    'frontend': """
+        TASK: Write the 'Frontend Engineering Guide'.
+        CONTEXT: Use the user's chosen frontend framework (React/Vue/etc).
+        OUTPUT SECTIONS:
+        - **Component Architecture**: How to split the UI (Atoms/Molecules).
+        - **State Management**: Strategy (Redux/Zustand/Context).
+        - **Routing Strategy**: List of main client-side routes.
+        - **Folder Structure**: ASCII tree of the frontend `src` folder.
+    """,
+    'ui_ux': """
+        TASK: Write the 'UI/UX & Skills.md Guide'.
+        CONTEXT: Create a 'cursor rules' style guide for the AI coder.
+        OUTPUT SECTIONS:
+        - **Design System**: Colors, Typography, Spacing variables.
+        - **Component Rules**: Rules for writing clean UI code (e.g., "Use functional components").
+        - **Accessibility**: ARIA labels and contrast rules.
+        - **The "Skills.md"**: A distinct block of rules to copy-paste into an AI editor.
+    """,
+    'api': """
+        TASK: Write the 'API Specification'.
+        CONTEXT: Define the communication layer.
+        OUTPUT SECTIONS:
+        - **Authentication Flow**: How login/token refresh works.
+        - **Endpoints List**: Grouped by resource (Auth, Users, Products).
+        - **Request/Response Examples**: JSON snippets for key endpoints.
+        - **Error Handling**: Standard error codes (400 vs 401 vs 403).
+    """,
+    'setup': """
+        TASK: Write the 'Master Terminal Setup Guide'.
+        CONTEXT: The exact commands to boot this from zero.
+        OUTPUT SECTIONS:
+        - **Prerequisites**: Node/Python versions.
+        - **Step 1: Backend Init**: `django-admin startproject` etc.
+        - **Step 2: Frontend Init**: `npm create vite@latest` etc.
+        - **Step 3: Environment**: `.env.example` file content.
+        - **Step 4: Running It**: Command to start both servers.
+    """,
+}
+
+for _key, _instruction in DOC_SECTION_INSTRUCTIONS.items():
+    register(PromptTemplate(
+        name=f'doc_section.{_key}',
+        version=1,
+        system='\n\n'.join([
+            textwrap.dedent(DOC_SECTION_PREAMBLE).strip(),
+            textwrap.dedent(_instruction).strip(),
+            DOC_SECTION_FOOTER,
+        ]),
+        user=DOC_SECTION_USER,
+    ))
+
+
+def doc_section_prompt(section_key):
+    """
+    Template for a docs tab (defaults to overview for unknown keys).
+    """
+    return PROMPTS.get(f'doc_section.{section_key}', PROMPTS['doc_section.overview'])
+
+
+# --- PROVIDER PREFIX CACHE ---
+def cached_prompt_tokens(usage):
+    """
+    (prompt_tokens, cached_tokens) from a completion's usage, or (None, None).
+    OpenAI / OpenRouter report prompt_tokens_details.cached_tokens;
+    DeepSeek reports prompt_cache_hit_tokens.
+    """
+    if usage is None:
+        return None, None
+    prompt_tokens = getattr(usage, 'prompt_tokens', None)
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = getattr(details, 'cached_tokens', None) if details is not None else None
+    if cached is None:
+        cached = getattr(usage, 'prompt_cache_hit_tokens', None)
+    return prompt_tokens, cached or 0
+
+
+class PrefixCacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_prompt = {}
+
+    def record(self, prompt_name, usage):
+        prompt_tokens, cached = cached_prompt_tokens(usage)
+        if prompt_tokens is None:
+            return
+        with self._lock:
+            entry = self.by_prompt.setdefault(
+                prompt_name, {'calls': 0, 'calls_with_hits': 0, 'prompt_tokens': 0, 'cached_tokens': 0}
+            )
+            entry['calls'] += 1
+            entry['calls_with_hits'] += 1 if cached else 0
+            entry['prompt_tokens'] += prompt_tokens
+            entry['cached_tokens'] += cached
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: dict(
+                    entry,
+                    hit_ratio=round(entry['cached_tokens'] / entry['prompt_tokens'], 3) if entry['prompt_tokens'] else 0.0,
+                )
+                for name, entry in self.by_prompt.items()
+            }
+
+
+prefix_cache = PrefixCacheStats()
@@ -0,0 +1,503 @@
+"""
+AI provider registry and latency-aware router.
+
+Every OpenAI-compatible backend (OpenRouter, DeepSeek direct, the local
+stub) is a Provider. ProviderRouter keeps rolling latency / error stats
+per provider and operation, sends each call to the fastest healthy one, fails over on
+errors and can optionally hedge: if the first provider is slower than
+its own p95, a duplicate request goes to the runner-up, the first
+answer wins and the other request is cancelled.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from django.conf import settings
+
+from .constants import BLUEPRINT_SCHEMA
+from .deadlines import DeadlineExceeded
+from .llm_clients import get_async_client, get_client
+from .ratelimit import get_limiter
+
+ROUTING_DEFAULTS = {
+    'HEDGING': False,
+    'WINDOW': 50,              # Calls kept per provider for p50/p95
+    'MIN_SAMPLES': 5,          # Below this, a provider is "unknown" (and healthy)
+    'MAX_ERROR_RATE': 0.5,     # Above this, a provider is unhealthy
+    'HEDGE_DELAY_DEFAULT': 20.0,
+}
+
+
+def routing_settings():
+    config = dict(ROUTING_DEFAULTS)
+    config.update(getattr(settings, 'AI_ROUTING', {}))
+    return config
+
+
+class ProviderStats:
+    """
+    Rolling windows of (latency, ok) samples for one provider, one per
+    operation (deadlines.operation_for): a blueprint takes far longer
+    than a task guide, so latencies are only compared within the same
+    operation. snapshot() without one covers them all (health).
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok, operation='default'):
+        with self._lock:
+            samples = self._samples.get(operation)
+            if samples is None:
+                samples = self._samples[operation] = deque(maxlen=self.window)
+            samples.append((latency, ok))
+
+    def operations(self):
+        with self._lock:
+            return sorted(self._samples)
+
+    def snapshot(self, operation=None):
+        with self._lock:
+            if operation is None:
+                samples = [sample for window in self._samples.values() for sample in window]
+            else:
+                samples = list(self._samples.get(operation, ()))
+        latencies = sorted(latency for latency, ok in samples if ok)
+        errors = sum(1 for _, ok in samples if not ok)
+        return {
+            'samples': len(samples),
+            'p50': _percentile(latencies, 0.50),
+            'p95': _percentile(latencies, 0.95),
+            'error_rate': round(errors / len(samples), 3) if samples else 0.0,
+        }
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 3)
+
+
+class Provider:
+    """
+    An OpenAI-compatible endpoint plus the model we use on it.
+    """
+
+    def __init__(self, name, base_url, api_key, model, default_headers=None):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.default_headers = default_headers
+        self.stats = ProviderStats(routing_settings()['WINDOW'])
+
+    @property
+    def client(self):
+        return get_client(base_url=self.base_url, api_key=self.api_key, default_headers=self.default_headers)
+
+    def complete(self, model=None, deadline=None, **params):
+        client = self.client
+        if deadline is not None:
+            deadline.check()
+            # What's left of the budget is the request timeout. The SDK's own
+            # retries would overrun it; the limiter and failover retry instead.
+            client = client.with_options(timeout=deadline.remaining(), max_retries=0)
+        return client.chat.completions.create(model=model or self.model, **params)
+
+    async def acomplete(self, model=None, deadline=None, **params):
+        """
+        Async (AsyncOpenAI) variant of complete() for the ASGI views.
+        """
+        client = get_async_client(base_url=self.base_url, api_key=self.api_key, default_headers=self.default_headers)
+        if deadline is not None:
+            deadline.check()
+            client = client.with_options(timeout=deadline.remaining(), max_retries=0)
+        return await client.chat.completions.create(model=model or self.model, **params)
+
+    def __repr__(self):
+        return f"<Provider {self.name}:{self.model}>"
+
+
+class StubProvider(Provider):
+    """
+    Offline provider for tests and local development.
+    Returns a schema-shaped blueprint for blueprint prompts and a short
+    markdown body for everything else, optionally after a fixed delay.
+    """
+
+    def __init__(self, name='stub', model='stub-model', latency=0.0, responder=None):
+        super().__init__(name=name, base_url='', api_key='', model=model)
+        self.latency = latency
+        self.responder = responder
+
+    def complete(self, messages, stream=False, model=None, deadline=None, **params):
+        if self.latency:
+            if deadline is not None and deadline.remaining() < self.latency:
+                time.sleep(deadline.remaining())
+                deadline.check()
+            time.sleep(self.latency)
+        return self._respond(messages, stream, model)
+
+    async def acomplete(self, messages, model=None, deadline=None, **params):
+        if self.latency:
+            if deadline is not None and deadline.remaining() < self.latency:
+                await asyncio.sleep(deadline.remaining())
+                deadline.check()
+            await asyncio.sleep(self.latency)
+        return self._respond(messages, False, model)
+
+    def _respond(self, messages, stream, model):
+        content = self.responder(messages) if self.responder else stub_content(messages)
+
+        # Rough (chars / 4) usage so token metrics move in development
+        usage = SimpleNamespace(
+            prompt_tokens=sum(len(m.get('content') or '') for m in messages) // 4,
+            completion_tokens=len(content) // 4,
+        )
+        if stream:
+            return _StubStream([content[i:i + 40] for i in range(0, len(content), 40)], model or self.model, usage)
+        return SimpleNamespace(
+            model=model or self.model,
+            choices=[SimpleNamespace(index=0, finish_reason='stop', message=SimpleNamespace(role='assistant', content=content))],
+            usage=usage,
+        )
+
+
+class _StubStream:
+    def __init__(self, pieces, model, usage=None):
+        chunks = [
+            SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, finish_reason=None, delta=SimpleNamespace(content=piece))])
+            for piece in pieces
+        ]
+        chunks.append(SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, finish_reason='stop', delta=SimpleNamespace(content=None))]))
+        if usage is not None:
+            chunks.append(SimpleNamespace(model=model, choices=[], usage=usage))
+        self._chunks = iter(chunks)
+
+    def __iter__(self):
+        return self._chunks
+
+    def close(self):
+        self._chunks = iter(())
+
+
+def stub_content(messages, tokens=0):
+    """
+    Canned completion for `messages`: a schema-shaped blueprint for
+    blueprint prompts, otherwise markdown padded to roughly `tokens`.
+    Shared by StubProvider and the run_mock_llm server.
+    """
+    prompt = ' '.join(message.get('content') or '' for message in messages)
+    if 'JSON' in prompt and '"overview"' in prompt:
+        return json.dumps(_sample_for(BLUEPRINT_SCHEMA))
+
+    lines = ["## Stub Response", "", "Generated offline by the stub provider."]
+    filler = "Lorem ipsum dolor sit amet, consectetur adipiscing elit sed do eiusmod. "
+    while sum(len(line) for line in lines) < tokens * 4:
+        lines.append(f"- {filler}")
+    return "\n".join(lines)
+
+
+def _sample_for(spec):
+    if isinstance(spec, dict):
+        return {key: _sample_for(sub_spec) for key, sub_spec in spec.items()}
+    if isinstance(spec, list):
+        return [_sample_for(spec[0]) for _ in range(3)]
+    if spec is str or (isinstance(spec, tuple) and str in spec):
+        return "Stub value"
+    return 1
+
+
+class ProviderRouter:
+    """
+    Routes each call to the fastest healthy provider, with failover and
+    optional hedging. Returns (provider, response).
+    """
+
+    def __init__(self, providers, hedging=None):
+        if not providers:
+            raise ValueError("ProviderRouter needs at least one provider.")
+        self.providers = list(providers)
+        self.hedging = routing_settings()['HEDGING'] if hedging is None else hedging
+
+    @property
+    def primary(self):
+        return self.providers[0]
+
+    def get(self, name):
+        for provider in self.providers:
+            if provider.name == name:
+                return provider
+        raise KeyError(f"Unknown AI provider: {name}")
+
+    def is_healthy(self, provider):
+        config = routing_settings()
+        stats = provider.stats.snapshot()
+        return stats['samples'] < config['MIN_SAMPLES'] or stats['error_rate'] <= config['MAX_ERROR_RATE']
+
+    def ranked(self, operation=None):
+        """
+        Healthy providers by p50 for `operation`, then healthy ones we
+        have no latency data on yet (an untried provider isn't assumed to
+        be the fastest), then unhealthy ones as a last resort.
+        Registration order breaks ties.
+        """
+        order = {provider.name: index for index, provider in enumerate(self.providers)}
+
+        def speed(provider):
+            p50 = provider.stats.snapshot(operation)['p50']
+            return (p50 is None, p50 or 0.0, order[provider.name])
+
+        healthy = sorted((p for p in self.providers if self.is_healthy(p)), key=speed)
+        unhealthy = sorted((p for p in self.providers if not self.is_healthy(p)), key=speed)
+        return healthy + unhealthy
+
+    def complete(self, user=None, deadline=None, **params):
+        """
+        `user` only orders the rate limiter's queue (fairness between users).
+        `deadline` (deadlines.Deadline) bounds queueing, failover and hedging
+        together, and caps each provider request's timeout.
+        """
+        candidates = self.ranked(_operation(deadline))
+        if self.hedging and len(candidates) > 1 and not params.get('stream'):
+            return self._hedged(candidates, params, user, deadline)
+        return self._failover(candidates, params, user, deadline)
+
+    # --- Strategies ---
+    def _call(self, provider, params, user=None, deadline=None):
+        def timed():
+            # Timed inside the limiter: queueing isn't the provider's latency
+            started = time.monotonic()
+            try:
+                response = provider.complete(deadline=deadline, **params)
+            except Exception:
+                provider.stats.record(time.monotonic() - started, ok=False, operation=_operation(deadline))
+                raise
+            provider.stats.record(time.monotonic() - started, ok=True, operation=_operation(deadline))
+            return response
+
+        try:
+            return get_limiter(provider.name).call(timed, user=user, stream=params.get('stream', False), deadline=deadline)
+        except Exception as e:
+            e.ai_provider = provider  # See failed_provider()
+            raise
+
+    def _failover(self, candidates, params, user=None, deadline=None):
+        last_error = None
+        for provider in candidates:
+            if deadline is not None and deadline.expired:
+                break  # No time left to try the next provider
+            try:
+                return provider, self._call(provider, params, user, deadline)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                last_error = e
+        if deadline is not None and deadline.expired:
+            raise DeadlineExceeded(f"{deadline.operation}: no result within {deadline.seconds:g}s") from last_error
+        raise last_error
+
+    def _hedged(self, candidates, params, user=None, deadline=None):
+        # Hedged calls run as tasks on hedge_loop(): unlike a thread stuck
+        # in an HTTP read, the losing task can be cancelled, which closes
+        # its request and hands its limiter slot back right away
+        future = asyncio.run_coroutine_threadsafe(self._ahedged(candidates, params, user, deadline), hedge_loop())
+        try:
+            return future.result()
+        finally:
+            future.cancel()  # No-op once done
+
+    # --- Async (ASGI views) ---
+    async def acomplete(self, user=None, deadline=None, **params):
+        """
+        Async complete(): same ranking, failover and hedging, but the
+        provider request is awaited instead of holding a thread.
+        Streaming isn't supported here.
+        """
+        candidates = self.ranked(_operation(deadline))
+        if self.hedging and len(candidates) > 1:
+            return await self._ahedged(candidates, params, user, deadline)
+        return await self._afailover(candidates, params, user, deadline)
+
+    async def _acall(self, provider, params, user=None, deadline=None):
+        async def timed():
+            started = time.monotonic()
+            try:
+                response = await provider.acomplete(deadline=deadline, **params)
+            except Exception:
+                provider.stats.record(time.monotonic() - started, ok=False, operation=_operation(deadline))
+                raise
+            provider.stats.record(time.monotonic() - started, ok=True, operation=_operation(deadline))
+            return response
+
+        try:
+            return await get_limiter(provider.name).acall(timed, user=user, deadline=deadline)
+        except Exception as e:
+            e.ai_provider = provider
+            raise
+
+    async def _afailover(self, candidates, params, user=None, deadline=None):
+        last_error = None
+        for provider in candidates:
+            if deadline is not None and deadline.expired:
+                break
+            try:
+                return provider, await self._acall(provider, params, user, deadline)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                last_error = e
+        if deadline is not None and deadline.expired:
+            raise DeadlineExceeded(f"{deadline.operation}: no result within {deadline.seconds:g}s") from last_error
+        raise last_error
+
+    async def _ahedged(self, candidates, params, user=None, deadline=None):
+        primary, backup = candidates[0], candidates[1]
+        p95 = primary.stats.snapshot(_operation(deadline))['p95']
+        delay = p95 if p95 is not None else routing_settings()['HEDGE_DELAY_DEFAULT']
+        if deadline is not None:
+            delay = deadline.cap(delay)
+
+        first = asyncio.ensure_future(self._acall(primary, params, user, deadline))
+        owners = {first: primary}
+        last_error = None
+        try:
+            done, _ = await asyncio.wait([first], timeout=delay)
+            if done and first.exception() is None:
+                return primary, first.result()
+
+            # Primary is slow (or already failed): race it against the backup
+            second = asyncio.ensure_future(self._acall(backup, params, user, deadline))
+            owners[second] = backup
+            pending = {first, second}
+            while pending:
+                timeout = deadline.remaining() if deadline is not None else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    deadline.check()
+                for future in done:
+                    if future.exception() is None:
+                        return owners[future], future.result()
+                    last_error = future.exception()
+        finally:
+            # The loser (or both, if we are cancelled) stops and frees its limiter slot
+            for future in owners:
+                future.cancel()
+
+        if len(candidates) > 2:
+            return await self._afailover(candidates[2:], params, user, deadline)
+        raise last_error
+
+    def stats(self):
+        return {
+            provider.name: dict(
+                provider.stats.snapshot(),
+                model=provider.model,
+                healthy=self.is_healthy(provider),
+                operations={operation: provider.stats.snapshot(operation) for operation in provider.stats.operations()},
+            )
+            for provider in self.providers
+        }
+
+
+def failed_provider(error):
+    """
+    The provider whose call raised `error` (the last one tried, after a
+    failover), or None if no provider was called.
+    """
+    while error is not None:
+        provider = getattr(error, 'ai_provider', None)
+        if provider is not None:
+            return provider
+        error = error.__cause__  # e.g. DeadlineExceeded from the last provider's error
+    return None
+
+
+def _operation(deadline):
+    # Latency stats are kept per operation (the deadline knows which)
+    return deadline.operation if deadline is not None else 'default'
+
+
+_router = None
+_router_lock = threading.Lock()
+_hedge_loop = None
+
+
+def hedge_loop():
+    """
+    Event loop on a daemon thread for the hedged calls of sync callers.
+    """
+    global _hedge_loop
+    with _router_lock:
+        if _hedge_loop is None:
+            _hedge_loop = asyncio.new_event_loop()
+            threading.Thread(target=_hedge_loop.run_forever, name='ai-hedge', daemon=True).start()
+    return _hedge_loop
+
+
+def _forget_hedge_loop():
+    # A forked child doesn't have the parent's loop thread
+    global _hedge_loop
+    _hedge_loop = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_hedge_loop)
+
+
+def build_providers():
+    """
+    Providers from settings.AI_PROVIDERS (those without an API key are
+    skipped), plus the stub when AI_STUB_PROVIDER is on.
+    """
+    providers = []
+    for entry in getattr(settings, 'AI_PROVIDERS', []):
+        if not entry.get('API_KEY'):
+            continue
+        providers.append(Provider(
+            name=entry['NAME'],
+            base_url=entry['BASE_URL'],
+            api_key=entry['API_KEY'],
+            model=entry['MODEL'],
+            default_headers=entry.get('HEADERS'),
+        ))
+
+    if getattr(settings, 'AI_STUB_PROVIDER', False):
+        providers.append(StubProvider())
+
+    # Nothing configured: keep the old behaviour (OpenRouter, failing on use)
+    if not providers:
+        providers.append(Provider(
+            name='openrouter',
+            base_url='https://openrouter.ai/api/v1',
+            api_key=getattr(settings, 'OPENROUTER_API_KEY', None),
+            model='deepseek/deepseek-r1-0528:free',
+        ))
+    return providers
+
+
+def get_router():
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ProviderRouter(build_providers())
+    return _router
+
+
+def set_router(router):
+    """
+    Swap the process-wide router (tests, or the stub for offline dev).
+    Returns the previous router.
+    """
+    global _router
+    with _router_lock:
+        previous, _router = _router, router
+    return previous
@@ -0,0 +1,429 @@
+"""
+Per-provider concurrency + rate limiting for AI calls.
+
+Each provider gets a ProviderLimiter that every AI call goes through
+(see ProviderRouter._call):
+- max in-flight: N slot lock files per provider; a call holds one
+  (flock) for its whole duration, so the cap covers every thread and
+  every worker process, and a crashed process frees its slot;
+- requests per minute: a token bucket kept in a small state file that
+  all processes update under a file lock;
+- queueing: callers wait instead of failing, served round-robin per
+  user within the process so one user's bulk run can't starve others;
+- 429s: the provider is paused for everyone for `Retry-After` (or an
+  exponential backoff with jitter) and the call is retried.
+"""
+import asyncio
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import singleflight
+from .singleflight import lock_dir
+
+try:
+    import fcntl
+except ImportError:  # Windows: limits apply within the process only
+    fcntl = None
+
+DEFAULTS = {
+    'MAX_IN_FLIGHT': 4,
+    'RPM': 60,
+    'BURST': None,           # Bucket size; defaults to MAX_IN_FLIGHT
+    'MAX_WAIT': 60.0,        # Longest a call queues before RateLimited
+    'MAX_RETRIES': 4,        # Retries after a 429
+    'BACKOFF_BASE': 1.0,
+    'BACKOFF_MAX': 60.0,
+}
+
+
+class RateLimited(Exception):
+    """The provider stayed saturated (or kept returning 429) for too long."""
+
+
+def limit_settings(provider):
+    config = dict(DEFAULTS)
+    # Older setting: plain per-provider concurrency
+    concurrency = getattr(settings, 'AI_PROVIDER_CONCURRENCY', {}).get(provider)
+    if concurrency:
+        config['MAX_IN_FLIGHT'] = concurrency
+    config.update(getattr(settings, 'AI_RATE_LIMITS', {}).get(provider, {}))
+    if not config['BURST']:
+        config['BURST'] = config['MAX_IN_FLIGHT']
+    return config
+
+
+def retry_after_seconds(error):
+    """
+    Seconds to wait for a 429 error (None if `error` isn't a 429).
+    Honours Retry-After (seconds or HTTP date) and retry-after-ms.
+    """
+    if getattr(error, 'status_code', None) != 429:
+        return None
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get('retry-after')
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            parsed = _parse_http_date(value)
+            if parsed is not None:
+                return max(0.0, parsed.timestamp() - time.time())
+    return 0.0  # No usable hint: plain backoff
+
+
+def _parse_http_date(value):
+    # Raises on a malformed date since Python 3.10 (returned None before)
+    try:
+        return email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Lease:
+    """
+    One in-flight slot. release() is idempotent.
+    """
+
+    def __init__(self, limiter, handle):
+        self.limiter = limiter
+        self.handle = handle
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.limiter._release(self)
+
+
+class LeasedStream:
+    """
+    Holds the lease until a streaming response is closed.
+    """
+
+    def __init__(self, stream, lease):
+        self.stream = stream
+        self.lease = lease
+
+    def __iter__(self):
+        try:
+            yield from self.stream
+        finally:
+            self.close()
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.lease.release()
+
+
+class ProviderLimiter:
+    POLL = 0.05  # Re-check interval while another process holds the slots
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.config = limit_settings(provider)
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # user -> deque of waiting tickets
+        self._local_in_flight = 0
+        self._changes = 0  # Bumped whenever a waiter may be able to go
+        self._watchers = []  # (loop, future) of async waiters, resolved on the next change
+
+    # --- Shared state files ---
+    def _path(self, suffix):
+        return os.path.join(lock_dir(), f'ratelimit-{self.provider}{suffix}')
+
+    @contextmanager
+    def _state(self):
+        """
+        Read-modify-write of the shared bucket state under a file lock.
+        """
+        handle = open(self._path('.lock'), 'a')
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                with open(self._path('.json')) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+            yield state
+            tmp = self._path(f'.json.{os.getpid()}.{threading.get_ident()}')
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self._path('.json'))
+        finally:
+            handle.close()  # Also drops the flock
+
+    def _take_token(self):
+        """
+        Returns 0 if a token was taken, else seconds until one is due.
+        """
+        rate = self.config['RPM'] / 60.0
+        capacity = self.config['BURST']
+        with self._state() as state:
+            now = time.time()
+            blocked = state.get('blocked_until', 0) - now
+            if blocked > 0:
+                return blocked
+
+            tokens = state.get('tokens', capacity)
+            elapsed = max(0.0, now - state.get('updated', now))
+            tokens = min(capacity, tokens + elapsed * rate)
+            state['updated'] = now
+            if tokens >= 1:
+                state['tokens'] = tokens - 1
+                return 0
+            state['tokens'] = tokens
+            return (1 - tokens) / rate
+
+    def block_for(self, seconds):
+        """
+        Pauses the provider for every process (after a 429).
+        """
+        with self._state() as state:
+            state['blocked_until'] = max(state.get('blocked_until', 0), time.time() + seconds)
+
+    def _try_slot(self):
+        if fcntl is None:
+            return True, None
+        for index in range(self.config['MAX_IN_FLIGHT']):
+            handle = open(self._path(f'.slot{index}.lock'), 'a')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True, handle
+            except OSError:
+                handle.close()
+        return False, None
+
+    # --- Queue ---
+    def _is_next(self, ticket):
+        for queue in self._queues.values():
+            return queue[0] is ticket
+        return False
+
+    def _dequeue(self, user, ticket):
+        queue = self._queues.get(user)
+        if queue is None:
+            return
+        queue.remove(ticket)
+        if queue:
+            self._queues.move_to_end(user)  # Round-robin between users
+        else:
+            del self._queues[user]
+
+    def _enqueue(self, user):
+        ticket = object()
+        with self._cond:
+            self._queues.setdefault(user, deque()).append(ticket)
+        return ticket
+
+    def _leave(self, user, ticket):
+        with self._cond:
+            self._dequeue(user, ticket)
+            self._changed()
+
+    def _changed(self):
+        # Caller holds _cond
+        self._changes += 1
+        self._cond.notify_all()
+        watchers, self._watchers = self._watchers, []
+        for loop, future in watchers:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:  # That loop has closed
+                pass
+
+    def _watch(self, loop):
+        future = loop.create_future()
+        with self._cond:
+            self._watchers.append((loop, future))
+        return future
+
+    def _attempt(self, ticket):
+        """
+        One try at a slot and a token. Returns (lease, wait): wait is
+        None when the ticket has to wait its turn (or for a local slot),
+        else the seconds until another try is worthwhile.
+        Only the queue bookkeeping runs under _cond; the slot and bucket
+        files are touched outside it. Only the head of the queue gets
+        here, so there is one attempt at a time per process.
+        """
+        with self._cond:
+            if not self._is_next(ticket) or self._local_in_flight >= self.config['MAX_IN_FLIGHT']:
+                return None, None
+            self._local_in_flight += 1  # Reserved while we try
+
+        lease = None
+        try:
+            ok, handle = self._try_slot()
+            if not ok:
+                return None, self.POLL  # Other processes hold the slots
+            wait = None
+            try:
+                wait = self._take_token()
+            finally:
+                if wait != 0 and handle is not None:
+                    handle.close()  # No token (or an error): give the slot back
+            if wait:
+                return None, wait
+            lease = Lease(self, handle)
+            return lease, 0
+        finally:
+            if lease is None:
+                with self._cond:
+                    self._local_in_flight -= 1
+
+    def acquire(self, user=None, timeout=None):
+        timeout = self.config['MAX_WAIT'] if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        ticket = self._enqueue(user)
+        try:
+            while True:
+                seen = self._changes
+                lease, wait = self._attempt(ticket)
+                if lease is not None:
+                    return lease
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RateLimited(f"{self.provider}: no capacity after {timeout:.0f}s")
+                with self._cond:
+                    self._cond.wait_for(lambda: self._changes != seen, min(wait or remaining, remaining))
+        finally:
+            self._leave(user, ticket)
+
+    async def aacquire(self, user=None, timeout=None):
+        """
+        acquire() for async callers. Waits on the event loop (woken by the
+        same changes as sync waiters), so a queued call doesn't hold a
+        thread; only the short file-lock step of each try runs on
+        singleflight's lock pool.
+        """
+        timeout = self.config['MAX_WAIT'] if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        loop = asyncio.get_running_loop()
+        ticket = self._enqueue(user)
+        try:
+            while True:
+                changed = self._watch(loop)
+                # If we are cancelled during a try, the slot it got is handed back
+                lease, wait = await singleflight.run_blocking(self._attempt, ticket, undo=_release_attempt)
+                if lease is not None:
+                    return lease
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RateLimited(f"{self.provider}: no capacity after {timeout:.0f}s")
+                try:
+                    await asyncio.wait_for(changed, min(wait or remaining, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._leave(user, ticket)
+
+    def _release(self, lease):
+        if lease.handle is not None:
+            lease.handle.close()
+        with self._cond:
+            self._local_in_flight -= 1
+            self._changed()
+
+    # --- Calls ---
+    def backoff(self, attempt, retry_after):
+        delay = min(self.config['BACKOFF_MAX'], self.config['BACKOFF_BASE'] * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)  # Jitter: don't retry in lockstep
+        return max(delay, retry_after or 0)
+
+    def call(self, func, user=None, stream=False, deadline=None):
+        """
+        Runs func() inside a slot, retrying 429s with backoff.
+        Streaming responses keep their slot until closed. With a
+        `deadline`, neither queueing nor a 429 pause may outlast it.
+        """
+        for attempt in range(self.config['MAX_RETRIES'] + 1):
+            timeout = deadline.cap(self.config['MAX_WAIT']) if deadline is not None else None
+            lease = self.acquire(user=user, timeout=timeout)
+            try:
+                response = func()
+            except Exception as e:
+                lease.release()
+                retry_after = retry_after_seconds(e)
+                if retry_after is None:
+                    raise
+                if attempt == self.config['MAX_RETRIES'] or retry_after > self.config['MAX_WAIT']:
+                    raise RateLimited(f"{self.provider}: rate limited ({e})") from e
+                if deadline is not None and retry_after >= deadline.remaining():
+                    raise RateLimited(f"{self.provider}: rate limited past the deadline ({e})") from e
+                self.block_for(self.backoff(attempt, retry_after))
+                continue
+
+            if stream:
+                return LeasedStream(response, lease)
+            lease.release()
+            return response
+
+    async def acall(self, func, user=None, deadline=None):
+        """
+        call() for a coroutine function. The queue is shared with sync
+        callers; waiting for a slot and the request itself are awaited.
+        """
+        for attempt in range(self.config['MAX_RETRIES'] + 1):
+            timeout = deadline.cap(self.config['MAX_WAIT']) if deadline is not None else None
+            lease = await self.aacquire(user, timeout)
+            try:
+                return await func()
+            except Exception as e:
+                retry_after = retry_after_seconds(e)
+                if retry_after is None:
+                    raise
+                if attempt == self.config['MAX_RETRIES'] or retry_after > self.config['MAX_WAIT']:
+                    raise RateLimited(f"{self.provider}: rate limited ({e})") from e
+                if deadline is not None and retry_after >= deadline.remaining():
+                    raise RateLimited(f"{self.provider}: rate limited past the deadline ({e})") from e
+                self.block_for(self.backoff(attempt, retry_after))
+            finally:
+                lease.release()
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _release_attempt(result):
+    lease, _ = result
+    if lease is not None:
+        lease.release()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider):
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = ProviderLimiter(provider)
+        return _limiters[provider]
+
+
+def max_in_flight(provider):
+    return limit_settings(provider)['MAX_IN_FLIGHT']
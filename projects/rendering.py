@@ -0,0 +1,49 @@
+"""
+Markdown -> HTML for the documentation pages.
+
+Building a Markdown instance (and its extensions) is the expensive
+part, so each thread keeps one converter and resets it between
+documents. Rendered sections are stored next to their markdown
+(DocSection.html), keyed by html_key(): a hash of the markdown and
+RENDERER_VERSION, so bumping the version re-renders everything lazily.
+"""
+import hashlib
+import threading
+
+import markdown
+
+EXTENSIONS = ['fenced_code', 'tables']
+
+# Bump when EXTENSIONS or the output below change
+RENDERER_VERSION = 1
+
+_local = threading.local()
+
+
+def _converter():
+    converter = getattr(_local, 'converter', None)
+    if converter is None:
+        converter = _local.converter = markdown.Markdown(extensions=EXTENSIONS)
+    return converter
+
+
+def render_markdown(md_content):
+    html_content = _converter().reset().convert(md_content or '')
+
+    # FIX: If HTML is empty or just whitespace, fallback to pre-formatted text
+    # This handles cases where AI output only invisible tags
+    if not html_content.strip():
+        html_content = f"<pre style='white-space: pre-wrap;'>{md_content}</pre>"
+    return html_content
+
+
+def html_key(md_content):
+    digest = hashlib.sha256(f"{RENDERER_VERSION}\n{md_content or ''}".encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+def rendered_entry(md_content):
+    """
+    {'key': html_key, 'html': ...} for one section.
+    """
+    return {'key': html_key(md_content), 'html': render_markdown(md_content)}
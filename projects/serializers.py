@@ -1,7 +1,20 @@
 from rest_framework import serializers
 from .models import Project
 
-class ProjectSerializer(serializers.ModelSerializer):
+
+class SparseFieldsMixin:
+    """
+    Accepts `fields=[...]` to serialize only those fields (?fields=).
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class ProjectSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     phase_display = serializers.CharField(source='get_current_phase_display', read_only=True)
 
@@ -18,9 +31,19 @@ class ProjectSerializer(serializers.ModelSerializer):
             'requirements_data',
             'blueprint_data',
             'created_at', 
-            'updated_at'
+            'updated_at',
+            'version',
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'user']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'user', 'version']
+
+
+class ProjectListSerializer(ProjectSerializer):
+    """
+    List rows: everything but the JSON blobs (ask for those with ?fields=).
+    """
+
+    class Meta(ProjectSerializer.Meta):
+        fields = [name for name in ProjectSerializer.Meta.fields if name not in Project.BLOB_FIELDS]
 
 # Add to projects/serializers.py
 
@@ -32,4 +55,6 @@ class AnswerInputSerializer(serializers.Serializer):
         ('tech_stack', 'Tech Stack'),
         ('quality', 'Quality & Delivery')
     ])
-    answer_data = serializers.JSONField()
\ No newline at end of file
+    answer_data = serializers.JSONField()
+    # Optional: the project version the client last read (409 if stale)
+    version = serializers.IntegerField(required=False, min_value=0)
\ No newline at end of file
@@ -0,0 +1,307 @@
+"""
+Single-flight coalescing for identical in-flight AI generations.
+
+The first caller for a key does the work; concurrent callers with the
+same key wait for and share its result:
+- threads in the same process wait on the leader's Event;
+- other processes (gunicorn workers, run_ai_worker) queue on a per-key
+  file lock, then `recheck()` picks up what the leader stored instead
+  of calling the model again.
+lead() is the same for work that streams while it runs (the SSE views).
+
+Async followers (arun) wait on the event loop, not on a thread. The one
+blocking step, the cross-process lock, runs on lock_executor(): a small
+pool of its own, so callers queueing on locks can't use up the loop's
+default executor that the leaders they wait for need. No wait is open
+ended: followers give up after the operation's deadline (FlightTimeout).
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .deadlines import DeadlineExceeded, deadline_settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalesce within the process only
+    fcntl = None
+
+LOCK_THREADS = 16  # lock_executor() size
+LOCK_POLL = 0.05   # Seconds between tries at a process lock held elsewhere
+WAIT_GRACE = 30    # Seconds past the operation's deadline that followers allow for storing the result
+
+
+class FlightAborted(Exception):
+    """The leader stopped without a result (e.g. its client went away)."""
+
+
+class FlightTimeout(DeadlineExceeded):
+    """The leader (in this process or another) didn't finish in time."""
+
+
+_calls = {}
+_lock = threading.Lock()
+_executor = None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self._waiters = []  # (loop, future) of async followers
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def wait(self, key, timeout):
+        if not self.done.wait(timeout):
+            raise FlightTimeout(f"{key}: no result within {timeout:g}s")
+
+    async def await_done(self, key, timeout):
+        """
+        wait() on the event loop: no thread is parked per follower.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with _lock:
+            if self.done.is_set():
+                return
+            self._waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise FlightTimeout(f"{key}: no result within {timeout:g}s") from None
+
+
+def _join(key):
+    """
+    (call, leader): the running call for `key`, or a new one we lead.
+    """
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+    return call, leader
+
+
+def _finish(call, key):
+    with _lock:
+        _calls.pop(key, None)
+        call.done.set()
+        waiters, call._waiters = call._waiters, []
+    for loop, future in waiters:
+        try:
+            loop.call_soon_threadsafe(_wake, future)
+        except RuntimeError:  # That loop has closed
+            pass
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _fail(call, key, error):
+    # Followers get a real error; if the leader was merely cancelled
+    # (GeneratorExit, CancelledError), they take over instead
+    call.error = error if isinstance(error, Exception) else FlightAborted(f"{key}: abandoned")
+
+
+def make_key(project_id, operation, *inputs):
+    """
+    (project, operation, input hash) -> flight key.
+    """
+    digest = hashlib.sha256(
+        json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+    return f"{project_id}:{operation}:{digest}"
+
+
+def lock_dir():
+    path = getattr(settings, 'AI_LOCK_DIR', None) or os.path.join(tempfile.gettempdir(), 'apprompty-locks')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def wait_timeout(key):
+    """
+    How long to wait for the leader of `key`: the deadline of its
+    operation (see make_key) plus WAIT_GRACE. Its AI calls can't run
+    past that deadline, so a leader still busy after it is stuck.
+    """
+    config = deadline_settings()
+    parts = key.split(':')
+    operation = parts[1] if len(parts) == 3 else 'default'
+    return config.get(operation, config['default']) + WAIT_GRACE
+
+
+def lock_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=LOCK_THREADS, thread_name_prefix='flight-lock')
+    return _executor
+
+
+async def run_blocking(func, *args, undo=None):
+    """
+    Awaits func(*args) run on lock_executor(). The thread can't be
+    stopped: if we are cancelled meanwhile, `undo(result)` is called
+    once it returns, to give back whatever it acquired.
+    """
+    pending = asyncio.get_running_loop().run_in_executor(lock_executor(), functools.partial(func, *args))
+    try:
+        return await asyncio.shield(pending)
+    except asyncio.CancelledError:
+        if undo is not None:
+            pending.add_done_callback(
+                lambda future: future.cancelled() or future.exception() is not None or undo(future.result())
+            )
+        raise
+
+
+@contextmanager
+def process_lock(key, timeout=None):
+    """
+    Cross-process exclusive lock for `key` (no-op without fcntl).
+    Raises FlightTimeout if it isn't free within `timeout` seconds.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    filename = os.path.join(lock_dir(), hashlib.sha1(key.encode('utf-8')).hexdigest() + '.lock')
+    with open(filename, 'a') as handle:
+        _flock(handle, key, timeout)
+        try:
+            yield
+        finally:
+            # Unlink while still holding the lock: waiters on this inode
+            # recheck, newcomers start a fresh file. Either way the result
+            # is already stored, so nobody recomputes it.
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _flock(handle, key, timeout):
+    if timeout is None:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return
+    give_up = time.monotonic() + timeout
+    while True:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            if time.monotonic() >= give_up:
+                raise FlightTimeout(f"{key}: locked by another process for {timeout:g}s") from None
+            time.sleep(LOCK_POLL)
+
+
+def run(key, func, recheck=None, timeout=None):
+    """
+    Runs func() at most once per key among concurrent callers.
+    `recheck()` (optional) returns an already-stored result or None; it
+    is consulted after acquiring the cross-process lock. Waiting for
+    another caller's result gives up after `timeout` (default:
+    wait_timeout(key)) with FlightTimeout.
+    """
+    timeout = wait_timeout(key) if timeout is None else timeout
+    call, leader = _join(key)
+
+    # Followers in this process just wait for the leader
+    if not leader:
+        call.wait(key, timeout)
+        if isinstance(call.error, FlightAborted):
+            return run(key, func, recheck, timeout)
+        return call.outcome()
+
+    try:
+        with process_lock(key, timeout):
+            result = recheck() if recheck else None
+            if result is None:
+                result = func()
+        call.result = result
+        return result
+    except BaseException as e:
+        _fail(call, key, e)
+        raise
+    finally:
+        _finish(call, key)
+
+
+async def arun(key, func, recheck=None, timeout=None):
+    """
+    run() for coroutine functions (`func` and `recheck` are async).
+    Shares the flights of sync callers: a sync request and an async one
+    for the same key still produce one generation.
+    """
+    timeout = wait_timeout(key) if timeout is None else timeout
+    call, leader = _join(key)
+
+    if not leader:
+        await call.await_done(key, timeout)
+        if isinstance(call.error, FlightAborted):
+            return await arun(key, func, recheck, timeout)
+        return call.outcome()
+
+    lock = process_lock(key, timeout)
+    try:
+        # Blocking flock on the lock pool; released from the loop (non-blocking)
+        await run_blocking(lock.__enter__, undo=lambda _: lock.__exit__(None, None, None))
+        try:
+            result = await recheck() if recheck else None
+            if result is None:
+                result = await func()
+        finally:
+            lock.__exit__(None, None, None)
+        call.result = result
+        return result
+    except BaseException as e:  # Incl. cancellation (client went away): don't leave followers with None
+        _fail(call, key, e)
+        raise
+    finally:
+        _finish(call, key)
+
+
+@contextmanager
+def lead(key):
+    """
+    run() for work that isn't one function call, e.g. a generator that
+    streams its output while it generates. Yields (flight, leader):
+    - leader: do the work inside the block and set `flight.result`;
+      run()/arun() callers with the same key wait for it meanwhile;
+    - follower: another caller is already on it. Wait on `flight.done`
+      for at most wait_timeout(key), then read `flight.outcome()`
+      (raises FlightAborted if that caller gave up: start over).
+    """
+    call, leader = _join(key)
+
+    if not leader:
+        yield call, False
+        return
+
+    try:
+        with process_lock(key, wait_timeout(key)):
+            yield call, True
+    except BaseException as e:  # Incl. GeneratorExit: the stream was closed
+        _fail(call, key, e)
+        raise
+    finally:
+        _finish(call, key)
@@ -0,0 +1,211 @@
+"""
+SQLite tuning for concurrent requests.
+
+- configure_connection(): connection_created hook (see apps.py) that
+  applies AI_SQLITE pragmas to every new connection: WAL (readers never
+  block the writer), synchronous=NORMAL, page cache / mmap sizes and a
+  busy timeout. settings.DATABASES also opens write transactions with
+  BEGIN IMMEDIATE, so a writer waits for the lock up front instead of
+  failing halfway through a transaction.
+- retry_writes(): runs a write transaction again, after a jittered
+  backoff, if it still gets "database is locked".
+- WriteQueue: optional single writer thread (AI_SQLITE['WRITE_QUEUE']).
+  Small writes (answer submits, status updates) from all request
+  threads are committed together, one transaction per batch, instead
+  of each thread queueing for the lock. Each write still runs in its
+  own savepoint, so one failing write doesn't affect the others.
+write() picks between the two.
+"""
+import functools
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',     # Safe with WAL; FULL fsyncs every commit
+    'CACHE_SIZE_KB': 65536,      # Page cache per connection
+    'MMAP_SIZE': 268435456,      # Bytes of the DB file to memory-map (0 = off)
+    'TEMP_STORE': 'MEMORY',
+    'BUSY_TIMEOUT_MS': 20000,    # How long a connection waits for a lock
+    'WRITE_RETRIES': 5,          # Extra attempts after "database is locked"
+    'RETRY_BASE_DELAY': 0.05,    # Seconds; doubles per attempt (full jitter)
+    'RETRY_MAX_DELAY': 2.0,
+    'WRITE_QUEUE': False,        # Funnel write() calls through one writer thread
+    'WRITE_QUEUE_BATCH': 50,     # Max writes per transaction
+}
+
+
+def sqlite_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AI_SQLITE', {}))
+    return config
+
+
+# --- Connection setup ---
+def pragmas(config=None):
+    config = config or sqlite_settings()
+    statements = [
+        f"PRAGMA synchronous = {config['SYNCHRONOUS']}",
+        f"PRAGMA cache_size = -{int(config['CACHE_SIZE_KB'])}",
+        f"PRAGMA mmap_size = {int(config['MMAP_SIZE'])}",
+        f"PRAGMA temp_store = {config['TEMP_STORE']}",
+        f"PRAGMA busy_timeout = {int(config['BUSY_TIMEOUT_MS'])}",
+    ]
+    if config['JOURNAL_MODE']:
+        statements.insert(0, f"PRAGMA journal_mode = {config['JOURNAL_MODE']}")
+    return statements
+
+
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    statements = pragmas()
+    if connection.is_in_memory_db():
+        # No WAL for in-memory (test) databases
+        statements = [sql for sql in statements if 'journal_mode' not in sql]
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+# --- Retries ---
+def is_locked_error(error):
+    message = str(error).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def backoff_delay(attempt, config=None):
+    """
+    Full-jitter exponential backoff: uniform(0, min(max, base * 2^attempt)).
+    """
+    config = config or sqlite_settings()
+    return random.uniform(0, min(config['RETRY_MAX_DELAY'], config['RETRY_BASE_DELAY'] * 2 ** attempt))
+
+
+def retry_writes(func):
+    """
+    Runs func in a transaction, retrying it on "database is locked".
+    Inside an outer transaction it runs once: only the outermost
+    transaction can be retried.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if connection.in_atomic_block:
+            return func(*args, **kwargs)
+
+        config = sqlite_settings()
+        for attempt in range(config['WRITE_RETRIES'] + 1):
+            try:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+            except OperationalError as e:
+                if not is_locked_error(e) or attempt == config['WRITE_RETRIES']:
+                    raise
+                delay = backoff_delay(attempt, config)
+                logger.warning(f"SQLite busy ({e}); retry {attempt + 1} in {delay * 1000:.0f}ms")
+                time.sleep(delay)
+    return wrapper
+
+
+# --- Single writer ---
+class WriteQueue:
+    """
+    One daemon thread that runs queued writes in batched transactions.
+    submit() returns a Future resolved once the batch has committed.
+    """
+
+    def __init__(self, batch_size=50):
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        self._ensure_thread()
+        return future
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]  # Block for the first one
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._commit(batch)
+            except Exception as e:  # The whole transaction failed
+                for future, *_ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                # Never leave the thread's connection in a broken state
+                if connection.needs_rollback or connection.in_atomic_block:
+                    connection.close()
+
+    @retry_writes
+    def _commit(self, batch):
+        results = []
+        for future, func, args, kwargs in batch:
+            try:
+                with transaction.atomic():  # Savepoint per write
+                    results.append((future, True, func(*args, **kwargs)))
+            except OperationalError as e:
+                if is_locked_error(e):
+                    raise  # Retry the whole batch
+                results.append((future, False, e))
+            except Exception as e:
+                results.append((future, False, e))
+
+        # Resolved only after the batch commits
+        transaction.on_commit(lambda: [
+            future.set_result(value) if ok else future.set_exception(value)
+            for future, ok, value in results
+        ])
+
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+
+def write_queue():
+    global _write_queue
+    if _write_queue is None:
+        with _write_queue_lock:
+            if _write_queue is None:
+                _write_queue = WriteQueue(batch_size=sqlite_settings()['WRITE_QUEUE_BATCH'])
+    return _write_queue
+
+
+def write(func, *args, **kwargs):
+    """
+    Runs a small write: on the writer thread when AI_SQLITE['WRITE_QUEUE']
+    is on, else here with retry_writes(). Returns func's result.
+    """
+    if sqlite_settings()['WRITE_QUEUE'] and not connection.in_atomic_block:
+        # (Inside a transaction the writer couldn't see our uncommitted rows)
+        return write_queue().submit(func, *args, **kwargs).result()
+    return retry_writes(func)(*args, **kwargs)
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from contextlib import closing
+
+from django.db import connection
+from django.urls import reverse
+
+from .json_extract import JSONExtractor
+from . import singleflight
+
+
+# Seconds between SSE comments while the AI is still writing a section.
+# Writing is how the server notices a client that went away, which then
+# closes the generator and with it the provider stream.
+KEEPALIVE_SECONDS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(event, data):
+    """
+    Formats one Server-Sent Events frame.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_comment(text='keepalive'):
+    return f": {text}\n\n"
+
+
+class BlueprintStreamParser:
+    """
+    Streaming front-end to JSONExtractor for the blueprint object.
+    feed() returns the (key, value) pairs whose values completed in that
+    chunk, so callers can publish 'overview', 'architecture', ... as soon
+    as each one closes. Input must already be free of <think> blocks.
+    """
+
+    def __init__(self, schema=None):
+        self._extractor = JSONExtractor(schema=schema, strip_think=False)
+        self._emitted = set()
+        self.extraction = None
+
+    @property
+    def finished(self):
+        return self._extractor.finished
+
+    @property
+    def complete(self):
+        return self.extraction is not None and self.extraction.complete
+
+    @property
+    def result(self):
+        return self._extractor.root or {}
+
+    def feed(self, text):
+        return self._track(self._extractor.feed(text))
+
+    def close(self):
+        """
+        Called when the stream ends. If the output was truncated, the
+        members still open are salvaged as they stand.
+        """
+        self.extraction = self._extractor.close()
+        return self._track(list(self.result.items()))
+
+    def _track(self, members):
+        fresh = [(key, value) for key, value in members if key not in self._emitted]
+        self._emitted.update(key for key, _ in fresh)
+        return fresh
+
+
+def blueprint_event_stream(project, use_cache=True):
+    """
+    SSE generator used by the HTML and DRF generate endpoints.
+    Emits one 'section' event per finished top-level key, then saves
+    the blueprint and emits 'done' (or 'error').
+    Joins the same single flight as generation.generate_blueprint(): if
+    another request is already generating this blueprint, waits for it
+    and replays the result instead of starting a second LLM call.
+    """
+    from .generation import blueprint_flight_key
+
+    requirements = project.requirements_data.get('answers', {})
+    key = blueprint_flight_key(project, requirements, use_cache)
+    with singleflight.lead(key) as (flight, leader):
+        if leader:
+            flight.result = yield from _generate_blueprint_events(project, requirements, use_cache)
+            return
+
+        timeout = singleflight.wait_timeout(key)
+        give_up = time.monotonic() + timeout
+        try:
+            while not flight.done.wait(KEEPALIVE_SECONDS):
+                if time.monotonic() >= give_up:
+                    raise singleflight.FlightTimeout(f"{key}: no result within {timeout:g}s")
+                yield sse_comment()
+            blueprint = flight.outcome()
+        except singleflight.FlightAborted:
+            blueprint = None  # That request went away mid-generation
+        except Exception as e:
+            blueprint = {"error": "Blueprint Generation Failed", "raw": str(e)}
+
+    if blueprint is None:
+        yield from blueprint_event_stream(project, use_cache)
+    elif 'error' in blueprint:
+        yield sse_event('error', {'message': blueprint['raw']})
+    else:
+        yield from _replay_blueprint(project, blueprint)
+
+
+def _replay_blueprint(project, blueprint):
+    for key, value in blueprint.items():
+        yield sse_event('section', {'key': key, 'value': value})
+    yield sse_event('done', {'redirect': reverse('project_blueprint', args=[project.pk])})
+
+
+def _generate_blueprint_events(project, requirements, use_cache):
+    """
+    The leader's side of blueprint_event_stream(). Returns the stored
+    blueprint or an {"error", "raw"} dict, like generate_blueprint().
+    """
+    from .ai_service import AIService
+    from .generation import adopt_speculative_blueprint, store_blueprint
+
+    blueprint = {}
+
+    # Already generated speculatively (or about to be): replay it
+    speculative = adopt_speculative_blueprint(project) if use_cache else None
+    if speculative:
+        yield from _replay_blueprint(project, speculative)
+        return speculative
+
+    try:
+        ai = AIService(user=project.user_id)
+        with closing(ai.stream_blueprint(requirements, use_cache=use_cache, keepalive=KEEPALIVE_SECONDS)) as sections:
+            for key, value in sections:
+                if key is None:
+                    yield sse_comment()
+                    continue
+                blueprint[key] = value
+                yield sse_event('section', {'key': key, 'value': value})
+    except Exception as e:
+        yield sse_event('error', {'message': str(e)})
+        return {"error": "Blueprint Generation Failed", "raw": str(e)}
+
+    if not blueprint:
+        message = 'The AI returned no usable blueprint.'
+        yield sse_event('error', {'message': message})
+        return {"error": "Blueprint Generation Failed", "raw": message}
+
+    stored = store_blueprint(project, blueprint)
+    if 'error' in stored:
+        yield sse_event('error', {'message': stored['raw']})
+        return stored
+    yield sse_event('done', {'redirect': reverse('project_blueprint', args=[project.pk])})
+    return stored
+
+
+def doc_sections_event_stream(project, section_keys, regenerate=False):
+    """
+    SSE generator for "generate all sections": one event per section as
+    it finishes (in completion order), with running progress counts.
+    """
+    from .generation import doc_section_html, generate_doc_sections
+
+    total = len(section_keys)
+    done = 0
+    yield sse_event('start', {'sections': section_keys, 'total': total})
+
+    for key, md_content, error in generate_doc_sections(project, section_keys, regenerate=regenerate):
+        done += 1
+        payload = {'key': key, 'done': done, 'total': total}
+        if error:
+            payload['error'] = error
+            yield sse_event('section_failed', payload)
+        else:
+            payload['markdown'] = md_content
+            payload['html'] = doc_section_html(project, key, md_content)
+            yield sse_event('section', payload)
+
+    yield sse_event('done', {'done': done, 'total': total})
+
+
+async def aiter_events(make_events, *args, **kwargs):
+    """
+    Async front-end to the SSE generators above, for the ASGI views.
+    Under ASGI, Django reads a sync iterator to the end before sending
+    anything, so make_events(*args, **kwargs) runs on its own thread and
+    passes each frame over as soon as it is produced. If the client
+    disconnects, Django cancels this generator. The thread then closes
+    make_events' generator at its next frame (keepalives arrive at
+    least every KEEPALIVE_SECONDS while tokens flow), and that closes
+    the provider stream.
+    """
+    loop = asyncio.get_running_loop()
+    frames = asyncio.Queue()
+    stop = threading.Event()
+    end = object()
+
+    def hand_over(frame):
+        try:
+            loop.call_soon_threadsafe(frames.put_nowait, frame)
+        except RuntimeError:  # Loop closed: nobody is listening
+            stop.set()
+
+    def produce():
+        try:
+            with closing(make_events(*args, **kwargs)) as events:
+                for frame in events:
+                    if stop.is_set():
+                        break
+                    hand_over(frame)
+        except Exception as e:
+            logger.error(f"Event stream failed: {e}")
+            hand_over(sse_event('error', {'message': str(e)}))
+        finally:
+            connection.close()  # This thread's own DB connection
+            hand_over(end)
+
+    threading.Thread(target=produce, name='sse-events', daemon=True).start()
+    try:
+        while (frame := await frames.get()) is not end:
+            yield frame
+    finally:
+        stop.set()
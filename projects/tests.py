@@ -1,3 +1,1465 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .ai_service import AIService
+from .context import build_context
+from .deadlines import Deadline, DeadlineExceeded, deadline_for
+from .engine import ConflictError, FlowEngine
+from .fields import RAW, ZLIB, pack, unpack
+from .json_extract import JSONExtractor, extract_json
+from .llm_cache import LLMResponseCache, make_cache_key, response_cache
+from .models import AIJob, AIResponseCache, DocSection, LLMCallRollup, Project, TaskGuide
+from .pagination import InvalidCursor, encode_cursor, keyset_paginate
+from .prompts import (
+    PROMPTS, PrefixCacheStats, PromptTemplate, cached_prompt_tokens, doc_section_prompt, get_prompt,
+    register as register_prompt,
+)
+from .providers import ProviderRouter, StubProvider
+from .ratelimit import ProviderLimiter, RateLimited, get_limiter, retry_after_seconds
+from .sqlite import retry_writes
+from .streaming import (
+    BlueprintStreamParser, aiter_events, blueprint_event_stream, doc_sections_event_stream, sse_comment, sse_event,
+)
+from . import generation, jobs, llm_clients, metrics, rendering, singleflight
+
+
+class ProviderLimiterTests(TestCase):
+    def setUp(self):
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        limits = {'test': {'MAX_IN_FLIGHT': 1, 'RPM': 6000, 'MAX_WAIT': 2.0}}
+        overrides = override_settings(AI_LOCK_DIR=lock_dir.name, AI_RATE_LIMITS=limits)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.limiter = ProviderLimiter('test')
+
+    def test_acall_cancelled_while_waiting_releases_slot(self):
+        async def scenario():
+            held = self.limiter.acquire(timeout=1)
+
+            async def request():
+                return 'done'
+
+            task = asyncio.ensure_future(self.limiter.acall(request))
+            await asyncio.sleep(0.2)  # acall is now queued behind `held`
+            task.cancel()
+            held.release()  # The waiting thread gets the slot...
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(scenario())
+
+        # ...and hands it straight back
+        self.assertEqual(self.limiter._local_in_flight, 0)
+        self.limiter.acquire(timeout=1).release()
+
+    def test_acall_releases_slot_after_success(self):
+        async def request():
+            return 'done'
+
+        self.assertEqual(asyncio.run(self.limiter.acall(request)), 'done')
+        self.limiter.acquire(timeout=1).release()
+
+    def test_queued_async_calls_leave_the_lock_pool_free(self):
+        async def request():
+            return 'done'
+
+        async def scenario():
+            held = self.limiter.acquire(timeout=1)
+            queued = [asyncio.ensure_future(self.limiter.acall(request)) for _ in range(40)]
+            await asyncio.sleep(0.2)
+            # With a thread parked per queued call this would wait for MAX_WAIT
+            probe = asyncio.get_running_loop().run_in_executor(singleflight.lock_executor(), lambda: 'free')
+            self.assertEqual(await asyncio.wait_for(probe, 0.5), 'free')
+            held.release()
+            return await asyncio.gather(*queued)
+
+        self.assertEqual(asyncio.run(scenario()), ['done'] * 40)
+        self.assertEqual(self.limiter._local_in_flight, 0)
+
+    def test_state_files_are_used_outside_the_queue_lock(self):
+        take_token = self.limiter._take_token
+        free = []
+
+        def checked_take_token():
+            def try_lock():
+                free.append(self.limiter._cond.acquire(timeout=1))
+                if free[-1]:
+                    self.limiter._cond.release()
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+            return take_token()
+
+        with mock.patch.object(self.limiter, '_take_token', checked_take_token):
+            self.limiter.acquire(timeout=1).release()
+        self.assertEqual(free, [True])
+
+    def test_retry_after_header(self):
+        def rate_limited(**headers):
+            return mock.Mock(status_code=429, response=mock.Mock(headers=headers))
+
+        self.assertEqual(retry_after_seconds(rate_limited(**{'retry-after': '7'})), 7.0)
+        self.assertEqual(retry_after_seconds(rate_limited(**{'retry-after-ms': '250'})), 0.25)
+        self.assertEqual(retry_after_seconds(rate_limited(**{'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'})), 0.0)
+        # Malformed: plain backoff instead of an exception
+        self.assertEqual(retry_after_seconds(rate_limited(**{'retry-after': 'soon-ish'})), 0.0)
+        self.assertIsNone(retry_after_seconds(mock.Mock(status_code=500)))
+
+
+class EventStreamTests(TestCase):
+    def test_frames_are_sent_while_the_generator_runs(self):
+        first_sent = threading.Event()
+
+        def events():
+            yield 'first'
+            # Only reached if 'first' went out before the generator ended
+            self.assertTrue(first_sent.wait(2))
+            yield 'second'
+
+        async def scenario():
+            received = []
+            async for frame in aiter_events(events):
+                received.append(frame)
+                first_sent.set()
+            return received
+
+        self.assertEqual(asyncio.run(scenario()), ['first', 'second'])
+
+    def test_disconnect_closes_the_sync_generator(self):
+        closed = threading.Event()
+
+        def events():
+            try:
+                while True:
+                    yield sse_comment()
+                    time.sleep(0.01)
+            finally:
+                closed.set()
+
+        async def scenario():
+            stream = aiter_events(events)
+            await stream.__anext__()
+            await stream.aclose()  # What Django does when the client goes away
+
+        asyncio.run(scenario())
+        self.assertTrue(closed.wait(2))
+
+    def test_errors_become_error_events(self):
+        def events():
+            raise RuntimeError('boom')
+            yield
+
+        async def scenario():
+            return [frame async for frame in aiter_events(events)]
+
+        with self.assertLogs('projects.streaming', 'ERROR'):
+            frames = asyncio.run(scenario())
+        self.assertEqual(frames, [sse_event('error', {'message': 'boom'})])
+
+
+class BlueprintStreamTests(TestCase):
+    BLUEPRINT = {'overview': 'A taxi app', 'architecture': {'style': 'Monolith'}, 'api': {'style': 'REST'}}
+
+    def setUp(self):
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        overrides = override_settings(AI_LOCK_DIR=lock_dir.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        response_cache.clear_memory()
+        self.addCleanup(response_cache.clear_memory)
+        user = User.objects.create_user('sse-test')
+        self.project = Project.objects.create(
+            user=user, name='SSE', current_phase=6, requirements_data={'answers': {'intent': {'description': 'Taxis'}}},
+        )
+
+    def test_parser_emits_each_key_once_it_closes(self):
+        parser = BlueprintStreamParser()
+        self.assertEqual(parser.feed('{"overview": "A taxi'), [])
+        self.assertEqual(parser.feed(' app", "api": {"style"'), [('overview', 'A taxi app')])
+        self.assertEqual(parser.feed(': "REST"}}'), [('api', {'style': 'REST'})])
+        self.assertEqual(parser.close(), [])
+        self.assertTrue(parser.complete)
+
+    def test_parser_salvages_a_truncated_stream(self):
+        parser = BlueprintStreamParser()
+        self.assertEqual(parser.feed('{"overview": "A taxi app", "api": {"style": "RE'), [('overview', 'A taxi app')])
+        self.assertEqual([key for key, _ in parser.close()], ['api'])
+        self.assertFalse(parser.complete)
+
+    def test_sections_are_sent_as_they_arrive(self):
+        provider = StubProvider('sse', responder=lambda messages: json.dumps(self.BLUEPRINT))
+        with mock.patch('projects.ai_service.get_router', return_value=ProviderRouter([provider])):
+            frames = list(blueprint_event_stream(self.project))
+
+        self.assertEqual(frames[:-1], [sse_event('section', {'key': key, 'value': value})
+                                       for key, value in self.BLUEPRINT.items()])
+        self.assertIn('event: done', frames[-1])
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.blueprint_data, self.BLUEPRINT)
+
+    def test_provider_errors_become_an_error_event(self):
+        def down(messages):
+            raise RuntimeError('provider down')
+
+        with mock.patch('projects.ai_service.get_router', return_value=ProviderRouter([StubProvider('sse', responder=down)])):
+            frames = list(blueprint_event_stream(self.project))
+        self.assertEqual(frames, [sse_event('error', {'message': 'provider down'})])
+
+
+class JobQueueTests(TransactionTestCase):
+    # Transactional: the lease heartbeat writes from its own thread
+
+    def setUp(self):
+        user = User.objects.create_user('worker-test')
+        self.project = Project.objects.create(user=user, name='Jobs')
+
+    def enqueue(self, handler, **kwargs):
+        patcher = mock.patch.dict(jobs.JOB_HANDLERS, {'task_guide': handler})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return jobs.enqueue(self.project, 'task_guide', {'task': 'x'}, **kwargs)
+
+    def test_claim_leases_job_to_one_worker(self):
+        job = self.enqueue(lambda job: {})
+        claimed = jobs.claim_next('w1', lease_seconds=60)
+        self.assertEqual((claimed.pk, claimed.worker_id, claimed.attempts), (job.pk, 'w1', 1))
+        self.assertIsNone(jobs.claim_next('w2', lease_seconds=60))
+
+    def test_expired_lease_is_reclaimed(self):
+        job = self.enqueue(lambda job: {})
+        jobs.claim_next('w1', lease_seconds=60)
+        AIJob.objects.filter(pk=job.pk).update(leased_until=timezone.now() - timedelta(seconds=1))
+        claimed = jobs.claim_next('w2', lease_seconds=60)
+        self.assertEqual((claimed.worker_id, claimed.attempts), ('w2', 2))
+
+    def test_expired_jobs_are_failed_not_claimed(self):
+        job = self.enqueue(lambda job: {})
+        AIJob.objects.filter(pk=job.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(jobs.claim_next('w1'))
+        self.assertEqual(AIJob.objects.get(pk=job.pk).status, 'failed')
+
+    def test_failed_attempts_are_retried_then_failed(self):
+        def fail(job):
+            raise RuntimeError('provider down')
+
+        job = self.enqueue(fail, max_attempts=2)
+        with self.assertLogs('projects.jobs', 'ERROR'):
+            job = jobs.run_job(jobs.claim_next('w1'))
+        self.assertEqual((job.status, job.error), ('queued', 'provider down'))
+        self.assertGreater(job.run_after, timezone.now())
+
+        AIJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        with self.assertLogs('projects.jobs', 'ERROR'):
+            job = jobs.run_job(jobs.claim_next('w1'))
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_heartbeat_keeps_a_long_job_leased(self):
+        def slow(job):
+            time.sleep(0.8)
+            return {'ok': True}
+
+        self.enqueue(slow)
+        job = jobs.claim_next('w1', lease_seconds=0.3)
+        runner = threading.Thread(target=jobs.run_job, args=(job, 0.3))
+        runner.start()
+        time.sleep(0.5)  # Past the original lease
+        self.assertIsNone(jobs.claim_next('w2', lease_seconds=60))
+        runner.join()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.attempts), ('succeeded', {'ok': True}, 1))
+
+    def test_result_is_dropped_after_losing_the_lease(self):
+        def reclaimed(job):
+            # Another worker takes the job over mid-run
+            AIJob.objects.filter(pk=job.pk).update(worker_id='w2', attempts=job.attempts + 1)
+            return {'stale': True}
+
+        self.enqueue(reclaimed)
+        with self.assertLogs('projects.jobs', 'WARNING'):
+            job = jobs.run_job(jobs.claim_next('w1', lease_seconds=60))
+        self.assertEqual((job.status, job.worker_id, job.result), ('running', 'w2', None))
+
+
+class ProjectVersionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cas-test')
+        self.project = Project.objects.create(user=self.user, name='CAS')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/projects/{self.project.pk}/'
+
+    def test_stale_engine_write_conflicts(self):
+        stale = Project.objects.get(pk=self.project.pk)
+        FlowEngine(self.project).submit_answer('intent', {'description': 'A'})
+        with self.assertRaises(ConflictError) as raised:
+            FlowEngine(stale).submit_answer('intent', {'description': 'B'})
+        self.assertEqual(raised.exception.current_version, 1)
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.requirements_data['answers']['intent'], {'description': 'A'})
+
+    def test_submit_answer_with_stale_version_is_409(self):
+        FlowEngine(self.project).submit_answer('intent', {'description': 'A'})
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.client.post(f'{self.url}submit_answer/', {
+                'stage': 'intent', 'answer_data': {'description': 'B'}, 'version': 0,
+            }, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['version'], 1)
+
+    def test_patch_bumps_version(self):
+        response = self.client.patch(self.url, {'name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], 1)
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.name, self.project.version), ('Renamed', 1))
+
+    def test_patch_with_stale_version_is_409(self):
+        FlowEngine(self.project).submit_answer('intent', {'description': 'A'})
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.client.patch(self.url, {'requirements_data': {}, 'version': 0}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.requirements_data['answers']['intent'], {'description': 'A'})
+
+    def test_put_does_not_overwrite_concurrent_answers(self):
+        body = self.client.get(self.url).data
+        FlowEngine(Project.objects.get(pk=self.project.pk)).submit_answer('intent', {'description': 'A'})
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.client.put(self.url, {
+                'name': 'Renamed', 'requirements_data': body['requirements_data'], 'version': body['version'],
+            }, format='json')
+        self.assertEqual(response.status_code, 409)
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('fields-test')
+        self.project = Project.objects.create(
+            user=self.user, name='Fields', requirements_data={'answers': {'intent': {'description': 'A'}}},
+            blueprint_data={'overview': 'An app'},
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_leaves_out_the_blobs(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/projects/')
+        row = response.data['results'][0]
+        self.assertEqual((row['name'], row['version']), ('Fields', 0))
+        self.assertFalse(set(Project.BLOB_FIELDS) & set(row))
+        self.assertFalse(any('blueprint_data' in query['sql'] for query in queries.captured_queries))
+
+    def test_fields_selects_columns_and_serializer_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/projects/', {'fields': 'name,status_display,blueprint_data'})
+        self.assertEqual(response.data['results'], [
+            {'name': 'Fields', 'status_display': self.project.get_status_display(), 'blueprint_data': {'overview': 'An app'}},
+        ])
+        select = next(query['sql'] for query in queries.captured_queries if 'FROM "projects_project"' in query['sql'])
+        self.assertNotIn('requirements_data', select)
+
+        response = self.client.get(f'/api/projects/{self.project.pk}/', {'fields': 'requirements_data'})
+        self.assertEqual(response.data, {'requirements_data': {'answers': {'intent': {'description': 'A'}}}})
+
+    def test_unknown_fields_are_rejected(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.client.get('/api/projects/', {'fields': 'name,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['fields'], ['Unknown field: password'])
+
+
+class SingleFlightTests(TestCase):
+    def test_concurrent_callers_share_one_call(self):
+        calls = []
+        release = threading.Event()
+
+        def work():
+            calls.append(1)
+            release.wait(2)
+            return 'result'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(singleflight.run('sf-test', work)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((len(calls), results), (1, ['result'] * 5))
+
+    def test_errors_reach_followers(self):
+        release = threading.Event()
+
+        def fail():
+            release.wait(2)
+            raise RuntimeError('boom')
+
+        errors = []
+
+        def call():
+            try:
+                singleflight.run('sf-error', fail)
+            except RuntimeError as e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, ['boom'] * 3)
+
+    def test_follower_takes_over_an_abandoned_flight(self):
+        def stream():
+            with singleflight.lead('sf-abandoned') as (flight, leader):
+                yield leader
+
+        leading = stream()
+        self.assertTrue(next(leading))
+        results = []
+        follower = threading.Thread(target=lambda: results.append(singleflight.run('sf-abandoned', lambda: 'fresh')))
+        follower.start()
+        time.sleep(0.1)
+        leading.close()  # The streaming client went away
+        follower.join(2)
+        self.assertEqual(results, ['fresh'])
+
+    def test_async_followers_do_not_starve_the_default_executor(self):
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)  # Let the followers pile up
+            return await asyncio.to_thread(lambda: 'result')  # Needs a free default-executor thread
+
+        async def scenario():
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2))
+            runs = [singleflight.arun('sf-async-many', work) for _ in range(50)]
+            return await asyncio.wait_for(asyncio.gather(*runs), 5)
+
+        self.assertEqual(asyncio.run(scenario()), ['result'] * 50)
+        self.assertEqual(len(calls), 1)
+
+    def test_followers_give_up_after_the_timeout(self):
+        def stream():
+            with singleflight.lead('sf-stuck') as (flight, leader):
+                yield leader
+
+        leading = stream()
+        self.assertTrue(next(leading))
+        self.addCleanup(leading.close)
+
+        with self.assertRaises(singleflight.FlightTimeout):
+            singleflight.run('sf-stuck', lambda: 'never', timeout=0.1)
+        with self.assertRaises(singleflight.FlightTimeout):
+            asyncio.run(singleflight.arun('sf-stuck', self.fail, timeout=0.1))
+
+    def test_wait_timeout_follows_the_operation_deadline(self):
+        with override_settings(AI_DEADLINES={'doc_section': 10, 'default': 20}):
+            key = singleflight.make_key('project', 'doc_section', 'backend')
+            self.assertEqual(singleflight.wait_timeout(key), 10 + singleflight.WAIT_GRACE)
+            self.assertEqual(singleflight.wait_timeout('sf-test'), 20 + singleflight.WAIT_GRACE)
+
+
+@mock.patch('projects.ai_service.get_router')
+class BlueprintFlightTests(TransactionTestCase):
+    # Transactional: the other request stores the blueprint from its own thread
+    BLUEPRINT = {'overview': 'An app', 'api': {'style': 'REST'}}
+
+    def setUp(self):
+        user = User.objects.create_user('flight-test')
+        self.project = Project.objects.create(
+            user=user, name='Flight', current_phase=6,
+            requirements_data={'answers': {'intent': {'description': 'A'}}},
+        )
+
+    def test_generate_joins_a_running_stream(self, get_router):
+        release = threading.Event()
+
+        def stream_blueprint(ai, requirements, **kwargs):
+            items = iter(self.BLUEPRINT.items())
+            yield next(items)
+            release.wait(2)  # Still generating while the other request arrives
+            yield from items
+
+        with mock.patch('projects.ai_service.AIService.stream_blueprint', stream_blueprint), \
+                mock.patch('projects.ai_service.AIService.generate_blueprint') as generate:
+            events = blueprint_event_stream(self.project)
+            results = []
+            follower = threading.Thread(target=lambda: results.append(generation.generate_blueprint(
+                Project.objects.get(pk=self.project.pk))))
+
+            first = next(events)  # Now leading the flight
+            follower.start()
+            time.sleep(0.2)
+            release.set()
+            frames = [first, *events]
+            follower.join(2)
+
+        generate.assert_not_called()
+        self.assertEqual(results[0], self.BLUEPRINT)
+        self.assertIn('event: done', frames[-1])
+
+    def test_stream_replays_a_running_generate(self, get_router):
+        release = threading.Event()
+
+        def generate_blueprint(ai, requirements, **kwargs):
+            release.wait(2)
+            return dict(self.BLUEPRINT)
+
+        with mock.patch('projects.ai_service.AIService.generate_blueprint', generate_blueprint), \
+                mock.patch('projects.ai_service.AIService.stream_blueprint') as stream:
+            leader = threading.Thread(target=generation.generate_blueprint, args=(Project.objects.get(pk=self.project.pk),))
+            leader.start()
+            time.sleep(0.2)
+            threading.Timer(0.2, release.set).start()
+            frames = list(blueprint_event_stream(self.project))
+            leader.join(2)
+
+        stream.assert_not_called()
+        self.assertEqual(frames[:-1], [sse_event('section', {'key': key, 'value': value})
+                                       for key, value in self.BLUEPRINT.items()])
+        self.assertIn('event: done', frames[-1])
+
+
+@override_settings(AI_SPECULATIVE_BLUEPRINT={'ENABLED': True}, AI_BACKGROUND_JOBS=True)
+class SpeculativeBlueprintTests(TransactionTestCase):
+    # Transactional: the job runner heartbeats from its own thread
+    BLUEPRINT = {'overview': 'An app', 'api': {'style': 'REST'}}
+
+    def setUp(self):
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        overrides = override_settings(AI_LOCK_DIR=lock_dir.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        user = User.objects.create_user('speculation-test')
+        self.project = Project.objects.create(
+            user=user, name='Speculation', current_phase=6,
+            requirements_data={'answers': {'intent': {'description': 'A'}}},
+        )
+        patcher = mock.patch('projects.ai_service.AIService.generate_blueprint', return_value=dict(self.BLUEPRINT))
+        self.generate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_locking_queues_one_speculation_per_answers(self):
+        job = jobs.speculate_blueprint(self.project)
+        self.assertEqual(job.kind, generation.SPECULATIVE_KIND)
+        self.assertEqual(jobs.speculate_blueprint(self.project).pk, job.pk)
+        with override_settings(AI_SPECULATIVE_BLUEPRINT={'ENABLED': False}):
+            self.assertIsNone(jobs.speculate_blueprint(self.project))
+
+    def test_generate_adopts_a_finished_speculation(self):
+        jobs.speculate_blueprint(self.project)
+        self.assertEqual(jobs.run_job(jobs.claim_next('w1')).status, 'succeeded')
+        self.assertEqual(self.generate.call_count, 1)
+
+        self.assertEqual(generation.generate_blueprint(Project.objects.get(pk=self.project.pk)), self.BLUEPRINT)
+        self.assertEqual(self.generate.call_count, 1)  # No second AI call
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.blueprint_data, self.project.current_phase), (self.BLUEPRINT, 7))
+
+    def test_queued_speculation_is_cancelled_by_an_explicit_generate(self):
+        job = jobs.speculate_blueprint(self.project)
+        generation.generate_blueprint(self.project)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('failed', 'Superseded by an explicit generate.'))
+        self.assertEqual(self.generate.call_count, 1)
+
+    def test_changed_answers_discard_the_speculation(self):
+        stale = jobs.speculate_blueprint(self.project)
+        FlowEngine(self.project).submit_answer('intent', {'description': 'B'})
+        generation.discard_speculation(self.project)
+        self.assertFalse(AIJob.objects.filter(pk=stale.pk).exists())
+        self.assertIsNone(generation.speculative_blueprint(self.project))
+
+        # A speculation that was already running fails instead of answering for old answers
+        job = jobs.enqueue(self.project, generation.SPECULATIVE_KIND, {'requirements_hash': stale.payload['requirements_hash']}, max_attempts=1)
+        with self.assertLogs('projects.jobs', 'ERROR'):
+            job = jobs.run_job(jobs.claim_next('w1'))
+        self.assertEqual(job.status, 'failed')
+        self.generate.assert_not_called()
+
+
+class DocSectionGenerationTests(TransactionTestCase):
+    # Transactional: sections are generated and saved on pool threads. One
+    # at a time: the in-memory test DB fails overlapping reads and writes
+    # with "database table is locked" instead of waiting
+
+    def setUp(self):
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        overrides = override_settings(AI_LOCK_DIR=lock_dir.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        patcher = mock.patch('projects.ratelimit.max_in_flight', return_value=1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = User.objects.create_user('docs-test')
+        self.project = Project.objects.create(user=user, name='Docs', blueprint_data={'overview': 'An app'})
+
+    def generate_with(self, generate_doc_section):
+        async def agenerate_doc_section(*args, **kwargs):
+            return generate_doc_section(*args, **kwargs)
+
+        for name, method in (('generate_doc_section', generate_doc_section), ('agenerate_doc_section', agenerate_doc_section)):
+            patcher = mock.patch(f'projects.ai_service.AIService.{name}', method)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_failed_section_is_returned_but_not_saved(self):
+        def down(ai, context, section_key, use_cache=True, raise_errors=False):
+            self.assertTrue(raise_errors)
+            raise RuntimeError('provider down')
+
+        self.generate_with(down)
+        self.assertEqual(generation.load_doc_section(self.project, 'api'), 'Error generating section: provider down')
+        self.assertEqual(asyncio.run(generation.aload_doc_section(self.project, 'api')), 'Error generating section: provider down')
+        with self.assertRaisesMessage(RuntimeError, 'provider down'):
+            generation.load_doc_section(self.project, 'api', raise_errors=True)
+        self.assertFalse(DocSection.objects.exists())
+
+    def test_sections_are_saved_as_they_finish(self):
+        def generate(ai, context, section_key, use_cache=True, raise_errors=False):
+            if section_key == 'api':
+                raise RuntimeError('provider down')
+            return f'# {section_key}'
+
+        self.generate_with(generate)
+        with mock.patch('projects.generation.doc_section_html', lambda project, key, md_content: md_content):
+            frames = list(doc_sections_event_stream(self.project, ['overview', 'api', 'setup']))
+        events = [(event[7:], json.loads(data[6:])) for event, data in (frame.split('\n')[:2] for frame in frames)]
+
+        self.assertEqual(events[0], ('start', {'sections': ['overview', 'api', 'setup'], 'total': 3}))
+        self.assertEqual(events[-1], ('done', {'done': 3, 'total': 3}))
+        progress = events[1:-1]
+        self.assertEqual([data['done'] for _, data in progress], [1, 2, 3])
+        self.assertEqual(sorted((event, data['key']) for event, data in progress),
+                         [('section', 'overview'), ('section', 'setup'), ('section_failed', 'api')])
+        self.assertEqual([data['error'] for event, data in progress if event == 'section_failed'], ['provider down'])
+        self.assertEqual(dict(DocSection.objects.values_list('key', 'markdown')), {'overview': '# overview', 'setup': '# setup'})
+
+    def test_closing_the_stream_drops_sections_not_started(self):
+        started = []
+
+        def generate(ai, context, section_key, use_cache=True, raise_errors=False):
+            started.append(section_key)
+            time.sleep(0.1)
+            return f'# {section_key}'
+
+        self.generate_with(generate)
+        sections = generation.generate_doc_sections(self.project, ['overview', 'features', 'backend', 'api'])
+        self.assertEqual(next(sections)[0], 'overview')
+        sections.close()  # The SSE client went away
+        time.sleep(0.3)
+        self.assertLessEqual(len(started), 2)
+
+
+class TaskGuideBatchTests(TransactionTestCase):
+    # Transactional: guides are generated on pool threads, one at a time
+    # (the in-memory test DB fails overlapping reads and writes)
+    BLUEPRINT = {'phases': [
+        {'phase': 1, 'title': 'Foundation', 'tasks': ['Set up repo', 'Add CI']},
+        {'phase': 2, 'title': 'Core', 'tasks': ['Build API', 'Add CI']},
+    ]}
+
+    def setUp(self):
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        overrides = override_settings(AI_LOCK_DIR=lock_dir.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        patcher = mock.patch('projects.ratelimit.max_in_flight', return_value=1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('guides-test')
+        self.project = Project.objects.create(user=self.user, name='Guides', blueprint_data=self.BLUEPRINT)
+        self.written = []
+
+        def guide(ai, project_context, current_task, raise_errors=False):
+            self.written.append(current_task)
+            if current_task == 'Build API':
+                raise RuntimeError('provider down')
+            return f'## {current_task}'
+
+        patcher = mock.patch('projects.ai_service.AIService.generate_task_guide', guide)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_tasks_are_listed_per_phase_once(self):
+        self.assertEqual(generation.blueprint_tasks(self.project), ['Set up repo', 'Add CI', 'Build API'])
+        self.assertEqual(generation.blueprint_tasks(self.project, '2'), ['Build API', 'Add CI'])
+
+    def test_missing_guides_are_generated_once_and_stored(self):
+        guides, errors = generation.generate_task_guides(self.project, generation.blueprint_tasks(self.project))
+        self.assertEqual(guides, {'Set up repo': '## Set up repo', 'Add CI': '## Add CI'})
+        self.assertEqual(errors, {'Build API': 'provider down'})
+
+        # Stored guides are served; only the failed one is retried
+        guides, _ = generation.generate_task_guides(self.project, generation.blueprint_tasks(self.project))
+        self.assertEqual(sorted(self.written), ['Add CI', 'Build API', 'Build API', 'Set up repo'])
+        self.assertEqual(set(guides), {'Set up repo', 'Add CI'})
+
+    def test_guides_follow_the_blueprint(self):
+        generation.generate_task_guides(self.project, ['Add CI'])
+        self.project.blueprint_data = {'phases': [{'phase': 1, 'tasks': ['Add CI']}]}
+        self.project.save(update_fields=['blueprint_data'])
+        self.assertEqual(generation.stored_task_guides(self.project), {})
+        generation.generate_task_guides(self.project, ['Add CI'])
+        self.assertEqual(self.written, ['Add CI', 'Add CI'])
+        self.assertEqual(TaskGuide.objects.filter(project=self.project).count(), 1)  # The old one is pruned
+
+    def test_board_fetches_a_phase_in_one_request(self):
+        self.client.force_login(self.user)
+        response = self.client.post(f'/projects/{self.project.pk}/generate_task_guides/', {'phase': 1},
+                                    content_type='application/json')
+        self.assertEqual(response.json(), {'guides': {'Set up repo': '## Set up repo', 'Add CI': '## Add CI'}, 'errors': {}})
+
+
+class RenderedHTMLTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('render-test')
+        self.project = Project.objects.create(user=user, name='Render')
+        generation.save_doc_section(self.project, 'api', '# API')
+
+    def test_stored_html_is_served_without_rendering(self):
+        section = DocSection.objects.get(project=self.project, key='api')
+        self.assertEqual((section.html, section.html_key), ('<h1>API</h1>', rendering.html_key('# API')))
+        with mock.patch('projects.rendering.render_markdown') as render:
+            self.assertEqual(generation.doc_section_html(self.project, 'api', '# API'), '<h1>API</h1>')
+        render.assert_not_called()
+
+    def test_renderer_version_bump_re_renders_once(self):
+        with mock.patch('projects.rendering.RENDERER_VERSION', rendering.RENDERER_VERSION + 1):
+            new_key = rendering.html_key('# API')
+            self.assertNotEqual(new_key, DocSection.objects.get(project=self.project, key='api').html_key)
+            self.assertEqual(generation.doc_section_html(self.project, 'api', '# API'), '<h1>API</h1>')
+            self.assertEqual(DocSection.objects.get(project=self.project, key='api').html_key, new_key)
+            with mock.patch('projects.rendering.render_markdown') as render:
+                generation.doc_section_html(self.project, 'api', '# API')
+            render.assert_not_called()
+
+    def test_other_markdown_is_rendered_but_not_stored(self):
+        # e.g. an unsaved error text: the stored section keeps its own HTML
+        self.assertEqual(generation.doc_section_html(self.project, 'api', '# Draft'), '<h1>Draft</h1>')
+        section = DocSection.objects.get(project=self.project, key='api')
+        self.assertEqual((section.markdown, section.html), ('# API', '<h1>API</h1>'))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('pager-test')
+        for i in range(7):
+            Project.objects.create(user=self.user, name=f'P{i}')
+        # Ties on updated_at: the id decides
+        same = timezone.now()
+        Project.objects.filter(name__in=['P2', 'P3', 'P4']).update(updated_at=same)
+        self.projects = Project.objects.filter(user=self.user)
+        self.expected = list(self.projects.order_by('-updated_at', '-id').values_list('pk', flat=True))
+
+    def test_forward_pages_cover_every_row_once(self):
+        seen, cursor = [], None
+        while True:
+            page = keyset_paginate(self.projects, cursor, page_size=3)
+            seen += [project.pk for project in page]
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.expected)
+
+    def test_previous_cursor_returns_the_page_before(self):
+        first = keyset_paginate(self.projects, None, page_size=3)
+        second = keyset_paginate(self.projects, first.next_cursor, page_size=3)
+        back = keyset_paginate(self.projects, second.previous_cursor, page_size=3)
+        self.assertEqual([p.pk for p in back], [p.pk for p in first])
+        self.assertIsNone(back.previous_cursor)
+        self.assertEqual(back.next_cursor, first.next_cursor)
+
+    def test_invalid_cursors_are_rejected(self):
+        for cursor in ('garbage', encode_cursor(('name', 'id'), ['x', 'y'])):
+            with self.assertRaises(InvalidCursor):
+                keyset_paginate(self.projects, cursor, page_size=3)
+
+    def test_dashboard_only_counts_on_the_first_page(self):
+        self.client.force_login(self.user)
+        with mock.patch('projects.views.DASHBOARD_PAGE_SIZE', 3):
+            with CaptureQueriesContext(connection) as first:
+                response = self.client.get('/projects/dashboard/')
+            self.assertEqual(response.context['project_count'], 7)
+
+            cursor = response.context['projects'].next_cursor
+            with CaptureQueriesContext(connection) as older:
+                response = self.client.get('/projects/dashboard/', {'cursor': cursor})
+            self.assertIsNone(response.context['project_count'])
+
+        self.assertTrue(any('COUNT(' in query['sql'] for query in first.captured_queries))
+        self.assertFalse(any('COUNT(' in query['sql'] for query in older.captured_queries))
+
+
+@override_settings(AI_CACHE={'MEMORY_MAX_ENTRIES': 2, 'TTL_SECONDS': 60})
+class LLMResponseCacheTests(TestCase):
+    MESSAGES = [{'role': 'user', 'content': 'Plan a taxi app'}]
+
+    def setUp(self):
+        self.cache = LLMResponseCache()
+
+    def test_key_covers_model_messages_params_and_version(self):
+        key = make_cache_key('m', self.MESSAGES, 0.2, 1000, version='v1')
+        self.assertEqual(key, make_cache_key('m', [{'content': 'Plan a taxi app', 'role': 'user'}], 0.2, 1000, version='v1'))
+        for other in (
+            make_cache_key('m2', self.MESSAGES, 0.2, 1000, version='v1'),
+            make_cache_key('m', self.MESSAGES, 0.7, 1000, version='v1'),
+            make_cache_key('m', self.MESSAGES, 0.2, 2000, version='v1'),
+            make_cache_key('m', self.MESSAGES, 0.2, 1000, version='v2'),
+        ):
+            self.assertNotEqual(key, other)
+
+    def test_memory_tier_evicts_least_recently_used(self):
+        self.cache.set('a', 'A')
+        self.cache.set('b', 'B')
+        self.cache.get('a')
+        self.cache.set('c', 'C')
+        self.assertEqual(list(self.cache._memory), ['a', 'c'])
+
+        # Evicted from memory, still in the DB tier (and promoted back)
+        self.assertEqual(self.cache.get('b'), 'B')
+        stats = self.cache.get_stats()
+        self.assertEqual((stats['memory_hits'], stats['db_hits'], stats['misses']), (1, 1, 0))
+
+    def test_expired_entries_are_misses(self):
+        self.cache.set('a', 'A')
+        # Both tiers past the TTL
+        AIResponseCache.objects.filter(key='a').update(expires_at=timezone.now() - timedelta(seconds=1))
+        with mock.patch('projects.llm_cache.time.time', return_value=time.time() + 61):
+            self.assertIsNone(self.cache.get('a'))
+        self.assertNotIn('a', self.cache._memory)
+        self.assertEqual(self.cache.get_stats()['misses'], 1)
+
+    def test_db_hit_keeps_the_rows_expiry_in_memory(self):
+        self.cache.set('a', 'A')
+        self.cache.clear_memory()
+        AIResponseCache.objects.filter(key='a').update(expires_at=timezone.now() + timedelta(seconds=5))
+        self.assertEqual(self.cache.get('a'), 'A')
+        # Promoted for the row's remaining 5s, not a fresh 60s TTL
+        with mock.patch('projects.llm_cache.time.time', return_value=time.time() + 10):
+            AIResponseCache.objects.filter(key='a').delete()
+            self.assertIsNone(self.cache.get('a'))
+
+    def test_db_errors_are_not_raised(self):
+        self.cache.set('a', 'A')
+        with mock.patch('projects.models.AIResponseCache.objects.filter', side_effect=OperationalError('database is locked')):
+            self.cache.invalidate('a')
+            self.assertNotIn('a', self.cache._memory)
+            self.assertIsNone(self.cache.get('a'))
+
+    def test_db_hits_touch_last_hit_at_at_most_once_per_interval(self):
+        self.cache.set('a', 'A')
+        self.cache.clear_memory()
+        with CaptureQueriesContext(connection) as fresh:
+            self.assertEqual(self.cache.get('a'), 'A')
+        self.assertFalse(any(query['sql'].startswith('UPDATE') for query in fresh.captured_queries))
+
+        AIResponseCache.objects.filter(key='a').update(last_hit_at=timezone.now() - timedelta(minutes=5))
+        self.cache.clear_memory()
+        with CaptureQueriesContext(connection) as stale:
+            self.assertEqual(self.cache.get('a'), 'A')
+        self.assertTrue(any(query['sql'].startswith('UPDATE') for query in stale.captured_queries))
+
+    def test_stats_are_exported(self):
+        self.cache.get('missing')
+        with mock.patch('projects.llm_cache.response_cache', self.cache):
+            text = metrics.render_prometheus()
+        self.assertIn('apprompty_llm_response_cache_lookups_total{result="miss"} 1', text)
+
+
+class ClientPoolTests(TestCase):
+    def setUp(self):
+        llm_clients.reset_clients()
+        self.addCleanup(llm_clients.reset_clients)
+
+    def test_clients_are_shared_per_endpoint_and_credentials(self):
+        client = llm_clients.get_client('https://llm.example/v1', 'key-a')
+        self.assertIs(llm_clients.get_client('https://llm.example/v1', 'key-a'), client)
+        self.assertIsNot(llm_clients.get_client('https://llm.example/v1', 'key-b'), client)
+
+    def test_stats_are_kept_per_pool(self):
+        llm_clients.get_client('https://llm.example/v1', 'key-a')
+        llm_clients.get_client('https://llm.example/v1', 'key-b')
+        llm_clients.get_client('https://llm.example/v1', 'key-a', {'X-Title': 'Planner'})
+        stats = llm_clients.pool_stats()
+        self.assertEqual(len(stats), 3)
+        self.assertTrue(all(label.startswith('https://llm.example/v1 [') for label in stats))
+        self.assertNotIn('key-a', ''.join(stats))
+
+
+class ProviderRouterTests(TestCase):
+    def setUp(self):
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        overrides = override_settings(AI_LOCK_DIR=lock_dir.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_untried_providers_rank_after_measured_ones(self):
+        untried, slow, fast = StubProvider('untried'), StubProvider('slow'), StubProvider('fast')
+        for latency in (2.0, 2.2, 1.8):
+            slow.stats.record(latency, ok=True)
+        fast.stats.record(0.5, ok=True)
+        router = ProviderRouter([untried, slow, fast])
+        self.assertEqual([provider.name for provider in router.ranked()], ['fast', 'slow', 'untried'])
+
+    def test_latency_is_ranked_per_operation(self):
+        a, b = StubProvider('a'), StubProvider('b')
+        a.stats.record(60.0, ok=True, operation='blueprint')
+        a.stats.record(1.0, ok=True, operation='task_guide')
+        b.stats.record(30.0, ok=True, operation='blueprint')
+        b.stats.record(5.0, ok=True, operation='task_guide')
+        router = ProviderRouter([a, b])
+        self.assertEqual([provider.name for provider in router.ranked('blueprint')], ['b', 'a'])
+        self.assertEqual([provider.name for provider in router.ranked('task_guide')], ['a', 'b'])
+        self.assertEqual(a.stats.snapshot('task_guide')['p95'], 1.0)
+
+        router.complete(messages=[{'role': 'user', 'content': 'hi'}], deadline=deadline_for('doc_section.backend'))
+        self.assertEqual(router.get('a').stats.operations(), ['blueprint', 'doc_section', 'task_guide'])
+
+    def test_unhealthy_providers_go_last(self):
+        broken, healthy = StubProvider('broken'), StubProvider('healthy')
+        for _ in range(5):
+            broken.stats.record(0.1, ok=False)
+        healthy.stats.record(3.0, ok=True)
+        router = ProviderRouter([broken, healthy])
+        self.assertEqual([provider.name for provider in router.ranked()], ['healthy', 'broken'])
+
+    def test_failover_to_the_next_provider(self):
+        def down(messages):
+            raise RuntimeError('down')
+
+        router = ProviderRouter([StubProvider('first', responder=down), StubProvider('second', responder=lambda messages: 'ok')])
+        provider, response = router.complete(messages=[{'role': 'user', 'content': 'hi'}])
+        self.assertEqual((provider.name, response.choices[0].message.content), ('second', 'ok'))
+        self.assertEqual(router.get('first').stats.snapshot()['error_rate'], 1.0)
+
+        router = ProviderRouter([StubProvider('first', responder=down)])
+        with self.assertRaisesMessage(RuntimeError, 'down'):
+            router.complete(messages=[{'role': 'user', 'content': 'hi'}])
+
+    @override_settings(AI_ROUTING={'HEDGE_DELAY_DEFAULT': 0.05})
+    def test_hedged_call_takes_the_backup_and_cancels_the_primary(self):
+        slow = StubProvider('hedge-slow', latency=5, responder=lambda messages: 'slow')
+        fast = StubProvider('hedge-fast', responder=lambda messages: 'fast')
+        router = ProviderRouter([slow, fast], hedging=True)
+
+        started = time.monotonic()
+        provider, response = router.complete(messages=[{'role': 'user', 'content': 'hi'}])
+        self.assertEqual((provider.name, response.choices[0].message.content), ('hedge-fast', 'fast'))
+        self.assertLess(time.monotonic() - started, 2)
+
+        # The losing request is cancelled: its limiter slot is free again
+        limiter = get_limiter('hedge-slow')
+        for _ in range(50):
+            if limiter._local_in_flight == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(limiter._local_in_flight, 0)
+        self.assertEqual(slow.stats.snapshot()['samples'], 0)
+
+    def test_hedging_waits_for_a_quick_primary(self):
+        primary = StubProvider('quick-primary', responder=lambda messages: 'primary')
+        backup = StubProvider('unused-backup', responder=lambda messages: 'backup')
+        provider, _ = ProviderRouter([primary, backup], hedging=True).complete(messages=[{'role': 'user', 'content': 'hi'}])
+        self.assertEqual(provider.name, 'quick-primary')
+        self.assertEqual(backup.stats.snapshot()['samples'], 0)
+
+
+class DeadlineTests(TestCase):
+    def setUp(self):
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        overrides = override_settings(AI_LOCK_DIR=lock_dir.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    @override_settings(AI_DEADLINES={'doc_section': 0.05})
+    def test_budget_is_per_operation(self):
+        deadline = deadline_for('doc_section.api')
+        self.assertEqual((deadline.operation, deadline.seconds), ('doc_section', 0.05))
+        self.assertLessEqual(deadline.cap(10), 0.05)
+        self.assertEqual(deadline_for('task_guide').seconds, 90)
+        time.sleep(0.06)
+        self.assertTrue(deadline.expired)
+        with self.assertRaisesMessage(DeadlineExceeded, 'doc_section: no result within 0.05s'):
+            deadline.check()
+
+    def test_a_stalled_provider_is_abandoned_at_the_deadline(self):
+        backup = StubProvider('deadline-backup', responder=lambda messages: 'late')
+        router = ProviderRouter([StubProvider('deadline-stalled', latency=5), backup])
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            router.complete(messages=[{'role': 'user', 'content': 'hi'}], deadline=Deadline(0.1))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(backup.stats.snapshot()['samples'], 0)  # No time left to fail over
+
+    def test_async_calls_share_the_deadline(self):
+        router = ProviderRouter([StubProvider('deadline-async', latency=5)])
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            asyncio.run(router.acomplete(messages=[{'role': 'user', 'content': 'hi'}], deadline=Deadline(0.1)))
+        self.assertLess(time.monotonic() - started, 1)
+
+    @override_settings(AI_RATE_LIMITS={'deadline-queue': {'MAX_IN_FLIGHT': 1, 'MAX_WAIT': 30}})
+    def test_queueing_counts_against_the_deadline(self):
+        limiter = ProviderLimiter('deadline-queue')
+        held = limiter.acquire(timeout=1)
+        try:
+            started = time.monotonic()
+            with self.assertRaises(RateLimited):
+                limiter.call(lambda: 'never', deadline=Deadline(0.1))
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            held.release()
+
+
+class AIServiceCacheTests(TestCase):
+    MESSAGES = [{'role': 'user', 'content': 'Plan a taxi app'}]
+
+    def setUp(self):
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        overrides = override_settings(AI_LOCK_DIR=lock_dir.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        response_cache.clear_memory()
+        self.addCleanup(response_cache.clear_memory)
+
+    def complete(self, *providers):
+        with mock.patch('projects.ai_service.get_router', return_value=ProviderRouter(providers)):
+            return AIService()._complete(self.MESSAGES, 0.2)
+
+    def test_answers_are_cached_under_the_model_that_answered(self):
+        def down(messages):
+            raise RuntimeError('primary down')
+
+        primary = StubProvider('primary', model='model-a', responder=down)
+        backup = StubProvider('backup', model='model-b', responder=lambda messages: 'from b')
+        self.assertEqual(self.complete(primary, backup), 'from b')
+        self.assertEqual(
+            list(AIResponseCache.objects.values_list('key', 'model')),
+            [(make_cache_key('model-b', self.MESSAGES, 0.2), 'model-b')],
+        )
+
+        # Served again while model-b may answer, but never as model-a's answer
+        self.assertEqual(self.complete(backup), 'from b')
+        self.assertEqual(self.complete(StubProvider('primary', model='model-a', responder=lambda messages: 'from a')), 'from a')
+
+    def test_failures_are_recorded_against_the_provider_tried(self):
+        def down(messages):
+            raise RuntimeError('down')
+
+        with mock.patch('projects.ai_service.metrics.record_call') as record_call, self.assertRaises(RuntimeError):
+            self.complete(StubProvider('primary', model='model-a', responder=down), StubProvider('backup', model='model-b', responder=down))
+        provider, model = record_call.call_args.args[:2]
+        self.assertEqual((provider, model), ('backup', 'model-b'))
+
+
+@override_settings(AI_METRICS={'ROLLUP_INTERVAL': 0})
+class MetricsRollupTests(TestCase):
+    def setUp(self):
+        metrics._pending.clear()
+        self.addCleanup(metrics._pending.clear)
+        # All calls in one rollup minute
+        clock = mock.patch('projects.metrics.timezone.now', return_value=timezone.now())
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_failed_flush_keeps_the_pending_totals(self):
+        metrics.record_call('p', 'm', 'blueprint', 2.0)
+        with mock.patch.object(LLMCallRollup.objects, 'create', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                metrics.flush_rollup()
+
+        metrics.record_call('p', 'm', 'blueprint', 5.0, error=RuntimeError('x'))
+        self.assertEqual(metrics.flush_rollup(), 1)
+        row = LLMCallRollup.objects.get()
+        self.assertEqual((row.calls, row.errors, row.total_seconds, row.max_seconds), (2, 1, 7.0, 5.0))
+        self.assertEqual(metrics.flush_rollup(), 0)
+
+    def test_flush_adds_to_the_minute_row(self):
+        metrics.record_call('p', 'm', 'blueprint', 1.0)
+        metrics.flush_rollup()
+        metrics.record_call('p', 'm', 'blueprint', 3.0)
+        metrics.flush_rollup()
+        row = LLMCallRollup.objects.get()
+        self.assertEqual((row.calls, row.max_seconds), (2, 3.0))
+
+    def test_default_deepseek_model_is_priced(self):
+        tokens = {'prompt': 1_000_000, 'cached': 400_000, 'completion': 1_000_000}
+        self.assertAlmostEqual(metrics.call_cost('deepseek-reasoner', tokens), 0.6 * 0.55 + 0.4 * 0.14 + 2.19)
+
+
+class BuildContextTests(TestCase):
+    REQUIREMENTS = {'intent': {'description': 'A taxi app'}, 'platform': {'targets': ['web']}, 'budget': {'amount': 5}}
+    BLUEPRINT = {'backend': {'framework': 'Django', 'database': 'PostgreSQL'}, 'frontend': {'framework': 'React'}, 'phases': []}
+
+    def test_prompt_gets_only_what_it_declares(self):
+        with self.assertNoLogs('projects.context', 'INFO'):  # Every prompt builds one: DEBUG only
+            context = build_context('doc_section.setup', self.REQUIREMENTS, self.BLUEPRINT)
+        self.assertEqual(json.loads(context.blueprint), {
+            'backend': {'framework': 'Django', 'database': 'PostgreSQL'}, 'frontend': {'framework': 'React'},
+        })
+        self.assertEqual(context.requirements, '{}')  # No tech_stack / quality answers yet
+        self.assertFalse(context.trimmed)
+        self.assertGreater(context.saved_tokens, 0)
+
+    def test_long_values_are_shortened_to_fit(self):
+        blueprint = {'overview': 'word ' * 2000, 'phases': [{'name': f'Phase {i}'} for i in range(50)]}
+        context = build_context('doc_section.overview', {}, blueprint, max_tokens=400)
+        self.assertTrue(context.trimmed)
+        self.assertLessEqual(context.tokens, 400)
+        trimmed = json.loads(context.blueprint)
+        self.assertEqual(set(trimmed), {'overview', 'phases'})  # Shortened, not dropped
+        self.assertTrue(trimmed['overview'].endswith('…'))
+        self.assertLess(len(trimmed['phases']), 50)
+
+    def test_least_important_keys_are_dropped_last(self):
+        blueprint = {key: {f'field{i}': f'value {i}' for i in range(30)} for key in ('backend', 'frontend', 'architecture')}
+        context = build_context('task_guide', {}, blueprint, max_tokens=60)
+        self.assertTrue(context.trimmed)
+        self.assertEqual(list(json.loads(context.blueprint)), ['backend'])
+
+
+class PromptRegistryTests(TestCase):
+    def test_templates_render_their_placeholders(self):
+        prompt = PromptTemplate('registry-test', 1, system="""
+            Reply as JSON: {"ok": true}
+        """, user="""
+            CONTEXT: $context
+        """)
+        self.assertEqual(prompt.fields, {'context'})
+        self.assertEqual(prompt.render(context='{"a":1}'), [
+            {'role': 'system', 'content': 'Reply as JSON: {"ok": true}'},
+            {'role': 'user', 'content': 'CONTEXT: {"a":1}'},
+        ])
+        with self.assertRaisesMessage(KeyError, 'needs: context'):
+            prompt.render()
+        with self.assertRaises(ValueError):
+            PromptTemplate('registry-test', 1, system='', user='Broken $')
+
+    def test_fingerprint_follows_text_version_and_sampling(self):
+        base = PromptTemplate('registry-test', 1, system='S', user='U $x')
+        self.assertEqual(base.fingerprint, PromptTemplate('registry-test', 1, system='  S  ', user='U $x').fingerprint)
+        for changed in (
+            PromptTemplate('registry-test', 2, system='S', user='U $x'),
+            PromptTemplate('registry-test', 1, system='S!', user='U $x'),
+            PromptTemplate('registry-test', 1, system='S', user='U $x', temperature=0.9),
+        ):
+            self.assertNotEqual(changed.fingerprint, base.fingerprint)
+
+    def test_cache_keys_change_with_the_prompt_version(self):
+        prompt = get_prompt('task_guide')
+        bumped = PromptTemplate('task_guide', prompt.version + 1, system=prompt.system, user=prompt.user.template)
+        messages = prompt.render(context='{}', task='Set up CI')
+        with mock.patch('projects.ai_service.get_router', return_value=ProviderRouter([StubProvider('p')])):
+            ai = AIService()
+            self.assertNotEqual(ai._cache_keys(messages, 0.3, prompt=prompt), ai._cache_keys(messages, 0.3, prompt=bumped))
+
+    def test_names_are_unique_and_unknown_doc_sections_fall_back(self):
+        with self.assertRaisesMessage(ValueError, 'Duplicate prompt: blueprint'):
+            register_prompt(PromptTemplate('blueprint', 1, system='S', user='U'))
+        self.assertIs(doc_section_prompt('nope'), get_prompt('doc_section.overview'))
+
+
+class PrefixCacheTests(TestCase):
+    def test_variable_data_comes_after_the_static_prefix(self):
+        for name, prompt in PROMPTS.items():
+            first = prompt.render(**{field: 'PROJECT A' for field in prompt.fields})
+            second = prompt.render(**{field: 'PROJECT B' for field in prompt.fields})
+            with self.subTest(name):
+                self.assertEqual(first[0], second[0])  # System message: byte-identical
+                self.assertTrue((first[0]['content'] + '\n' + first[1]['content']).startswith(prompt.static_prefix))
+
+    def test_context_json_is_stable_across_key_order(self):
+        answers = {'intent': {'description': 'Taxis', 'audience': 'Riders'}, 'platform': {'targets': ['web']}}
+        reordered = {'platform': {'targets': ['web']}, 'intent': {'audience': 'Riders', 'description': 'Taxis'}}
+        self.assertEqual(build_context('blueprint', answers).requirements, build_context('blueprint', reordered).requirements)
+
+    def test_cached_tokens_are_read_from_either_usage_shape(self):
+        openai = mock.Mock(prompt_tokens=1000, prompt_tokens_details=mock.Mock(cached_tokens=768))
+        deepseek = mock.Mock(spec=['prompt_tokens', 'prompt_cache_hit_tokens'], prompt_tokens=1000, prompt_cache_hit_tokens=512)
+        self.assertEqual(cached_prompt_tokens(openai), (1000, 768))
+        self.assertEqual(cached_prompt_tokens(deepseek), (1000, 512))
+        self.assertEqual(cached_prompt_tokens(None), (None, None))
+
+        stats = PrefixCacheStats()
+        stats.record('blueprint', openai)
+        stats.record('blueprint', mock.Mock(spec=['prompt_tokens'], prompt_tokens=1000))
+        self.assertEqual(stats.snapshot()['blueprint'], {
+            'calls': 2, 'calls_with_hits': 1, 'prompt_tokens': 2000, 'cached_tokens': 768, 'hit_ratio': 0.384,
+        })
+
+
+class JSONExtractorTests(TestCase):
+    SCHEMA = {'overview': str, 'phases': [dict]}
+
+    def test_skips_reasoning_fences_and_preamble(self):
+        text = '<think>Maybe {"x": 1}?</think>Sure! ```json\n{"overview": "A {braced} \\"app\\"", "phases": [{}]}\n``` {"y": 2}'
+        result = extract_json(text, self.SCHEMA)
+        self.assertEqual(result.value, {'overview': 'A {braced} "app"', 'phases': [{}]})
+        self.assertTrue(result.is_valid)
+
+    def test_truncated_output_keeps_the_partial_object(self):
+        result = extract_json('{"overview": "An app", "phases": [{"phase": 1, "tasks": ["a", "b', self.SCHEMA)
+        self.assertEqual(result.value, {'overview': 'An app', 'phases': [{'phase': 1, 'tasks': ['a', 'b']}]})
+        self.assertTrue(result.truncated)
+        self.assertFalse(result.complete)
+
+    def test_reports_missing_and_mismatched_fields(self):
+        result = extract_json('{"overview": 3}', self.SCHEMA)
+        self.assertEqual((result.missing, result.mismatched), (['phases'], ['overview']))
+        self.assertFalse(result.is_valid)
+
+    def test_malformed_members_are_skipped(self):
+        result = extract_json('{"a": 1,, "b": tru, "c": {"d": }, "e": 2,}')
+        self.assertEqual(result.value, {'a': 1, 'c': {}, 'e': 2})
+        self.assertTrue(result.complete)
+        self.assertTrue(result.errors)
+
+    def test_no_object_at_all(self):
+        for text in ('', 'I cannot help with that.', '<think>{"a": 1}</think>'):
+            result = extract_json(text)
+            self.assertIsNone(result.value)
+            self.assertFalse(result.complete)
+
+    def test_chunked_input_matches_one_shot(self):
+        text = '<think>plan</think>{"overview": "A \\u00e9 \\ud83d\\ude00", "phases": [{"n": 1}], "n": -1.5e2}'
+        extractor = JSONExtractor(schema=self.SCHEMA)
+        members = []
+        for index in range(0, len(text), 3):
+            members += extractor.feed(text[index:index + 3])
+        result = extractor.close()
+        self.assertEqual(result.value, extract_json(text, self.SCHEMA).value)
+        self.assertEqual(result.value['overview'], 'A \u00e9 \U0001F600')
+        self.assertEqual([key for key, _ in members], ['overview', 'phases', 'n'])
+
+
+@override_settings(AI_COMPRESSION={'THRESHOLD': 256})
+class CompressedFieldTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='packer')
+        self.blueprint = {'overview': 'Tasks, reminders and teams. ' * 40, 'phases': [{'phase': 1, 'name': 'MVP'}]}
+        self.project = Project.objects.create(user=self.user, name='Planner', requirements_data={'answers': {}}, blueprint_data=self.blueprint)
+        self.section = DocSection.objects.create(project=self.project, key='summary', markdown='# Summary\n' + 'Text. ' * 200, html='<p>short</p>')
+
+    def execute(self, sql, obj, params=()):
+        pk = obj._meta.pk.get_db_prep_value(obj.pk, connection)
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(table=obj._meta.db_table), [*params, pk])
+            return cursor.fetchone() if sql.startswith('SELECT') else None
+
+    def stored(self, obj, column):
+        value = self.execute(f'SELECT {column} FROM {{table}} WHERE id = %s', obj)[0]
+        return bytes(value) if isinstance(value, (bytes, memoryview)) else value
+
+    def stored_columns(self):
+        return {
+            column: self.stored(obj, column)
+            for obj, column in (
+                (self.project, 'blueprint_data'),
+                (self.project, 'requirements_data'),
+                (self.section, 'markdown'),
+                (self.section, 'html'),
+            )
+        }
+
+    def test_pack_round_trip(self):
+        self.assertEqual(pack(b'tiny', raw_header=RAW), RAW + b'tiny')
+        self.assertEqual(pack(b'{}'), b'{}')
+        self.assertEqual(pack(b'a' * 1000)[:1], ZLIB)
+        for data in (b'tiny', 'caf\u00e9 '.encode() * 300):
+            self.assertEqual(unpack(pack(data, raw_header=RAW)), data.decode())
+            self.assertEqual(unpack(pack(data)), data.decode())
+
+    def test_fields_round_trip(self):
+        project = Project.objects.get(pk=self.project.pk)
+        section = DocSection.objects.get(pk=self.section.pk)
+        self.assertEqual(project.blueprint_data, self.blueprint)
+        self.assertEqual(project.requirements_data, {'answers': {}})
+        self.assertEqual(section.markdown, self.section.markdown)
+        self.assertEqual(section.html, '<p>short</p>')
+
+        self.assertEqual(self.stored(self.project, 'blueprint_data')[:1], ZLIB)
+        self.assertEqual(self.stored(self.project, 'requirements_data'), b'{"answers": {}}')
+        self.assertEqual(self.stored(self.section, 'markdown')[:1], ZLIB)
+        self.assertEqual(self.stored(self.section, 'html'), RAW + b'<p>short</p>')
+
+    def test_legacy_text_rows_are_read_as_is(self):
+        self.execute('UPDATE {table} SET blueprint_data = %s WHERE id = %s', self.project, ['{"legacy": true}'])
+        self.execute('UPDATE {table} SET markdown = %s WHERE id = %s', self.section, ['# Old'])
+        self.assertEqual(Project.objects.get(pk=self.project.pk).blueprint_data, {'legacy': True})
+        self.assertEqual(DocSection.objects.get(pk=self.section.pk).markdown, '# Old')
+
+    def test_compress_payloads_is_idempotent(self):
+        self.execute('UPDATE {table} SET blueprint_data = %s WHERE id = %s', self.project, [json.dumps(self.blueprint)])
+        self.execute('UPDATE {table} SET html = %s WHERE id = %s', self.section, ['<p>old</p>'])
+
+        call_command('compress_payloads', stdout=io.StringIO())
+        first = self.stored_columns()
+        self.assertEqual(first['blueprint_data'][:1], ZLIB)
+        self.assertEqual(first['html'], RAW + b'<p>old</p>')
+
+        call_command('compress_payloads', stdout=io.StringIO())
+        second = self.stored_columns()
+        self.assertEqual(second, first)
+
+        project = Project.objects.get(pk=self.project.pk)
+        self.assertEqual(project.blueprint_data, self.blueprint)
+        self.assertEqual(DocSection.objects.get(pk=self.section.pk).markdown, self.section.markdown)
+
+
+class MigrationTestCase(TransactionTestCase):
+    """
+    Moves the test database to an older migration; tearDown() migrates
+    it back to the latest one.
+    """
+
+    def migrate(self, name):
+        """
+        Migrates to projects.`name`; returns the app registry of that state.
+        """
+        executor = MigrationExecutor(connection)
+        executor.migrate([('projects', name)])
+        return executor.loader.project_state([('projects', name)]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('projects'))
+        super().tearDown()
+
+
+class DocSectionMigrationTests(MigrationTestCase):
+    def test_docs_blob_becomes_one_row_per_section(self):
+        apps = self.migrate('0012_project_version')
+        user = User.objects.create_user(username='forward')
+        project = apps.get_model('projects', 'Project').objects.create(
+            user_id=user.pk, name='Forward',
+            docs_data={'overview': '# Overview', 'api': '# API'},
+            # 'api' was never rendered: its row starts without HTML and renders on first read
+            docs_html={'overview': {'key': 'k1', 'html': '<h1>Overview</h1>'}},
+        )
+        apps.get_model('projects', 'Project').objects.create(user_id=user.pk, name='No docs')
+
+        apps = self.migrate('0013_doc_section')
+        sections = apps.get_model('projects', 'DocSection').objects.order_by('key')
+        self.assertEqual(
+            [(s.project_id, s.key, s.markdown, s.html, s.html_key) for s in sections],
+            [(project.pk, 'api', '# API', '', ''), (project.pk, 'overview', '# Overview', '<h1>Overview</h1>', 'k1')],
+        )
+        self.assertEqual(sections.get(key='api').content_hash, generation.markdown_hash('# API'))
+
+
+class CompressedPayloadMigrationTests(MigrationTestCase):
+    def test_rollback_decompresses_payloads(self):
+        user = User.objects.create_user(username='rollback')
+        blueprint = {'overview': 'Tasks, reminders and teams. ' * 100}
+        project = Project.objects.create(user=user, name='Rollback', requirements_data={'answers': {'a': 1}}, blueprint_data=blueprint)
+        section = DocSection.objects.create(project=project, key='summary', markdown='# Summary\n' + 'Text. ' * 400, html='<p>short</p>')
+
+        apps = self.migrate('0013_doc_section')
+        old_project = apps.get_model('projects', 'Project').objects.get(pk=project.pk)
+        old_section = apps.get_model('projects', 'DocSection').objects.get(pk=section.pk)
+        self.assertEqual((old_project.blueprint_data, old_project.requirements_data), (blueprint, {'answers': {'a': 1}}))
+        self.assertEqual((old_section.markdown, old_section.html), (section.markdown, '<p>short</p>'))
+
+        # And on through 0013's own rollback (sections back into docs_data)
+        apps = self.migrate('0012_project_version')
+        old_project = apps.get_model('projects', 'Project').objects.get(pk=project.pk)
+        self.assertEqual(old_project.docs_data, {'summary': section.markdown})
+
+
+@override_settings(AI_SQLITE={'WRITE_RETRIES': 3, 'RETRY_BASE_DELAY': 0.01, 'RETRY_MAX_DELAY': 0.02})
+class RetryWritesTests(TransactionTestCase):
+    def flaky(self, failures, error='database is locked'):
+        calls = []
+
+        def write():
+            calls.append(connection.in_atomic_block)
+            if len(calls) <= failures:
+                raise OperationalError(error)
+            return 'written'
+        return write, calls
+
+    def test_retries_until_the_lock_clears(self):
+        write, calls = self.flaky(2)
+        with self.assertLogs('projects.sqlite', 'WARNING') as logs:
+            self.assertEqual(retry_writes(write)(), 'written')
+        self.assertEqual(calls, [True, True, True])
+        self.assertEqual(len(logs.records), 2)
+
+    def test_gives_up_after_write_retries(self):
+        write, calls = self.flaky(10)
+        with self.assertLogs('projects.sqlite', 'WARNING'), self.assertRaises(OperationalError):
+            retry_writes(write)()
+        self.assertEqual(len(calls), 4)
+
+    def test_other_errors_are_not_retried(self):
+        write, calls = self.flaky(1, error='no such table: nope')
+        with self.assertRaises(OperationalError):
+            retry_writes(write)()
+        self.assertEqual(len(calls), 1)
+
+    def test_runs_once_inside_an_outer_transaction(self):
+        write, calls = self.flaky(1)
+        with self.assertRaises(OperationalError), transaction.atomic():
+            retry_writes(write)()
+        self.assertEqual(len(calls), 1)
+
+    @override_settings(AI_SQLITE={'WRITE_RETRIES': 50, 'RETRY_BASE_DELAY': 0.01, 'RETRY_MAX_DELAY': 0.02})
+    def test_waits_out_a_held_write_lock(self):
+        user = User.objects.create_user(username='locker')
+        project = Project.objects.create(user=user, name='Locked')
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    Project.objects.filter(pk=project.pk).update(name='Held')
+                    locked.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        locked.wait(5)
+        threading.Timer(0.2, release.set).start()
+
+        @retry_writes
+        def rename():
+            return Project.objects.filter(pk=project.pk).update(name='Renamed')
+
+        with self.assertLogs('projects.sqlite', 'WARNING'):
+            self.assertEqual(rename(), 1)
+        holder.join(5)
+        project.refresh_from_db()
+        self.assertEqual(project.name, 'Renamed')
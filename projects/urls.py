@@ -1,18 +1,29 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Under ASGI, the AI views can await the provider instead of holding a thread
+ai_views = async_views if getattr(settings, 'AI_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('create/', views.create_project, name='create_project'),
+    path('ai/pool/', views.ai_pool_stats, name='ai_pool_stats'),
+    path('ai/providers/', views.ai_provider_stats, name='ai_provider_stats'),
+    path('ai/context/', views.ai_context_stats, name='ai_context_stats'),
+    path('ai/prompt-cache/', views.ai_prompt_cache_stats, name='ai_prompt_cache_stats'),
     path('<uuid:pk>/', views.project_detail, name='project_detail'),
     path('<uuid:pk>/delete/', views.delete_project, name='delete_project'),
     path('<uuid:pk>/duplicate/', views.duplicate_project_view, name='duplicate_project'),
     path('<uuid:pk>/flow-debug/', views.flow_debug, name='flow_debug'),
     path('<uuid:pk>/wizard/', views.project_wizard, name='project_wizard'),
     path('<uuid:pk>/summary/', views.project_summary, name='project_summary'),
-    path('<uuid:pk>/generate/', views.project_generate, name='project_generate'),
+    path('<uuid:pk>/generate/', ai_views.project_generate, name='project_generate'),
+    path('<uuid:pk>/generate/stream/', ai_views.project_generate_stream, name='project_generate_stream'),
     path('<uuid:pk>/blueprint/', views.project_blueprint, name='project_blueprint'),
     path('<uuid:pk>/docs/', views.project_docs_shell, name='project_docs'),
-    path('<uuid:pk>/get_doc_section/', views.get_doc_section, name='get_doc_section'),
-    path('<uuid:pk>/get_task_help/', views.get_task_help, name='get_task_help'),
+    path('<uuid:pk>/get_doc_section/', ai_views.get_doc_section, name='get_doc_section'),
+    path('<uuid:pk>/generate_all_docs/', ai_views.generate_all_docs, name='generate_all_docs'),
+    path('<uuid:pk>/get_task_help/', ai_views.get_task_help, name='get_task_help'),
+    path('<uuid:pk>/generate_task_guides/', views.generate_task_guides, name='generate_task_guides'),
 ]
\ No newline at end of file
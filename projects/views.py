@@ -1,16 +1,30 @@
+import json
+import logging
 import uuid
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .models import Project
 from .forms import ProjectForm
-from .engine import FlowEngine
+from .engine import ConflictError, FlowEngine
 from .questions import QUESTION_BANK
-from .ai_service import AIService
+from .models import AIJob
+from .streaming import blueprint_event_stream, doc_sections_event_stream
+from . import generation, jobs
+from .llm_clients import pool_stats
+from .providers import get_router
+from .context import savings as context_savings
+from .prompts import prefix_cache
+from .pagination import InvalidCursor, keyset_paginate
+from . import metrics
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.urls import reverse
 from django.views.decorators.http import require_POST
 
+logger = logging.getLogger(__name__)
 
-from django.shortcuts import redirect
 
 def index(request):
     """
@@ -80,15 +94,30 @@ def get_next_action(project):
 
 # --- VIEWS ---
 
+DASHBOARD_PAGE_SIZE = 24
+
 @login_required
 def dashboard(request):
-    projects = Project.objects.filter(user=request.user)
-    
+    user_projects = Project.objects.filter(user=request.user)
+    try:
+        projects = keyset_paginate(user_projects.without_blobs(), request.GET.get('cursor'), DASHBOARD_PAGE_SIZE)
+    except InvalidCursor:
+        return redirect('dashboard')
+
     # IMPORTANT: Manually attach the action dict to each object
     for p in projects:
         p.action = get_next_action(p)
         
-    return render(request, 'projects/dashboard.html', {'projects': projects})
+    # The total is only shown on the first page, and only counted when
+    # that page isn't already all of them: deeper pages stay one seek
+    project_count = None
+    if not request.GET.get('cursor'):
+        project_count = user_projects.count() if projects.next_cursor else len(projects)
+
+    return render(request, 'projects/dashboard.html', {
+        'projects': projects,
+        'project_count': project_count,
+    })
 
 @login_required
 def create_project(request):
@@ -121,12 +150,14 @@ def delete_project(request, pk):
 @login_required
 def duplicate_project_view(request, pk):
     original = get_object_or_404(Project, pk=pk, user=request.user)
+    source_id = original.pk
     original.pk = None
     original.id = uuid.uuid4()
     original.name = f"Copy of {original.name}"
     original.status = 'draft'
     original.current_phase = 0
     original.save()
+    generation.copy_doc_sections(source_id, original)
     messages.success(request, "Project duplicated.")
     return redirect('dashboard')
 
@@ -157,16 +188,16 @@ def project_wizard(request, pk):
             
             answers[qid] = val
         
-        # --- DEBUG PRINT ---
-        # Look at your terminal when you click Next. It should show the data.
-        print(f"DEBUG: Saving Stage: {current_stage}")
-        print(f"DEBUG: Data Received: {answers}")
-        # -------------------
+        logger.debug(f"Saving stage {current_stage}: {answers}")
 
         try:
-            engine.submit_answer(current_stage, answers)
+            engine.submit_answer(current_stage, answers, expected_version=request.POST.get('version') or None)
+            generation.discard_speculation(project)
             messages.success(request, f"Saved {current_stage}!") # Visual feedback
             return redirect('project_wizard', pk=pk)
+        except ConflictError as e:
+            messages.error(request, str(e))
+            return redirect('project_wizard', pk=pk)  # Reload the current answers
         except ValueError as e:
             messages.error(request, str(e))
 
@@ -183,17 +214,18 @@ def project_summary(request, pk):
     
     if request.method == 'POST':
         try:
-            engine.lock_requirements()
+            engine.lock_requirements(expected_version=request.POST.get('version') or None)
+            jobs.speculate_blueprint(project)  # Start on the blueprint while the user reads on
             messages.success(request, "Locked. Ready for AI.")
             return redirect('project_generate', pk=pk) # Direct to AI page
+        except ConflictError as e:
+            messages.error(request, str(e))
+            return redirect('project_summary', pk=pk)
         except ValueError as e:
             messages.error(request, str(e))
     
     return render(request, 'projects/summary.html', {'project': project, 'summary': engine.get_summary()})
 
-# ... (Keep existing imports)
-from .ai_service import AIService
-
 @login_required
 def project_generate(request, pk):
     """
@@ -202,29 +234,52 @@ def project_generate(request, pk):
     project = get_object_or_404(Project, pk=pk, user=request.user)
     
     if request.method == 'POST':
-        # 1. Initialize Service
-        ai = AIService()
-        
-        # 2. Get User Answers
-        requirements = project.requirements_data.get('answers', {})
-        
-        # 3. Call DeepSeek (Synchronous)
-        blueprint = ai.generate_blueprint(requirements)
+        # 1. Background mode: queue it and let the page poll the job
+        #    (unless the speculative generation already finished)
+        if jobs.background_jobs_enabled():
+            if generation.adopt_speculative_blueprint(project, wait=False):
+                messages.success(request, "Blueprint Architected Successfully!")
+                return redirect('project_blueprint', pk=pk)
+            job = jobs.enqueue(project, 'blueprint')
+            return redirect(f"{reverse('project_generate', args=[pk])}?job={job.pk}")
+
+        # 2. Call DeepSeek (Synchronous), saves on success
+        blueprint = generation.generate_blueprint(project)
         
+        if blueprint.get('error') == generation.BLUEPRINT_CONFLICT:
+            messages.error(request, blueprint['raw'])
+            return redirect('project_summary', pk=pk)
         if 'error' in blueprint:
             messages.error(request, f"AI Error: {blueprint['raw']}")
             return redirect('project_generate', pk=pk)
-
-        # 4. Save Result
-        project.blueprint_data = blueprint
-        project.status = 'blueprint_ready'
-        project.current_phase = 7
-        project.save()
         
         messages.success(request, "Blueprint Architected Successfully!")
         return redirect('project_blueprint', pk=pk)
-        
-    return render(request, 'projects/generate.html', {'project': project})
+
+    # Page reload while a queued job is running -> keep polling it
+    job = None
+    if request.GET.get('job'):
+        job = AIJob.objects.filter(pk=request.GET['job'], project=project).first()
+
+    return render(request, 'projects/generate.html', {
+        'project': project,
+        'job': jobs.describe_job(job) if job else None,
+        'background_jobs': jobs.background_jobs_enabled(),
+    })
+
+
+@login_required
+@require_POST
+def project_generate_stream(request, pk):
+    """
+    Phase 6 (streaming): pushes each finished blueprint section as an
+    SSE event so generate.html can render while the model is still writing.
+    """
+    project = get_object_or_404(Project, pk=pk, user=request.user)
+    response = StreamingHttpResponse(blueprint_event_stream(project), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+    return response
     
 @login_required
 def project_blueprint(request, pk):
@@ -256,20 +311,11 @@ def project_implementation(request, pk):
     
     return render(request, 'projects/implementation.html', {
         'project': project,
-        'phases': phases
+        'phases': phases,
+        # Already generated guides render instantly; the rest come in one batch
+        'guides': generation.stored_task_guides(project),
     })
 
-import json
-import logging
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
-from django.contrib.auth.decorators import login_required
-from django.shortcuts import get_object_or_404
-from .models import Project
-from .ai_service import AIService
-
-logger = logging.getLogger(__name__)
-
 @login_required
 @require_POST
 def get_task_help(request, pk):
@@ -286,95 +332,56 @@ def get_task_help(request, pk):
         except json.JSONDecodeError:
             return JsonResponse({'content': 'Error: Invalid JSON body'}, status=400)
 
-        # 2. Prepare Context (Handle missing keys gracefully)
-        blueprint = project.blueprint_data or {}
-        backend = blueprint.get('backend', {})
-        
-        # Force SQLite3 context if missing, since you explicitly requested it
-        if not backend.get('database'):
-            backend['database'] = "SQLite3"
-
-        project_context = {
-            'architecture': blueprint.get('architecture', {}),
-            'frontend': blueprint.get('frontend', {}),
-            'backend': backend,
-        }
+        # 2. Already generated for this blueprint (e.g. by the batch)
+        stored = generation.stored_task_guides(project, [task_name])
+        if task_name in stored:
+            return JsonResponse({'content': stored[task_name]})
+
+        # 3. Background mode: return a job for the page to poll
+        if jobs.background_jobs_enabled():
+            job = jobs.enqueue(project, 'task_guide', {'task': task_name})
+            return JsonResponse(jobs.describe_job(job), status=202)
 
-        # 3. Call AI
-        ai = AIService()
-        help_content = ai.generate_task_guide(
-            project_context=project_context,
-            current_task=task_name
-        )
+        # 4. Call AI (context built from the blueprint, missing keys handled)
+        help_content = generation.generate_task_guide(project, task_name)
 
         return JsonResponse({'content': help_content})
 
     except Exception as e:
         # Log the full error to your terminal for debugging
         logger.error(f"Task Generation Error: {str(e)}")
-        print(f"❌ SERVER ERROR: {str(e)}") # Print to terminal
         
         # Return a clean JSON error to the frontend
         return JsonResponse({
             'content': f"## System Error\n\nThe server encountered an error while contacting DeepSeek:\n\n`{str(e)}`\n\nPlease check your terminal for more details."
         }, status=500)
 
-# ... imports ...
-import markdown
 
 @login_required
-def project_docs(request, pk):
+@require_POST
+def generate_task_guides(request, pk):
     """
-    Phase 7: Strategic Documentation.
-    Checks DB first. If empty, generates via AI and saves.
+    AJAX Endpoint: guides for every task of a phase ({"phase": 2}) or of
+    the whole blueprint (empty body), in one round-trip.
+    Returns {"guides": {task: markdown}, "errors": {task: message}}, or
+    (background mode) one job to poll for the same result.
     """
     project = get_object_or_404(Project, pk=pk, user=request.user)
-    
-    # 1. Check if user requested a FORCE REGENERATE (via button)
-    force_regen = request.POST.get('regenerate') == 'true'
-
-    # 2. If docs exist and we aren't forcing, LOAD from DB
-    if project.documentation_md and not force_regen:
-        html_content = markdown.markdown(project.documentation_md, extensions=['fenced_code', 'tables'])
-        return render(request, 'projects/docs.html', {
-            'project': project,
-            'html_content': html_content,
-            'raw_markdown': project.documentation_md
-        })
+    try:
+        data = json.loads(request.body or '{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
 
-    # 3. Otherwise, GENERATE new docs
-    if request.method == 'POST':
-        ai = AIService()
-        
-        # Merge context
-        blueprint = project.blueprint_data or {}
-        full_context = {
-            'blueprint': blueprint,
-            'original_requirements': project.requirements_data.get('answers', {})
-        }
-        
-        # Call AI
-        md_content = ai.generate_project_docs(full_context)
-        
-        # SAVE to Database
-        project.documentation_md = md_content
-        project.save()
-        
-        # Render
-        html_content = markdown.markdown(md_content, extensions=['fenced_code', 'tables'])
-        return render(request, 'projects/docs.html', {
-            'project': project,
-            'html_content': html_content,
-            'raw_markdown': md_content
-        })
-        
-    # 4. If GET and no docs exist, show "Ready to Generate" screen
-    return render(request, 'projects/docs_start.html', {'project': project})
+    tasks = generation.blueprint_tasks(project, data.get('phase'))
+    stored = generation.stored_task_guides(project, tasks)
 
+    if jobs.background_jobs_enabled() and len(stored) < len(tasks):
+        job = jobs.enqueue(project, 'task_guides', {'phase': data.get('phase')})
+        return JsonResponse(jobs.describe_job(job), status=202)
+
+    guides, errors = generation.generate_task_guides(project, tasks)
+    return JsonResponse({'guides': guides, 'errors': errors})
 
-# ... imports ...
-import markdown
-# projects/views.py
 
 @login_required
 @require_POST
@@ -386,35 +393,20 @@ def get_doc_section(request, pk):
         section_key = data.get('section')
         force_regen = data.get('regenerate', False)
         
-        current_docs = project.docs_data or {}
-        
-        # 1. Determine Content (Load or Generate)
-        if section_key in current_docs and not force_regen:
-            md_content = current_docs[section_key]
-        else:
-            # Generate new
-            print(f"--- 🧠 GENERATING SECTION: {section_key} ---") # Debug Print
-            ai = AIService()
-            context = {
-                'blueprint': project.blueprint_data,
-                'requirements': project.requirements_data.get('answers', {})
-            }
-            md_content = ai.generate_doc_section(context, section_key)
-            
-            # Debug: Print first 100 chars to terminal to prove it exists
-            print(f"--- ✅ RESULT: {md_content[:100]}... ---")
-            
-            current_docs[section_key] = md_content
-            project.docs_data = current_docs
-            project.save()
+        # Only this section's row is read
+        md_content = None if force_regen else generation.stored_doc_section(project.pk, section_key)
 
-        # 2. Convert to HTML (With Safety Check)
-        html_content = markdown.markdown(md_content, extensions=['fenced_code', 'tables'])
-        
-        # FIX: If HTML is empty or just whitespace, fallback to pre-formatted text
-        # This handles cases where AI output only invisible tags
-        if not html_content.strip():
-            html_content = f"<pre style='white-space: pre-wrap;'>{md_content}</pre>"
+        # 1. Background mode: queue missing sections, page polls the job
+        if md_content is None and jobs.background_jobs_enabled():
+            job = jobs.enqueue(project, 'doc_section', {'section': section_key, 'regenerate': force_regen})
+            return JsonResponse(jobs.describe_job(job), status=202)
+
+        # 2. Determine Content (Load or Generate)
+        if md_content is None:
+            md_content = generation.load_doc_section(project, section_key, regenerate=force_regen)
+
+        # 3. Stored HTML (rendered once, when the section was saved)
+        html_content = generation.doc_section_html(project, section_key, md_content)
 
         return JsonResponse({
             'markdown': md_content,
@@ -422,9 +414,88 @@ def get_doc_section(request, pk):
         })
 
     except Exception as e:
-        print(f"❌ ERROR: {str(e)}")
+        logger.error(f"Doc section error: {str(e)}")
         return JsonResponse({'error': str(e)}, status=500)
 
+
+@login_required
+@require_POST
+def generate_all_docs(request, pk):
+    """
+    Generates every missing doc section at once.
+    Streams per-section progress as SSE, or (background mode) queues one
+    job per section and returns them for polling.
+    """
+    project = get_object_or_404(Project, pk=pk, user=request.user)
+    try:
+        data = json.loads(request.body or '{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+
+    regenerate = bool(data.get('regenerate', False))
+    section_keys = generation.missing_doc_sections(project, regenerate=regenerate)
+
+    if jobs.background_jobs_enabled():
+        queued = {
+            key: jobs.describe_job(jobs.enqueue(project, 'doc_section', {'section': key, 'regenerate': regenerate}))
+            for key in section_keys
+        }
+        return JsonResponse({'jobs': queued}, status=202)
+
+    response = StreamingHttpResponse(
+        doc_sections_event_stream(project, section_keys, regenerate=regenerate),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@staff_member_required
+def ai_pool_stats(request):
+    """
+    Connection-pool metrics for the shared AI clients (staff only).
+    """
+    return JsonResponse(pool_stats())
+
+
+@staff_member_required
+def ai_provider_stats(request):
+    """
+    Rolling latency / error stats the router uses to rank providers (staff only).
+    """
+    return JsonResponse(get_router().stats())
+
+
+@staff_member_required
+def ai_context_stats(request):
+    """
+    Input tokens sent vs. the old full-context prompts, per prompt type (staff only).
+    """
+    return JsonResponse(context_savings.snapshot())
+
+
+@staff_member_required
+def ai_prompt_cache_stats(request):
+    """
+    Provider-side prompt prefix cache hit ratios per prompt (staff only).
+    """
+    return JsonResponse(prefix_cache.snapshot())
+
+
+def llm_metrics(request):
+    """
+    LLM call metrics in Prometheus text format.
+    Readable by staff, or by a scraper sending `Authorization: Bearer <AI_METRICS['TOKEN']>`.
+    """
+    token = metrics.metrics_settings()['TOKEN']
+    authorized = request.user.is_staff or (
+        token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    )
+    if not authorized:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
         
 @login_required
 def project_docs_shell(request, pk):